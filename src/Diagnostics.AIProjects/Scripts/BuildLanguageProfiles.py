@@ -0,0 +1,76 @@
+"""
+Builds SearchAPI/SearchModule/LanguageProfiles.json, the character trigram profiles used to detect
+english queries that don't need translation. The profiles are learnt from gettext catalogs (.mo files),
+which carry english source strings (msgid) with their translations (msgstr) in many languages.
+
+Usage: python BuildLanguageProfiles.py <output file> <folder with .mo files> [<folder> ...]
+e.g. python BuildLanguageProfiles.py ../SearchAPI/SearchModule/LanguageProfiles.json /usr/share/locale
+"""
+import os, sys, re, json, math, gettext, unicodedata
+from collections import Counter, defaultdict
+
+# Latin script languages, anything in another script is not ascii and always gets translated
+languages = ["en", "es", "fr", "de", "it", "pt", "nl", "sv", "da", "nb", "pl", "ro", "tr", "id", "vi", "cs", "hu", "fi", "ca", "sk", "hr", "sl", "gl", "et", "lt"]
+profileSize = 1000
+
+# Must match normalizeText in TranslationProvider.py
+def normalizeText(text):
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return " ".join(re.sub(r"[^a-z]+", " ", text).split())
+
+def getTrigrams(text):
+    for word in text.split():
+        word = " " + word + " "
+        for i in range(len(word)-2):
+            yield word[i:i+3]
+
+# Strips printf/format placeholders, markup and accelerator keys from catalog strings
+def cleanMessage(message):
+    return re.sub(r"%[-#0-9.]*[a-zA-Z]|\{[^}]*\}|<[^>]*>|[&_~]", "", message)
+
+def readCatalogs(folders):
+    texts = defaultdict(set)
+    for root, dirs, files in [x for folder in folders for x in os.walk(folder)]:
+        if os.path.basename(root) != "LC_MESSAGES":
+            continue
+        language = os.path.basename(os.path.dirname(root)).split("_")[0].split("@")[0]
+        for f in files:
+            if not f.endswith(".mo"):
+                continue
+            try:
+                with open(os.path.join(root, f), "rb") as fp:
+                    catalog = gettext.GNUTranslations(fp)._catalog
+            except Exception:
+                continue
+            for msgid, msgstr in catalog.items():
+                msgid = msgid[0] if isinstance(msgid, tuple) else msgid
+                if not msgid or not msgstr or not isinstance(msgstr, str):
+                    continue
+                texts["en"].add(msgid)
+                if language in languages and msgstr != msgid:
+                    texts[language].add(msgstr)
+    return texts
+
+def buildProfiles(texts):
+    profiles = {}
+    for language in languages:
+        counts = Counter(g for text in texts.get(language, []) for g in getTrigrams(normalizeText(cleanMessage(text))))
+        if not counts:
+            continue
+        total = sum(counts.values())
+        top = counts.most_common(profileSize)
+        profiles[language] = {
+            "trigrams": {g: round(math.log(n/total), 3) for g, n in top},
+            "unknown": round(math.log(top[-1][1]/total) - 1, 3)
+        }
+    return profiles
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    output = sys.argv[1]
+    profiles = buildProfiles(readCatalogs(sys.argv[2:]))
+    with open(output, "w") as fp:
+        json.dump({"profileSize": profileSize, "languages": profiles}, fp, separators=(",", ":"), sort_keys=True)
+    print("Wrote profiles for {0} languages to {1}".format(len(profiles), output))
@@ -0,0 +1,68 @@
+"""
+Local stand-in for the LUIS v3 prediction endpoint, for testing and benchmarking the search service
+without calling LUIS. Point the service at it with LUIS_ENDPOINT=http://localhost:<port>.
+
+Usage: python FakeLuisEndpoint.py [--port 8020] [--delay 0.2] [--failure-rate 0.1] [--intents intents.json]
+The intents file maps a word to the intent scores returned for queries containing it, e.g.
+{"slow": {"PerfAnalysis": 0.82}, "certificate": {"SSLCertificate": 0.76}}
+"""
+import json, time, random, argparse, urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+defaultIntents = {
+    "slow": {"PerfAnalysis": 0.82},
+    "cpu": {"HighCPU": 0.77},
+    "memory": {"MemoryAnalysis": 0.74},
+    "certificate": {"SSLCertificate": 0.76},
+    "ssl": {"SSLCertificate": 0.71},
+    "restart": {"AppRestarts": 0.69},
+    "500": {"HttpServerErrors": 0.66}
+}
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def createHandler(intents, delay, failureRate):
+    class FakeLuisHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            params = urllib.parse.parse_qs(url.query)
+            if not url.path.endswith("/predict") or "subscription-key" not in params:
+                self.send_error(404)
+                return
+            if delay:
+                time.sleep(delay)
+            if failureRate and random.random() < failureRate:
+                self.send_error(503)
+                return
+            query = params.get("query", [""])[0]
+            scores = {"None": 0.05}
+            for word in query.lower().split():
+                for intent, score in intents.get(word, {}).items():
+                    scores[intent] = max(scores.get(intent, 0), score)
+            body = json.dumps({"query": query, "prediction": {"topIntent": max(scores, key=scores.get), "intents": {intent: {"score": score} for intent, score in scores.items()}}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return FakeLuisHandler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake LUIS prediction endpoint")
+    parser.add_argument("--port", type=int, default=8020)
+    parser.add_argument("--delay", type=float, default=0, help="Seconds to wait before answering")
+    parser.add_argument("--failure-rate", type=float, default=0, help="Fraction of requests answered with 503")
+    parser.add_argument("--intents", default=None, help="Json file mapping words to intent scores")
+    args = parser.parse_args()
+    intents = defaultIntents
+    if args.intents:
+        with open(args.intents, "r") as fp:
+            intents = json.loads(fp.read())
+    server = ThreadingHTTPServer(("localhost", args.port), createHandler(intents, args.delay, args.failure_rate))
+    print("Fake LUIS endpoint listening on http://localhost:{0}".format(args.port))
+    server.serve_forever()
@@ -0,0 +1,119 @@
+"""
+Stress test for the model snapshots of the search service. Reader threads pin the current snapshot of a
+product and query it while a writer keeps publishing new models and evicting them, the way the model watcher
+and /freeModel do. Fails when a reader sees a missing, closed or mismatched model, when a model is closed
+more than once, or when snapshots are left open after the readers are done.
+
+Usage: python ModelSnapshotStressTest.py [--readers 16] [--refreshes 2000] [--products 3] [--evict-every 50]
+"""
+import os, sys, time, random, argparse, threading, importlib.util
+import numpy as np
+
+# Loaded from its file so the test doesn't start the Flask app that importing SearchModule does
+registryPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SearchAPI", "SearchModule", "ModelRegistry.py")
+spec = importlib.util.spec_from_file_location("ModelRegistry", registryPath)
+ModelRegistry = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ModelRegistry)
+
+class FakeModel:
+    def __init__(self, productId, version):
+        self.productId = productId
+        self.trainingId = f"{productId}-{version}"
+        self.packagePath = None
+        self.vectors = np.full((64, 32), version, dtype=np.float32)
+        self.closed = 0
+
+    def queryDetectors(self, query):
+        if self.closed:
+            raise Exception(f"Queried closed model {self.trainingId}")
+        scores = self.vectors.sum(axis=1)
+        # Every row was written with the version, a torn model would show up as a mix
+        if not np.all(scores == scores[0]):
+            raise Exception(f"Inconsistent model {self.trainingId}")
+        return {"query": query, "results": [{"detector": self.trainingId, "score": float(scores[0])}]}
+
+def run(readers, refreshes, products, evictEvery):
+    registry = ModelRegistry.ModelRegistry({})
+    productIds = [str(1000+i) for i in range(products)]
+    published = []
+    errors = []
+    counters = {"queries": 0, "misses": 0}
+    lock = threading.Lock()
+
+    def onClose(productId, model):
+        model.closed += 1
+    registry.onClose = onClose
+
+    for productId in productIds:
+        model = FakeModel(productId, 0)
+        published.append(model)
+        registry.put(productId, model)
+
+    done = threading.Event()
+    def reader():
+        queries = misses = 0
+        while not done.is_set():
+            productId = random.choice(productIds)
+            snapshot = registry.acquire(productId)
+            if not snapshot:
+                misses += 1
+                continue
+            try:
+                if snapshot.model is None or snapshot.model.trainingId != snapshot.trainingId:
+                    raise Exception(f"Snapshot {snapshot.trainingId} doesn't match its model")
+                snapshot.model.queryDetectors("app is slow")
+                # Hold it across a few switches now and then
+                if random.random() < 0.01:
+                    time.sleep(0.005)
+                snapshot.model.queryDetectors("high cpu")
+                queries += 2
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+            finally:
+                snapshot.release()
+        with lock:
+            counters["queries"] += queries
+            counters["misses"] += misses
+
+    threads = [threading.Thread(target=reader) for i in range(readers)]
+    startTime = time.time()
+    for thread in threads:
+        thread.start()
+    for i in range(1, refreshes+1):
+        productId = productIds[i % len(productIds)]
+        if evictEvery and i % evictEvery == 0:
+            registry.evict(productId)
+            continue
+        model = FakeModel(productId, i)
+        published.append(model)
+        registry.put(productId, model)
+    done.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - startTime
+
+    stats = registry.stats()
+    current = set([registry.peek(productId).trainingId for productId in registry.keys()])
+    for model in published:
+        expected = 0 if model.trainingId in current else 1
+        if model.closed != expected:
+            errors.append(f"Model {model.trainingId} was closed {model.closed} times, expected {expected}")
+    if stats["retiredSnapshots"]:
+        errors.append(f"{stats['retiredSnapshots']} retired snapshots are still open")
+    print(f"{counters['queries']} queries and {counters['misses']} misses by {readers} readers over {refreshes} refreshes in {elapsed:.2f}s")
+    print(f"{len(published)} models published, {stats['snapshotsClosed']} closed, {len(current)} current")
+    for error in errors[:20]:
+        print("ERROR", error)
+    return not errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--refreshes", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--evict-every", type=int, default=50)
+    args = parser.parse_args()
+    passed = run(args.readers, args.refreshes, args.products, args.evict_every)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,131 @@
+"""
+Benchmark of the dense and sparse TF-IDF similarity indices of the search service on synthetic corpora.
+Every corpus is a set of short titles over a Zipf distributed vocabulary, like the case and StackOverflow
+titles of m2. Both indices are stored the way TfIdfTrainer saves them, the dense docs x features float32
+array and the column wise sparse matrix as its data, indices and indptr arrays, and queried with the same
+product TfIdfSearchModel.getSimilarities runs. Reports the size, the load time, the query latency for single
+queries and batches, and which index the trainer would pick.
+
+Usage: python SimilarityIndexBenchmark.py [--corpora 2000x3000,20000x15000,50000x30000] [--queries 200]
+       [--batch 16] [--doc-length 8] [--max-dense-mb 1024] [--mmap]
+"""
+import os, sys, time, shutil, argparse, tempfile
+import numpy as np
+from scipy import sparse
+
+# Defaults of TrainingConfig.sparseIndexMaxDensity and sparseIndexMinSize, same rule as TfIdfTrainer.trainIndex
+sparseIndexMaxDensity = 0.05
+sparseIndexMinSize = 1 << 20
+
+def makeCorpus(numDocs, numFeatures, docLength, rng):
+    # Feature ids drawn from a Zipf distribution, rarer features get larger idf weights
+    ranks = np.arange(1, numFeatures+1)
+    probabilities = 1./ranks
+    probabilities /= probabilities.sum()
+    idfs = np.log2(1./probabilities).astype(np.float32)
+    lengths = np.maximum(1, rng.poisson(docLength, numDocs))
+    rows = np.repeat(np.arange(numDocs), lengths)
+    cols = rng.choice(numFeatures, size=lengths.sum(), p=probabilities)
+    matrix = sparse.csr_matrix((idfs[cols], (rows, cols)), shape=(numDocs, numFeatures), dtype=np.float32)
+    matrix.sum_duplicates()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    return sparse.diags(1./np.maximum(norms, 1e-12)).dot(matrix).tocsr().astype(np.float32), probabilities
+
+def makeQueries(count, numFeatures, probabilities, rng):
+    lengths = np.maximum(1, rng.poisson(4, count))
+    rows = np.repeat(np.arange(count), lengths)
+    cols = rng.choice(numFeatures, size=lengths.sum(), p=probabilities)
+    queries = sparse.csr_matrix((np.ones(len(cols), dtype=np.float32), (rows, cols)), shape=(count, numFeatures))
+    queries.sum_duplicates()
+    return queries
+
+def saveDense(matrix, folder):
+    np.save(os.path.join(folder, "index.npy"), matrix.toarray())
+
+def loadDense(folder, mmapMode):
+    return np.load(os.path.join(folder, "index.npy"), mmap_mode=mmapMode)
+
+def saveSparse(matrix, folder):
+    matrix = matrix.tocsc()
+    for name in ["data", "indices", "indptr"]:
+        np.save(os.path.join(folder, "index.{0}.npy".format(name)), getattr(matrix, name))
+    np.save(os.path.join(folder, "index.shape.npy"), np.array(matrix.shape))
+
+def loadSparse(folder, mmapMode):
+    arrays = [np.load(os.path.join(folder, "index.{0}.npy".format(name)), mmap_mode=mmapMode) for name in ["data", "indices", "indptr"]]
+    shape = tuple(np.load(os.path.join(folder, "index.shape.npy")))
+    return sparse.csc_matrix(tuple(arrays), shape=shape, copy=False)
+
+# Same products as TfIdfSearchModel.getSimilarities
+def score(queryMatrix, index):
+    if sparse.issparse(index):
+        return queryMatrix.dot(index.T).toarray()
+    cols = np.unique(queryMatrix.indices)
+    return np.asarray(index[:, cols].dot(queryMatrix[:, cols].T.toarray()).T)
+
+def folderSize(folder):
+    return sum([os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)])
+
+def indexBytes(index):
+    if sparse.issparse(index):
+        return index.data.nbytes + index.indices.nbytes + index.indptr.nbytes
+    return index.nbytes
+
+def timeQueries(index, queries, batch):
+    startTime = time.time()
+    for i in range(queries.shape[0]):
+        score(queries[i], index)
+    single = (time.time() - startTime)/queries.shape[0]
+    startTime = time.time()
+    batches = 0
+    for i in range(0, queries.shape[0], batch):
+        score(queries[i:i+batch], index)
+        batches += 1
+    return single, (time.time() - startTime)/batches
+
+def run(corpora, numQueries, batch, docLength, maxDenseMb, mmapMode):
+    rng = np.random.default_rng(0)
+    mismatches = 0
+    print("{0:>14} {1:>8} {2:>6} {3:>7} {4:>10} {5:>10} {6:>12} {7:>12}".format("corpus", "density", "auto", "index", "size MB", "load ms", "single ms", "batch ms"))
+    for numDocs, numFeatures in corpora:
+        matrix, probabilities = makeCorpus(numDocs, numFeatures, docLength, rng)
+        queries = makeQueries(numQueries, numFeatures, probabilities, rng)
+        density = matrix.nnz/float(numDocs*numFeatures)
+        denseSize = 4*numDocs*numFeatures
+        auto = "sparse" if density <= sparseIndexMaxDensity and denseSize >= sparseIndexMinSize else "dense"
+        results = {}
+        for indexType, save, load in [("dense", saveDense, loadDense), ("sparse", saveSparse, loadSparse)]:
+            label = "{0}x{1}".format(numDocs, numFeatures)
+            if indexType == "dense" and denseSize > maxDenseMb*(1 << 20):
+                print("{0:>14} {1:>8.5f} {2:>6} {3:>7} {4:>10.1f} {5:>10} {6:>12} {7:>12}".format(label, density, auto, indexType, denseSize/float(1 << 20), "skipped", "-", "-"))
+                continue
+            folder = tempfile.mkdtemp(prefix="indexbenchmark-")
+            try:
+                save(matrix, folder)
+                startTime = time.time()
+                index = load(folder, mmapMode)
+                loadTime = time.time() - startTime
+                single, batched = timeQueries(index, queries, batch)
+                results[indexType] = score(queries, index)
+                size = (folderSize(folder) if mmapMode else indexBytes(index))/float(1 << 20)
+                print("{0:>14} {1:>8.5f} {2:>6} {3:>7} {4:>10.1f} {5:>10.1f} {6:>12.3f} {7:>12.3f}".format(label, density, auto, indexType, size, loadTime*1000, single*1000, batched*1000))
+                del index
+            finally:
+                shutil.rmtree(folder, True)
+        if len(results) == 2 and not np.allclose(results["dense"], results["sparse"], atol=1e-5):
+            mismatches += 1
+            print("ERROR dense and sparse scores differ for {0}x{1}".format(numDocs, numFeatures))
+    return not mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpora", default="2000x3000,20000x15000,50000x30000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--doc-length", type=int, default=8)
+    parser.add_argument("--max-dense-mb", type=int, default=1024)
+    parser.add_argument("--mmap", action="store_true", help="Map the index files like MODEL_MMAP_ENABLED does instead of reading them")
+    args = parser.parse_args()
+    corpora = [tuple([int(x) for x in corpus.split("x")]) for corpus in args.corpora.split(",")]
+    passed = run(corpora, args.queries, args.batch, args.doc_length, args.max_dense_mb, 'r' if args.mmap else None)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,101 @@
+"""
+Parity test for the tokenizers of the search and training services. getAllNGrams of both TokenizerModules
+must emit exactly the n-grams of the plain NLTK path they replaced, word_tokenize then stopwords then the
+WordNet lemmatizer, for every n-gram size with and without lemmatization. Runs over a fixed corpus of
+sentences that covers the plain-text fast path, the Treebank contractions it handles itself and the text
+that has to fall back to NLTK, plus the sentences of an optional file, one per line.
+
+Usage: python TokenizerParityTest.py [--sentences titles.txt] [--max-n 3]
+"""
+import os, re, sys, argparse, itertools, importlib.util
+import nltk
+from nltk import ngrams
+
+apiRoot = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Loaded from their files so the test doesn't start the Flask app or the function app their packages import
+def loadModule(name, *path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(apiRoot, *path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+corpus = [
+    "",
+    "   ",
+    "web app is down",
+    "my web app returns 503 errors after deployment",
+    "Function App cold start takes 30 seconds",
+    "HTTP 500.30 - ASP.NET Core app failed to start",
+    "I cannot connect to the database",
+    "Cannot connect to SQL server from App Service",
+    "gimme logs gonna check them, gotta go, lemme see, wanna know",
+    "gonna wanna gotta",
+    "Can't scale out: the plan's limit is reached!",
+    "Why doesn't my app restart? It won't, it isn't, they're stuck",
+    "\"Quoted\" title with 'single quotes' and ``backticks''",
+    "Error: System.OutOfMemoryException at w3wp.exe (pid 1234)",
+    "High CPU on instance RD0003FF1A2B3C; memory > 90%",
+    "SSL/TLS certificate binding failed for *.contoso.com",
+    "https://myapp.azurewebsites.net/api/values returns 404",
+    "e-mail notifications aren't sent... any ideas?",
+    "Deployment slot swap stuck at 50 % -- what now",
+    "node.js app crashes with ECONNRESET",
+    "C# WebJob stopped; Python 3.6 worker exited with code -1",
+    "Mr. Smith's app is slow. Dr. Jones said it's the DB.",
+    "tabs\tand\nnewlines\rin the\x0btitle\x0cfeed",
+    "Café Münchën résumé naïve",
+    "日本語のタイトル app service",
+    "emoji 🚀 deployment failed",
+    "the a an of to in",
+    "running runs ran better geese leaves analyses",
+    "appservice appserviceplan functionapp logicapp",
+    "multiple     spaces    between   words",
+    "trailing punctuation!!!",
+    "...",
+    "1234 5678 90",
+    "a",
+]
+
+# The NLTK path the tokenizers replaced, specialChars is the pattern the training service cleans titles with first
+def referenceNGrams(sentence, n, lemmatize, lemmatizer, stop, specialChars=None):
+    if specialChars is not None:
+        if not sentence:
+            return []
+        sentence = " ".join(re.sub(specialChars, " ", sentence).split())
+    tokens = [lemmatizer.lemmatize(word) if lemmatize else word for word in nltk.word_tokenize(sentence.lower()) if word not in stop]
+    return list(itertools.chain.from_iterable([[' '.join(list(x)) for x in ngrams(tokens, i)] for i in range(1, min([n, len(sentence.split())])+1)]))
+
+def run(sentences, maxN):
+    tokenizers = [
+        ("SearchAPI", loadModule("SearchTokenizer", "SearchAPI", "SearchModule", "TokenizerModule.py"), None),
+        ("TrainingAPI", loadModule("TrainingTokenizer", "TrainingAPI", "__app__", "TrainingModule", "TokenizerModule.py"), r'[^0-9a-zA-Z ]+')
+    ]
+    errors = []
+    checks = 0
+    for name, module, specialChars in tokenizers:
+        for sentence in sentences:
+            for n in range(1, maxN+1):
+                for lemmatize in [True, False]:
+                    expected = referenceNGrams(sentence, n, lemmatize, module.lemmatizer, module.stop, specialChars)
+                    actual = module.getAllNGrams(sentence, n, lemmatize)
+                    checks += 1
+                    if actual != expected:
+                        errors.append(f"{name} n={n} lemmatize={lemmatize} {sentence!r}: {actual} != {expected}")
+    print(f"{checks} checks over {len(sentences)} sentences and {len(tokenizers)} tokenizers")
+    for error in errors[:20]:
+        print("ERROR", error)
+    return not errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", help="File with more sentences to check, one per line")
+    parser.add_argument("--max-n", type=int, default=3)
+    args = parser.parse_args()
+    sentences = list(corpus)
+    if args.sentences:
+        with open(args.sentences, "r", encoding="utf-8") as f:
+            sentences += [line.rstrip("\n") for line in f]
+    passed = run(sentences, args.max_n)
+    print("PASSED" if passed else "FAILED")
+    sys.exit(0 if passed else 1)
@@ -13,10 +13,47 @@ class DevelopmentConfig(Config):
     STORAGE_ACCOUNT_KEY = devJson.get('STORAGE_ACCOUNT_KEY', None)
     STORAGE_ACCOUNT_CONTAINER_NAME = devJson.get('STORAGE_ACCOUNT_CONTAINER_NAME', None)
     TRAINED_MODELS_PATH = devJson.get('TRAINED_MODELS_PATH', 'models')
+    MODEL_STORE_PATH = devJson.get('MODEL_STORE_PATH', None)
+    MODEL_SYNC_CONCURRENCY = devJson.get('MODEL_SYNC_CONCURRENCY', 4)
+    MODEL_DOWNLOAD_WORKERS = devJson.get('MODEL_DOWNLOAD_WORKERS', 4)
+    MODEL_DOWNLOAD_RETRIES = devJson.get('MODEL_DOWNLOAD_RETRIES', 3)
+    MODEL_SMOKE_QUERY_COUNT = devJson.get('MODEL_SMOKE_QUERY_COUNT', 5)
+    MODEL_VERSIONS_TO_KEEP = devJson.get('MODEL_VERSIONS_TO_KEEP', 2)
+    STARTUP_CONCURRENCY = devJson.get('STARTUP_CONCURRENCY', 4)
+    STARTUP_WARMUP_QUERY_COUNT = devJson.get('STARTUP_WARMUP_QUERY_COUNT', 5)
+    WMD_PRUNING_ENABLED = devJson.get('WMD_PRUNING_ENABLED', True)
+    WMD_EMD_WORKERS = devJson.get('WMD_EMD_WORKERS', 0)
+    WMD_QUERY_TIMEOUT = devJson.get('WMD_QUERY_TIMEOUT', 2.0)
     LUIS_APP_ID = devJson.get('LUIS_APP_ID', None)
     LUIS_APP_KEY = devJson.get('LUIS_APP_KEY', None)
     ALLOWED_ISSUERS = devJson.get('ALLOWED_ISSUERS', None)
     ALLOWED_SUBJECTNAMES = devJson.get('ALLOWED_SUBJECTNAMES', None)
+    JWKS_REFRESH_INTERVAL = devJson.get('JWKS_REFRESH_INTERVAL', 24*3600)
+    VERIFIED_TOKEN_CACHE_SIZE = devJson.get('VERIFIED_TOKEN_CACHE_SIZE', 10000)
+    CERTIFICATE_CACHE_SIZE = devJson.get('CERTIFICATE_CACHE_SIZE', 1000)
+    QUERY_CACHE_ENABLED = devJson.get('QUERY_CACHE_ENABLED', True)
+    QUERY_CACHE_SIZE = devJson.get('QUERY_CACHE_SIZE', 4096)
+    QUERY_CACHE_TTL = devJson.get('QUERY_CACHE_TTL', 3600)
+    QUERY_CACHE_ADDRESS = devJson.get('QUERY_CACHE_ADDRESS', None)
+    QUERY_CACHE_AUTHKEY = devJson.get('QUERY_CACHE_AUTHKEY', None)
+    MODEL_MMAP_ENABLED = devJson.get('MODEL_MMAP_ENABLED', os.name != 'nt')
+    MODEL_PREFETCH_ENABLED = devJson.get('MODEL_PREFETCH_ENABLED', True)
+    MODEL_MEMORY_BUDGET_MB = devJson.get('MODEL_MEMORY_BUDGET_MB', 0)
+    PINNED_PRODUCTS = devJson.get('PINNED_PRODUCTS', None)
+    DEPENDENCY_POOL_SIZE = devJson.get('DEPENDENCY_POOL_SIZE', 32)
+    TRANSLATION_TIMEOUT = devJson.get('TRANSLATION_TIMEOUT', 2)
+    LUIS_TIMEOUT = devJson.get('LUIS_TIMEOUT', 3)
+    LUIS_ENDPOINT = devJson.get('LUIS_ENDPOINT', None)
+    LUIS_POOL_SIZE = devJson.get('LUIS_POOL_SIZE', 16)
+    LUIS_CACHE_SIZE = devJson.get('LUIS_CACHE_SIZE', 4096)
+    LUIS_CACHE_TTL = devJson.get('LUIS_CACHE_TTL', 3600)
+    LUIS_BREAKER_FAILURES = devJson.get('LUIS_BREAKER_FAILURES', 5)
+    LUIS_BREAKER_COOLDOWN = devJson.get('LUIS_BREAKER_COOLDOWN', 30)
+    TRANSLATOR = devJson.get('TRANSLATOR', 'google')
+    TRANSLATION_BYPASS_ENABLED = devJson.get('TRANSLATION_BYPASS_ENABLED', True)
+    TRANSLATION_BYPASS_MARGIN = devJson.get('TRANSLATION_BYPASS_MARGIN', 0.1)
+    TRANSLATION_CACHE_SIZE = devJson.get('TRANSLATION_CACHE_SIZE', 4096)
+    TRANSLATION_CACHE_TTL = devJson.get('TRANSLATION_CACHE_TTL', 24*3600)
 
 class ProductionConfig(Config):
     ENVIRONMENT = "PRODUCTION"
@@ -29,7 +66,44 @@ class ProductionConfig(Config):
     STORAGE_ACCOUNT_KEY = os.getenv('STORAGE_ACCOUNT_KEY', None)
     STORAGE_ACCOUNT_CONTAINER_NAME = os.getenv('STORAGE_ACCOUNT_CONTAINER_NAME', None)
     TRAINED_MODELS_PATH = os.getenv('TRAINED_MODELS_PATH', 'models')
+    MODEL_STORE_PATH = os.getenv('MODEL_STORE_PATH', None)
+    MODEL_SYNC_CONCURRENCY = int(os.getenv('MODEL_SYNC_CONCURRENCY', 4))
+    MODEL_DOWNLOAD_WORKERS = int(os.getenv('MODEL_DOWNLOAD_WORKERS', 4))
+    MODEL_DOWNLOAD_RETRIES = int(os.getenv('MODEL_DOWNLOAD_RETRIES', 3))
+    MODEL_SMOKE_QUERY_COUNT = int(os.getenv('MODEL_SMOKE_QUERY_COUNT', 5))
+    MODEL_VERSIONS_TO_KEEP = int(os.getenv('MODEL_VERSIONS_TO_KEEP', 2))
+    STARTUP_CONCURRENCY = int(os.getenv('STARTUP_CONCURRENCY', 4))
+    STARTUP_WARMUP_QUERY_COUNT = int(os.getenv('STARTUP_WARMUP_QUERY_COUNT', 5))
+    WMD_PRUNING_ENABLED = os.getenv('WMD_PRUNING_ENABLED', 'true').lower() == 'true'
+    WMD_EMD_WORKERS = int(os.getenv('WMD_EMD_WORKERS', 0))
+    WMD_QUERY_TIMEOUT = float(os.getenv('WMD_QUERY_TIMEOUT', 2.0))
     LUIS_APP_ID = os.getenv('LUIS_APP_ID', None)
     LUIS_APP_KEY = os.getenv('LUIS_APP_KEY', None)
     ALLOWED_ISSUERS = os.getenv('ALLOWED_ISSUERS', None)
-    ALLOWED_SUBJECTNAMES = os.getenv('ALLOWED_SUBJECTNAMES', None)
\ No newline at end of file
+    ALLOWED_SUBJECTNAMES = os.getenv('ALLOWED_SUBJECTNAMES', None)
+    JWKS_REFRESH_INTERVAL = int(os.getenv('JWKS_REFRESH_INTERVAL', 24*3600))
+    VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv('VERIFIED_TOKEN_CACHE_SIZE', 10000))
+    CERTIFICATE_CACHE_SIZE = int(os.getenv('CERTIFICATE_CACHE_SIZE', 1000))
+    QUERY_CACHE_ENABLED = os.getenv('QUERY_CACHE_ENABLED', 'true').lower() == 'true'
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 4096))
+    QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 3600))
+    QUERY_CACHE_ADDRESS = os.getenv('QUERY_CACHE_ADDRESS', None)
+    QUERY_CACHE_AUTHKEY = os.getenv('QUERY_CACHE_AUTHKEY', None)
+    MODEL_MMAP_ENABLED = os.getenv('MODEL_MMAP_ENABLED', str(os.name != 'nt')).lower() == 'true'
+    MODEL_PREFETCH_ENABLED = os.getenv('MODEL_PREFETCH_ENABLED', 'true').lower() == 'true'
+    MODEL_MEMORY_BUDGET_MB = int(os.getenv('MODEL_MEMORY_BUDGET_MB', 0))
+    PINNED_PRODUCTS = os.getenv('PINNED_PRODUCTS', '14748')
+    DEPENDENCY_POOL_SIZE = int(os.getenv('DEPENDENCY_POOL_SIZE', 32))
+    TRANSLATION_TIMEOUT = float(os.getenv('TRANSLATION_TIMEOUT', 2))
+    LUIS_TIMEOUT = float(os.getenv('LUIS_TIMEOUT', 3))
+    LUIS_ENDPOINT = os.getenv('LUIS_ENDPOINT', None)
+    LUIS_POOL_SIZE = int(os.getenv('LUIS_POOL_SIZE', 16))
+    LUIS_CACHE_SIZE = int(os.getenv('LUIS_CACHE_SIZE', 4096))
+    LUIS_CACHE_TTL = int(os.getenv('LUIS_CACHE_TTL', 3600))
+    LUIS_BREAKER_FAILURES = int(os.getenv('LUIS_BREAKER_FAILURES', 5))
+    LUIS_BREAKER_COOLDOWN = float(os.getenv('LUIS_BREAKER_COOLDOWN', 30))
+    TRANSLATOR = os.getenv('TRANSLATOR', 'google')
+    TRANSLATION_BYPASS_ENABLED = os.getenv('TRANSLATION_BYPASS_ENABLED', 'true').lower() == 'true'
+    TRANSLATION_BYPASS_MARGIN = float(os.getenv('TRANSLATION_BYPASS_MARGIN', 0.1))
+    TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', 4096))
+    TRANSLATION_CACHE_TTL = int(os.getenv('TRANSLATION_CACHE_TTL', 24*3600))
\ No newline at end of file
@@ -1,55 +1,169 @@
-import jwt, requests
+import jwt, requests, hashlib, threading, time
 from cryptography.x509 import load_pem_x509_certificate
 from cryptography.hazmat.backends import default_backend
 from SearchModule import app
+from SearchModule.Logger import loggerInstance
+from SearchModule.ResultCache import TtlLruCache
 
-# Get jwk openid-configuration to find where the jwk keys are located
-openid_res = requests.get('https://login.microsoftonline.com/common/.well-known/openid-configuration')
-jwk_uri = openid_res.json()['jwks_uri']
-jwk_res = requests.get(jwk_uri)
-jwk_keys = jwk_res.json()
+openid_config_uri = 'https://login.microsoftonline.com/common/.well-known/openid-configuration'
+
+# Public keys of the signing certificates by kid, refreshed in the background so key rotation is picked up
+class JwkKeyCache:
+    def __init__(self, refreshInterval=24*3600, minRefreshInterval=5*60, failureBackoff=30):
+        self.refreshInterval = refreshInterval
+        self.minRefreshInterval = minRefreshInterval
+        self.failureBackoff = failureBackoff
+        self.keys = {}
+        self.lastRefresh = None
+        self.lastFailure = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.refreshed = threading.Condition(self.lock)
+        self.refresher = None
+
+    def fetchKeys(self):
+        # Get jwk openid-configuration to find where the jwk keys are located
+        jwk_uri = requests.get(openid_config_uri, timeout=10).json()['jwks_uri']
+        jwk_keys = requests.get(jwk_uri, timeout=10).json()
+        keys = {}
+        for key in jwk_keys['keys']:
+            if not key.get('x5c', None):
+                continue
+            cert = ''.join(['-----BEGIN CERTIFICATE-----\n', key['x5c'][0], '\n-----END CERTIFICATE-----\n',])
+            keys[key['kid']] = load_pem_x509_certificate(cert.encode(), default_backend()).public_key()
+        return keys
+
+    def refresh(self):
+        with self.lock:
+            # Requests that find a refresh in flight wait for its keys instead of fetching them again
+            if self.refreshing:
+                self.refreshed.wait_for(lambda: not self.refreshing, timeout=30)
+                return False
+            # Tokens signed with an unknown kid would otherwise trigger a fetch on every request. A failed fetch
+            # doesn't count as a refresh, the next one is only held back for a short while.
+            now = time.monotonic()
+            if self.lastRefresh and now - self.lastRefresh < self.minRefreshInterval:
+                return False
+            if self.lastFailure and now - self.lastFailure < self.failureBackoff:
+                return False
+            self.refreshing = True
+        # Fetched without holding the lock so a slow endpoint doesn't stall the requests that already have their key
+        keys = None
+        try:
+            keys = self.fetchKeys()
+        finally:
+            with self.lock:
+                if keys is None:
+                    # The previous keys stay in use
+                    self.lastFailure = time.monotonic()
+                else:
+                    # The whole set is replaced, so keys retired by a rotation stop being accepted
+                    self.keys = keys
+                    self.lastRefresh = time.monotonic()
+                    self.lastFailure = None
+                self.refreshing = False
+                self.refreshed.notify_all()
+        return True
+
+    def startRefresher(self):
+        def refreshLoop():
+            delay = self.refreshInterval
+            while True:
+                time.sleep(delay)
+                try:
+                    self.refresh()
+                    delay = self.refreshInterval
+                except Exception as e:
+                    loggerInstance.logHandledException("jwkKeyRefresh", Exception(f"Failed to refresh signing keys: {str(e)}"))
+                    delay = self.failureBackoff
+        self.refresher = threading.Thread(target=refreshLoop, daemon=True)
+        self.refresher.start()
+
+    def getKey(self, kid):
+        if not self.refresher:
+            with self.lock:
+                if not self.refresher:
+                    self.startRefresher()
+        key = self.keys.get(kid, None)
+        if key is None:
+            # Also picks up the keys of a refresh another request had in flight
+            self.refresh()
+            key = self.keys.get(kid, None)
+        return key
+
+# Config values are read once, the first time a token is validated
+class AuthConfig:
+    def __init__(self, config):
+        self.tid = self.readValue(config, "TENANT_ID")
+        self.iss = self.readValue(config, "TOKEN_ISSUER")
+        self.appid = self.readValue(config, "APP_ID")
+        try:
+            self.whitelistedapps = frozenset([x.strip() for x in config["WHITELISTED_APPS"].split(",")])
+            if not self.whitelistedapps:
+                raise Exception("WHITELISTED_APPS is empty")
+        except Exception as e:
+            raise Exception("Error reading WHITELISTED_APPS from environment variables " + str(e))
+
+    def readValue(self, config, name):
+        try:
+            value = config[name]
+            if not value:
+                raise Exception(f"{name} is empty")
+        except Exception as e:
+            raise Exception(f"Error reading {name} from environment variables " + str(e))
+        return value
+
+authConfig = None
+jwkKeyCache = None
+verifiedTokens = None
+cacheLock = threading.Lock()
+
+# Created on first use so that the config loaded by the entry point is honoured
+def getAuthConfig():
+    global authConfig
+    with cacheLock:
+        if not authConfig:
+            authConfig = AuthConfig(app.config)
+    return authConfig
+
+def getJwkKeyCache():
+    global jwkKeyCache
+    with cacheLock:
+        if not jwkKeyCache:
+            jwkKeyCache = JwkKeyCache(app.config.get("JWKS_REFRESH_INTERVAL", 24*3600))
+    return jwkKeyCache
+
+def getVerifiedTokens():
+    global verifiedTokens
+    with cacheLock:
+        if not verifiedTokens:
+            verifiedTokens = TtlLruCache(app.config.get("VERIFIED_TOKEN_CACHE_SIZE", 10000))
+    return verifiedTokens
 
 def validateToken(token):
     if not token:
         return ("Token is empty", False)
-    try:
-        tid = app.config["TENANT_ID"]
-        if not tid:
-            raise Exception("TENANT_ID is empty")
-    except Exception as e:
-        raise Exception("Error reading TENANT_ID from environment variables " + str(e))
-    try:
-        iss = app.config["TOKEN_ISSUER"]
-        if not iss:
-            raise Exception("TOKEN_ISSUER is empty")
-    except Exception as e:
-        raise Exception("Error reading TOKEN_ISSUER from environment variables " + str(e))        
-    try:
-        appid = app.config["APP_ID"]
-        if not appid:
-            raise Exception("APP_ID is empty")
-    except Exception as e:
-        raise Exception("Error reading APP_ID from environment variables " + str(e))
-    try:
-        whitelistedapps = [x.strip() for x in app.config["WHITELISTED_APPS"].split(",")]
-        if not whitelistedapps:
-            raise Exception("WHITELISTED_APPS is empty")
-    except Exception as e:
-        raise Exception("Error reading WHITELISTED_APPS from environment variables " + str(e))
+    config = getAuthConfig()
+    # Tokens that were verified before are trusted until they expire
+    tokenHash = hashlib.sha256(token.encode()).hexdigest()
+    result = getVerifiedTokens().get(tokenHash)
+    if result:
+        return result
     token_header = jwt.get_unverified_header(token)
-    x5c = None
-    for key in jwk_keys['keys']:
-        if key['kid'] == token_header['kid']:
-            x5c = key['x5c']
-    if not x5c:
+    public_key = getJwkKeyCache().getKey(token_header.get('kid', None))
+    if not public_key:
         return ("MalformedToken - Failed to read token attributes", False)
-    cert = ''.join(['-----BEGIN CERTIFICATE-----\n', x5c[0], '\n-----END CERTIFICATE-----\n',])
-    public_key = load_pem_x509_certificate(cert.encode(), default_backend()).public_key()
-    decoded_token = jwt.decode(token, public_key, algorithms='RS256', audience=appid,)
-    if not (decoded_token.get('tid', None) == tid):
+    decoded_token = jwt.decode(token, public_key, algorithms='RS256', audience=config.appid,)
+    result = checkClaims(decoded_token, config)
+    if decoded_token.get('exp', None):
+        getVerifiedTokens().set(tokenHash, result, expiresAt=decoded_token['exp'])
+    return result
+
+def checkClaims(decoded_token, config):
+    if not (decoded_token.get('tid', None) == config.tid):
         return (f"Token from the tenant {decoded_token.get('tid', None)} is unauthorized to access this resource", False)
-    if not (decoded_token.get('iss', None) == iss):
+    if not (decoded_token.get('iss', None) == config.iss):
         return (f"Token from the issuer {decoded_token.get('iss', None)} is unauthorized to access this resource", False)
-    if not (decoded_token.get('appid', None) in whitelistedapps):
+    if not (decoded_token.get('appid', None) in config.whitelistedapps):
         return (f"App with id {decoded_token.get('appid', None)} is unauthorized to access this resource", False)
-    return (None, True)
\ No newline at end of file
+    return (None, True)
@@ -1,16 +1,38 @@
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
 from cryptography.x509.oid import NameOID
-import datetime
+import datetime, calendar, hashlib, threading
 from SearchModule import app
+from SearchModule.ResultCache import TtlLruCache
+
+allowLists = None
+certificateCache = None
+cacheLock = threading.Lock()
+
+# Parsed certificates by digest of the header value, each entry is dropped when its certificate expires
+def getCertificateCache():
+    global certificateCache
+    with cacheLock:
+        if not certificateCache:
+            certificateCache = TtlLruCache(app.config.get("CERTIFICATE_CACHE_SIZE", 1000))
+    return certificateCache
+
+def getCertificateInfo(certStr):
+    digest = hashlib.sha256(certStr.encode()).hexdigest()
+    certInfo = getCertificateCache().get(digest)
+    if certInfo:
+        return certInfo
+    certStr = ''.join(['-----BEGIN CERTIFICATE-----\n', certStr, '\n-----END CERTIFICATE-----\n',])
+    certInfo = readCertificateInfo(certStr.encode())
+    if certInfo:
+        getCertificateCache().set(digest, certInfo, expiresAt=calendar.timegm(certInfo["expiry_date"].utctimetuple()))
+    return certInfo
 
 def validateCertificate(certStr):
     if not certStr:
         return ("Empty certificate value", False)
     try:
-        certStr = ''.join(['-----BEGIN CERTIFICATE-----\n', certStr, '\n-----END CERTIFICATE-----\n',])
-        certBytes = certStr.encode()
-        certInfo = readCertificateInfo(certBytes)
+        certInfo = getCertificateInfo(certStr)
         if not certInfo:
             return ("MalformedCertificate - Unable to verify certificate", False)
         if certInfo["expiry_date"]<=datetime.datetime.now():
@@ -27,21 +49,28 @@ def validateCertificate(certStr):
     except Exception as e:
         return (str(e), False)
 
+# The allow lists are parsed once, the first time a certificate is validated
 def readAppConfig():
+    global allowLists
+    if not allowLists:
+        allowLists = parseAllowLists()
+    return allowLists
+
+def parseAllowLists():
     try:
         ALLOWED_ISSUERS = app.config["ALLOWED_ISSUERS"]
         if ALLOWED_ISSUERS and len(ALLOWED_ISSUERS)>1:
-            ALLOWED_ISSUERS = [x.lower() if x else x for x in ALLOWED_ISSUERS.strip().split(",")]
+            ALLOWED_ISSUERS = frozenset([x.lower() if x else x for x in ALLOWED_ISSUERS.strip().split(",")])
         else:
-            ALLOWED_ISSUERS = []
+            ALLOWED_ISSUERS = frozenset()
     except Exception as e:
         raise Exception("Error reading ALLOWED_ISSUERS from environment variables " + str(e))
     try:
         ALLOWED_SUBJECTNAMES = app.config["ALLOWED_SUBJECTNAMES"]
         if ALLOWED_SUBJECTNAMES and len(ALLOWED_SUBJECTNAMES)>1:
-            ALLOWED_SUBJECTNAMES = [x.lower() if x else x for x in ALLOWED_SUBJECTNAMES.strip().split(",")]
+            ALLOWED_SUBJECTNAMES = frozenset([x.lower() if x else x for x in ALLOWED_SUBJECTNAMES.strip().split(",")])
         else:
-            ALLOWED_SUBJECTNAMES = []
+            ALLOWED_SUBJECTNAMES = frozenset()
     except Exception as e:
         raise Exception("Error reading ALLOWED_SUBJECTNAMES from environment variables " + str(e))
     return (ALLOWED_ISSUERS, ALLOWED_SUBJECTNAMES)
@@ -0,0 +1,57 @@
+import mmap
+import numpy as np
+from collections import Counter
+from gensim import matutils
+from gensim.models import KeyedVectors
+from gensim.models.keyedvectors import Vocab
+
+# Dictionary token -> id table stored as a sorted token array and a parallel id array
+class ArrayDictionary:
+    def __init__(self, tokensFile, idsFile, mmapMode='r'):
+        self.tokens = np.load(tokensFile, mmap_mode=mmapMode)
+        self.ids = np.load(idsFile, mmap_mode=mmapMode)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Same output as gensim's Dictionary.doc2bow: (id, count) pairs of known tokens sorted by id
+    def doc2bow(self, document):
+        counts = Counter(document)
+        if not counts or not len(self.tokens):
+            return []
+        words = list(counts.keys())
+        positions = np.minimum(np.searchsorted(self.tokens, words), len(self.tokens)-1)
+        return sorted((int(self.ids[positions[i]]), counts[words[i]]) for i in range(len(words)) if self.tokens[positions[i]] == words[i])
+
+# TF-IDF weighting from a dense idf array, matching gensim's default TfidfModel (raw tf, unit length)
+class ArrayTfidfModel:
+    eps = 1e-12
+
+    def __init__(self, idfFile, mmapMode='r'):
+        self.idfs = np.load(idfFile, mmap_mode=mmapMode)
+
+    def __getitem__(self, bow):
+        vector = [(termid, tf * float(self.idfs[termid])) for termid, tf in bow if termid < len(self.idfs) and abs(self.idfs[termid]) > self.eps]
+        vector = matutils.unitvec(vector)
+        return [(termid, weight) for termid, weight in vector if abs(weight) > self.eps]
+
+# KeyedVectors over the embeddings shipped with a WMD package, the vectors of the words its indices use and of the
+# most frequent words. Stored float16 vectors are widened to float32, the precision word distances are computed in.
+def loadEmbeddings(wordsFile, vectorsFile, mmapMode='r'):
+    words = [str(x) for x in np.load(wordsFile)]
+    vectors = np.load(vectorsFile, mmap_mode=mmapMode)
+    if vectors.dtype != np.float32:
+        vectors = vectors.astype(np.float32)
+    embeddings = KeyedVectors(vectors.shape[1])
+    embeddings.vectors = vectors
+    embeddings.index2word = words
+    embeddings.vocab = dict([(word, Vocab(index=i, count=len(words)-i)) for i, word in enumerate(words)])
+    return embeddings
+
+# Reads one value per page so a freshly mapped array is resident before the first query
+def prefetchArray(array):
+    if array is None or not isinstance(array, np.ndarray) or not array.size:
+        return 0
+    flat = array.reshape(-1)
+    step = max(1, mmap.PAGESIZE // flat.itemsize)
+    return float(flat[::step].sum())
@@ -13,4 +13,6 @@ class ModelRefreshException(Exception):
 class CopySourceFolderNotFoundException(Exception):
     pass
 class CopyTaskException(Exception):
+    pass
+class LuisUnavailableException(Exception):
     pass
\ No newline at end of file
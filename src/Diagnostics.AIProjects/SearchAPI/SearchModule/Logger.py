@@ -1,5 +1,6 @@
 import requests, json, os
-from SearchModule.ETWProvider import log
+from datetime import datetime, timezone
+from SearchModule.TelemetryPipeline import createTelemetryPipeline, truncate, HIGH_PRIORITY, NORMAL_PRIORITY, LOW_PRIORITY
 
 class LoggingException(Exception):
     pass
@@ -13,13 +14,20 @@ class Logger:
 			"Insights": {"eventId": 4005, "category": "Information"},
 			"HandledException": {"eventId": 4006, "category": "Error"}
 		}
+		self.eventPriorities = {"UnhandledException": HIGH_PRIORITY, "HandledException": HIGH_PRIORITY, "APISummary": NORMAL_PRIORITY, "Insights": LOW_PRIORITY}
+		# Response bodies are cut before serializing the summary instead of dumping whole result lists
+		self.maxSummaryContentLength = int(os.getenv("TELEMETRY_MAX_SUMMARY_CONTENT_LENGTH", 2048))
+		self.maxExceptionDetailsLength = int(os.getenv("TELEMETRY_MAX_EXCEPTION_DETAILS_LENGTH", 4096))
+		# Events whose content is serialized JSON, the pipeline must not cut them
+		self.jsonEvents = frozenset(["UnhandledException", "APISummary", "HandledException"])
+		self.pipeline = createTelemetryPipeline()
 	
 	def logHandledException(self, requestId, exception):
-		exp = { "eventType": "HandledException", "eventContent": json.dumps({ "requestId": requestId, "exceptionType": type(exception).__name__, "exceptionDetails": str(exception) }) }
+		exp = { "eventType": "HandledException", "eventContent": json.dumps({ "requestId": requestId, "exceptionType": type(exception).__name__, "exceptionDetails": truncate(str(exception), self.maxExceptionDetailsLength) }) }
 		self.logEvent(exp)
 
 	def logUnhandledException(self, requestId, exception):
-		exp = { "eventType": "UnhandledException", "eventContent": json.dumps({ "requestId": requestId, "exceptionType": type(exception).__name__, "exceptionDetails": str(exception) }) }
+		exp = { "eventType": "UnhandledException", "eventContent": json.dumps({ "requestId": requestId, "exceptionType": type(exception).__name__, "exceptionDetails": truncate(str(exception), self.maxExceptionDetailsLength) }) }
 		self.logEvent(exp)
 
 	def logInsights(self, insights):
@@ -27,10 +35,17 @@ class Logger:
 		self.logEvent(exp)
 
 	def logApiSummary(self, requestId, operationName, statusCode, latencyInMilliseconds, startTime, endTime, content):
-		exp = { "eventType": "APISummary", "eventContent": json.dumps({ "requestId": requestId, "operationName": operationName, "statusCode": statusCode, "latencyInMilliseconds": latencyInMilliseconds, "startTime": startTime, "endTime": endTime, "content": content }) }
+		exp = { "eventType": "APISummary", "eventContent": json.dumps({ "requestId": requestId, "operationName": operationName, "statusCode": statusCode, "latencyInMilliseconds": latencyInMilliseconds, "startTime": startTime, "endTime": endTime, "content": truncate(content, self.maxSummaryContentLength) }) }
 		self.logEvent(exp)
 
 	def logEvent(self, event):
 		if self.isLogToKustoEnabled:
-			log(self.eventCategoryMapping[event["eventType"]]["eventId"], self.eventCategoryMapping[event["eventType"]]["category"], [event["eventContent"]], "")
+			mapping = self.eventCategoryMapping[event["eventType"]]
+			self.pipeline.enqueue({"timestamp": datetime.now(timezone.utc).isoformat(), "eventType": event["eventType"], "eventId": mapping["eventId"], "category": mapping["category"], "content": event["eventContent"]}, self.eventPriorities[event["eventType"]], event["eventType"] not in self.jsonEvents)
+
+	def getTelemetryStats(self):
+		return self.pipeline.stats()
+
+	def flushTelemetry(self, timeout=None):
+		self.pipeline.flush(timeout)
 loggerInstance = Logger(kustoEnabled=True)
\ No newline at end of file
@@ -1,16 +1,117 @@
-import requests, json
+import requests, json, time, threading
+from requests.adapters import HTTPAdapter
 from SearchModule import app
+from SearchModule.ResultCache import TtlLruCache
+from SearchModule.Exceptions import LuisUnavailableException
+from SearchModule.Metrics import metrics
 luisConfig = {"enabledProducts": ["14748"]}
 luis_api_endpoints = {
-		"GET_INTENTS": "https://westus.api.cognitive.microsoft.com/luis/prediction/v3.0/apps/{appId}/slots/production/predict?subscription-key={key}&verbose=true&show-all-intents=true&log=true&query={queryString}",
+		"GET_INTENTS": "{endpoint}/luis/prediction/v3.0/apps/{appId}/slots/production/predict",
 	}
-def getLuisPredictions(queryString, productId=None):
-    if productId and productId in luisConfig["enabledProducts"]:
-        appId = app.config["LUIS_APP_ID"]
-        key = app.config["LUIS_APP_KEY"]
-        url = luis_api_endpoints["GET_INTENTS"].replace("{appId}", appId).replace("{key}", key).replace("{queryString}", queryString)
-        r = requests.get(url)
-        res = json.loads(r.content)
+defaultLuisEndpoint = "https://westus.api.cognitive.microsoft.com"
+
+def isLuisEnabled(productId):
+    return bool(productId) and productId in luisConfig["enabledProducts"]
+
+# Stops calls to LUIS for a cool down period after repeated failures, then lets a single trial call through
+class CircuitBreaker:
+    def __init__(self, failureThreshold=5, coolDown=30):
+        self.failureThreshold = failureThreshold
+        self.coolDown = coolDown
+        self.state = "closed"
+        self.failures = 0
+        self.openedAt = None
+        self.trialRunning = False
+        self.timesOpened = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.openedAt >= self.coolDown:
+                self.state = "halfopen"
+            if self.state == "halfopen" and not self.trialRunning:
+                self.trialRunning = True
+                return True
+            return False
+
+    def recordSuccess(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trialRunning = False
+
+    def recordFailure(self):
+        with self.lock:
+            self.failures += 1
+            self.trialRunning = False
+            if self.state == "halfopen" or self.failures >= self.failureThreshold:
+                if self.state != "open":
+                    self.timesOpened += 1
+                self.state = "open"
+                self.openedAt = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {"state": self.state, "consecutiveFailures": self.failures, "timesOpened": self.timesOpened}
+
+# LUIS prediction client with a persistent connection pool, a result cache and a circuit breaker
+class LuisClient:
+    def __init__(self, appId, key, endpoint=None, timeout=3, poolSize=16, cache=None, breaker=None):
+        self.appId = appId
+        self.key = key
+        self.url = luis_api_endpoints["GET_INTENTS"].replace("{endpoint}", (endpoint or defaultLuisEndpoint).rstrip("/")).replace("{appId}", appId or "")
+        self.timeout = timeout
+        self.cache = cache
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.counters = {"requests": 0, "cacheHits": 0, "calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "totalLatency": 0.0, "maxLatency": 0.0}
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def buildKey(self, queryString, productId):
+        return "{0}|{1}".format(productId, " ".join(queryString.lower().split()))
+
+    def getPredictions(self, queryString, productId, timeout=None):
+        self.count("requests")
+        key = self.buildKey(queryString, productId)
+        preds = self.cache.get(key) if self.cache else None
+        if preds is not None:
+            self.count("cacheHits")
+            # Callers modify the scores while merging, so they get their own copies
+            return [dict(x) for x in preds]
+        if not self.breaker.allow():
+            self.count("rejected")
+            raise LuisUnavailableException("LUIS calls are suspended after repeated failures")
+        startTime = time.monotonic()
+        try:
+            self.count("calls")
+            r = self.session.get(self.url, params={"subscription-key": self.key, "verbose": "true", "show-all-intents": "true", "log": "true", "query": queryString}, timeout=timeout or self.timeout)
+            r.raise_for_status()
+            res = json.loads(r.content)
+        except requests.exceptions.Timeout:
+            self.count("timeouts")
+            self.count("failures")
+            self.breaker.recordFailure()
+            raise
+        except Exception:
+            self.count("failures")
+            self.breaker.recordFailure()
+            raise
+        finally:
+            latency = time.monotonic() - startTime
+            metrics.observe("searchapi_stage_seconds", latency, stage="luis")
+            with self.lock:
+                self.counters["totalLatency"] += latency
+                self.counters["maxLatency"] = max(self.counters["maxLatency"], latency)
+        self.breaker.recordSuccess()
         try:
             predictions = res["prediction"]["intents"]
         except Exception as e:
@@ -22,7 +123,37 @@ def getLuisPredictions(queryString, productId=None):
                     "detector": intent,
                     "score": round(float(predictions[intent]["score"]), 3)
                 })
-        return preds[: min([3, len(preds)])]
+        preds = preds[: min([3, len(preds)])]
+        if self.cache:
+            self.cache.set(key, [dict(x) for x in preds])
+        return preds
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["averageLatency"] = stats["totalLatency"]/stats["calls"] if stats["calls"] else 0
+        stats["cacheHitRate"] = stats["cacheHits"]/stats["requests"] if stats["requests"] else 0
+        stats["breaker"] = self.breaker.stats()
+        if self.cache:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+luisClient = None
+luisClientLock = threading.Lock()
+
+# Created on first use so that the config loaded by the entry point is honoured
+def getLuisClient():
+    global luisClient
+    with luisClientLock:
+        if not luisClient:
+            cache = TtlLruCache(app.config.get("LUIS_CACHE_SIZE", 4096), app.config.get("LUIS_CACHE_TTL", 3600)) if app.config.get("LUIS_CACHE_SIZE", 4096) else None
+            breaker = CircuitBreaker(app.config.get("LUIS_BREAKER_FAILURES", 5), app.config.get("LUIS_BREAKER_COOLDOWN", 30))
+            luisClient = LuisClient(app.config["LUIS_APP_ID"], app.config["LUIS_APP_KEY"], app.config.get("LUIS_ENDPOINT", None), app.config.get("LUIS_TIMEOUT", 3), app.config.get("LUIS_POOL_SIZE", 16), cache, breaker)
+    return luisClient
+
+def getLuisPredictions(queryString, productId=None, timeout=None):
+    if isLuisEnabled(productId):
+        return getLuisClient().getPredictions(queryString, productId, timeout)
     else:
         return []
 
@@ -39,4 +170,4 @@ def mergeLuisResults(result):
             # To make sure LUIS results are cleared by runtime host api
             res["score"] = max([0.31, res["score"]])
             result["results"].append(res)
-    return result    
\ No newline at end of file
+    return result
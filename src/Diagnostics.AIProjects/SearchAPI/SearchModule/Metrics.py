@@ -0,0 +1,122 @@
+import time, bisect, threading
+from contextlib import contextmanager
+
+# Seconds, from half a millisecond for the vector math up to the network calls
+defaultBuckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+quantiles = (0.5, 0.9, 0.99)
+
+class Histogram:
+    def __init__(self, buckets=defaultBuckets):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets)+1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Estimated by linear interpolation inside the bucket holding the quantile, like Prometheus' histogram_quantile
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q*self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if cumulative + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i-1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower)*(rank - cumulative)/n
+            cumulative += n
+        return self.buckets[-1]
+
+def formatLabels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(["{0}=\"{1}\"".format(k, escape(v)) for k, v in items]) + "}"
+
+# In-process metrics rendered in the Prometheus text format, cheap enough to stay on for every request
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key, None)
+            if not histogram:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - startTime, **labels)
+
+    # Time spent in one step of serving a query
+    def stage(self, stageName):
+        return self.timer("searchapi_stage_seconds", stage=stageName)
+
+    # Collectors are called on every scrape and return (name, labels dict, value) gauges
+    def registerCollector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            histograms = sorted([(name, labels, list(h.counts), h.sum, h.count, [h.quantile(q) for q in quantiles]) for (name, labels), h in self.histograms.items()])
+            counters = sorted(self.counters.items())
+        lastName = None
+        for name, labels, counts, total, count, quantileValues in histograms:
+            if name != lastName:
+                lines.append("# TYPE {0} histogram".format(name))
+                lastName = name
+            cumulative = 0
+            for i, bound in enumerate(list(defaultBuckets) + ["+Inf"]):
+                cumulative += counts[i]
+                lines.append("{0}_bucket{1} {2}".format(name, formatLabels(labels, [("le", bound)]), cumulative))
+            lines.append("{0}_sum{1} {2}".format(name, formatLabels(labels), total))
+            lines.append("{0}_count{1} {2}".format(name, formatLabels(labels), count))
+        lastName = None
+        for name, labels, counts, total, count, quantileValues in histograms:
+            if name != lastName:
+                lines.append("# TYPE {0}_quantile gauge".format(name))
+                lastName = name
+            for q, value in zip(quantiles, quantileValues):
+                lines.append("{0}_quantile{1} {2}".format(name, formatLabels(labels, [("quantile", q)]), value))
+        lastName = None
+        for (name, labels), value in counters:
+            if name != lastName:
+                lines.append("# TYPE {0} counter".format(name))
+                lastName = name
+            lines.append("{0}{1} {2}".format(name, formatLabels(labels), value))
+        gauges = []
+        for collector in self.collectors:
+            try:
+                gauges += [(name, tuple(sorted(labels.items())), value) for name, labels, value in collector()]
+            except Exception:
+                self.increment("searchapi_metrics_collector_errors_total")
+        lastName = None
+        for name, labels, value in sorted(gauges, key=lambda x: (x[0], x[1])):
+            if name != lastName:
+                lines.append("# TYPE {0} gauge".format(name))
+                lastName = name
+            lines.append("{0}{1} {2}".format(name, formatLabels(labels), float(value) if value is not None else "NaN"))
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
@@ -0,0 +1,151 @@
+import os, gzip, shutil, hashlib, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from SearchModule.Exceptions import ModelDownloadFailed
+
+chunkSize = 1 << 20
+
+class ChecksumMismatch(ModelDownloadFailed):
+    pass
+
+# Reader over the decompressed content of a downloaded artifact
+def openArtifact(path, compression):
+    if not compression:
+        return open(path, "rb")
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        # Optional, only needed when the trainer publishes zstd artifacts
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    raise ModelDownloadFailed(f"Unsupported compression {compression}")
+
+# Files of a version as published in the manifest, or as listed in storage for versions published without checksums
+def getArtifacts(prefix, manifest, blobs):
+    artifacts = []
+    if manifest and manifest.get("files", None):
+        for entry in manifest["files"]:
+            path = prefix + entry.get("blob", entry["name"])
+            if path not in blobs:
+                raise ModelDownloadFailed(f"{path} is in the manifest but not in the store")
+            etag, blobSize = blobs[path]
+            artifacts.append({"name": entry["name"], "path": path, "etag": etag, "blobSize": entry.get("blobSize", blobSize), "size": entry.get("size", None), "sha256": entry.get("sha256", None), "compression": entry.get("compression", None)})
+    else:
+        for path, (etag, blobSize) in blobs.items():
+            artifacts.append({"name": path.split("/")[-1], "path": path, "etag": etag, "blobSize": blobSize, "size": blobSize, "sha256": None, "compression": None})
+    return artifacts
+
+# Downloads the files of a model version concurrently into a staging folder, and only moves the folder in place
+# once every file is complete and matches its checksum, so a partially downloaded version is never loaded
+class ModelDownloader:
+    def __init__(self, store, workers=4, retries=3, retryDelay=2):
+        self.store = store
+        self.retries = retries
+        self.retryDelay = retryDelay
+        # Shared by all products so the number of concurrent transfers stays bounded
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.counters = {"downloaded": 0, "reused": 0, "resumed": 0, "retries": 0, "checksumFailures": 0, "bytes": 0}
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    # Files with the same etag as the copy in reuseDir are copied from there instead of downloaded again
+    def downloadVersion(self, artifacts, stagingDir, reuseDir=None, reuseEtags=None):
+        try:
+            os.makedirs(stagingDir)
+        except FileExistsError:
+            pass
+        reuseEtags = reuseEtags or {}
+        futures = [self.executor.submit(self.fetch, artifact, stagingDir, reuseDir if artifact["etag"] and reuseEtags.get(artifact["name"], None) == artifact["etag"] else None) for artifact in artifacts]
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(str(e))
+        if errors:
+            raise ModelDownloadFailed("Failed to download {0} of {1} files: {2}".format(len(errors), len(artifacts), "; ".join(errors)))
+        return {artifact["name"]: artifact["etag"] for artifact in artifacts}
+
+    def fetch(self, artifact, stagingDir, reuseDir=None):
+        finalPath = os.path.join(stagingDir, artifact["name"])
+        if os.path.isfile(finalPath) and self.isComplete(finalPath, artifact):
+            return
+        if reuseDir and os.path.isfile(os.path.join(reuseDir, artifact["name"])):
+            shutil.copyfile(os.path.join(reuseDir, artifact["name"]), finalPath)
+            if self.isComplete(finalPath, artifact):
+                self.count("reused")
+                return
+        partPath = os.path.join(stagingDir, artifact["path"].split("/")[-1] + ".part")
+        lastError = None
+        for attempt in range(self.retries):
+            if attempt:
+                self.count("retries")
+                time.sleep(self.retryDelay*attempt)
+            try:
+                # A part left by an earlier attempt or an earlier watcher cycle is resumed from where it stopped
+                offset = os.path.getsize(partPath) if os.path.isfile(partPath) else 0
+                if artifact["blobSize"] is not None and offset > artifact["blobSize"]:
+                    os.remove(partPath)
+                    offset = 0
+                if artifact["blobSize"] is None or offset < artifact["blobSize"]:
+                    if offset:
+                        self.count("resumed")
+                    self.store.downloadFile(artifact["path"], partPath, offset)
+                if artifact["blobSize"] is not None and os.path.getsize(partPath) != artifact["blobSize"]:
+                    raise ModelDownloadFailed("{0} has {1} bytes, expected {2}".format(artifact["path"], os.path.getsize(partPath), artifact["blobSize"]))
+                self.unpack(artifact, partPath, finalPath)
+                os.remove(partPath)
+                self.count("downloaded")
+                self.count("bytes", artifact["blobSize"] or 0)
+                return
+            except ChecksumMismatch as e:
+                # The part itself is bad, resuming it would fail again
+                self.count("checksumFailures")
+                for path in (partPath, finalPath):
+                    if os.path.isfile(path):
+                        os.remove(path)
+                lastError = e
+            except Exception as e:
+                lastError = e
+        raise ModelDownloadFailed("{0}: {1}".format(artifact["path"], str(lastError)))
+
+    # Decompresses while hashing, so the content is only read once
+    def unpack(self, artifact, partPath, finalPath):
+        digest = hashlib.sha256()
+        size = 0
+        tempPath = finalPath + ".tmp"
+        with openArtifact(partPath, artifact["compression"]) as src, open(tempPath, "wb") as dst:
+            while True:
+                chunk = src.read(chunkSize)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                dst.write(chunk)
+        if (artifact["size"] is not None and size != artifact["size"]) or (artifact["sha256"] and digest.hexdigest() != artifact["sha256"]):
+            os.remove(tempPath)
+            raise ChecksumMismatch("{0} failed verification, got {1} bytes with sha256 {2}".format(artifact["path"], size, digest.hexdigest()))
+        os.replace(tempPath, finalPath)
+
+    def isComplete(self, path, artifact):
+        if artifact["size"] is not None and os.path.getsize(path) != artifact["size"]:
+            return False
+        if artifact["sha256"]:
+            digest = hashlib.sha256()
+            with open(path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(chunkSize), b""):
+                    digest.update(chunk)
+            return digest.hexdigest() == artifact["sha256"]
+        return True
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+# Moves the verified stagingDir to targetDir, a version folder that isn't being served yet
+def publishStaged(stagingDir, targetDir):
+    if os.path.isdir(targetDir):
+        shutil.rmtree(targetDir)
+    os.rename(stagingDir, targetDir)
@@ -5,4 +5,7 @@ class ModelInfo:
         self.modelType = modelInfo.get("modelType", "TfIdfSearchModel")
         self.detectorContentSplitted = modelInfo.get("detectorContentSplitted", False)
         self.textNGrams = modelInfo.get("textNGrams", 1)
-        self.splitDictionary = modelInfo.get("splitDictionary", False)
\ No newline at end of file
+        self.splitDictionary = modelInfo.get("splitDictionary", False)
+        self.mmapArrays = modelInfo.get("mmapArrays", False)
+        self.embeddings = modelInfo.get("embeddings", False)
+        self.indexTypes = modelInfo.get("indexTypes", {})
\ No newline at end of file
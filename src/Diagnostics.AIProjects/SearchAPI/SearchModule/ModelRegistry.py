@@ -0,0 +1,207 @@
+import os, time, threading
+from collections import OrderedDict
+
+# Size of a model package on disk, used as the footprint estimate of the loaded model
+def getFolderSize(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return size
+
+# Immutable view of a product's model that a request pins for as long as it uses it. A refresh publishes a new
+# snapshot and retires the old one, which is closed when the last request holding it releases it.
+class ModelSnapshot:
+    def __init__(self, productId, model, onClose=None):
+        self.productId = productId
+        self.model = model
+        self.trainingId = getattr(model, "trainingId", None)
+        self.packagePath = getattr(model, "packagePath", None)
+        # The registry holds the first reference until the snapshot is retired
+        self.refCount = 1
+        self.closed = False
+        self.onClose = onClose
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.refCount == 0:
+                return False
+            self.refCount += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.refCount -= 1
+            if self.refCount > 0 or self.closed:
+                return
+            self.closed = True
+        model = self.model
+        self.model = None
+        if self.onClose:
+            self.onClose(self, model)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+class ModelEntry:
+    def __init__(self, snapshot, size, loadTime):
+        self.snapshot = snapshot
+        self.size = size
+        self.loadTime = loadTime
+        self.loadedAt = time.time()
+        self.lastUsed = self.loadedAt
+        self.hits = 0
+
+    @property
+    def model(self):
+        return self.snapshot.model
+
+# Loaded models by productId, kept under a memory budget by evicting the least recently used unpinned products
+class ModelRegistry:
+    def __init__(self, config=None):
+        self.config = config if config is not None else {}
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.loadLocks = {}
+        self.evictions = 0
+        # Snapshots that were published and aren't closed yet, including retired ones still pinned by requests
+        self.liveSnapshots = set()
+        self.snapshotsClosed = 0
+        # Called with the product and model of every closed snapshot
+        self.onClose = None
+
+    def getMemoryBudget(self):
+        return int(self.config.get("MODEL_MEMORY_BUDGET_MB", 0) or 0)*1024*1024
+
+    def getPinnedProducts(self):
+        pinned = self.config.get("PINNED_PRODUCTS", None) or ""
+        return set([x.strip() for x in pinned.split(",") if x.strip()])
+
+    def isPinned(self, productId):
+        return productId in self.getPinnedProducts()
+
+    # Callers loading the same product hold the same lock so only one of them does the work
+    def getLoadLock(self, productId):
+        with self.lock:
+            if productId not in self.loadLocks:
+                self.loadLocks[productId] = threading.Lock()
+            return self.loadLocks[productId]
+
+    def __contains__(self, productId):
+        with self.lock:
+            return productId in self.entries
+
+    def __getitem__(self, productId):
+        with self.lock:
+            entry = self.touch(productId)
+            return entry.model
+
+    def __setitem__(self, productId, model):
+        self.put(productId, model)
+
+    def __delitem__(self, productId):
+        if not self.evict(productId):
+            raise KeyError(productId)
+
+    def get(self, productId, default=None):
+        try:
+            return self[productId]
+        except KeyError:
+            return default
+
+    def touch(self, productId):
+        entry = self.entries[productId]
+        self.entries.move_to_end(productId)
+        entry.hits += 1
+        entry.lastUsed = time.time()
+        return entry
+
+    # Pins the current snapshot of a product, None when it isn't loaded. The caller releases it when done.
+    def acquire(self, productId):
+        with self.lock:
+            entry = self.entries.get(productId, None)
+            if not entry:
+                return None
+            self.touch(productId)
+            # Can't fail, the registry's own reference keeps the snapshot open while it is current
+            entry.snapshot.acquire()
+            return entry.snapshot
+
+    # Looks up a model without counting a hit or refreshing its position
+    def peek(self, productId):
+        with self.lock:
+            entry = self.entries.get(productId, None)
+            return entry.model if entry else None
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    # Package folders of the product's snapshots that are still open
+    def livePackagePaths(self, productId):
+        with self.lock:
+            return [x.packagePath for x in self.liveSnapshots if x.productId == productId and x.packagePath]
+
+    def closeSnapshot(self, snapshot, model):
+        with self.lock:
+            self.liveSnapshots.discard(snapshot)
+            self.snapshotsClosed += 1
+        if self.onClose:
+            self.onClose(snapshot.productId, model)
+
+    def put(self, productId, model, size=0, loadTime=0):
+        with self.lock:
+            previous = self.entries.get(productId, None)
+            entry = ModelEntry(ModelSnapshot(productId, model, self.closeSnapshot), size, loadTime)
+            self.liveSnapshots.add(entry.snapshot)
+            if previous:
+                entry.hits = previous.hits
+            self.entries[productId] = entry
+            self.entries.move_to_end(productId)
+            retired = self.popOverBudget(keep=productId)
+        # Retired snapshots are released outside the lock, closing one can remove its folder
+        for x in ([previous] if previous else []) + retired:
+            x.snapshot.release()
+        return [x.snapshot.productId for x in retired]
+
+    def evict(self, productId):
+        with self.lock:
+            entry = self.entries.pop(productId, None)
+        if entry:
+            entry.snapshot.release()
+        return entry is not None
+
+    def enforceBudget(self, keep=None):
+        with self.lock:
+            retired = self.popOverBudget(keep)
+        for entry in retired:
+            entry.snapshot.release()
+        return [x.snapshot.productId for x in retired]
+
+    # Removes the least recently used unpinned entries until the rest fit in the budget, the caller releases them
+    def popOverBudget(self, keep=None):
+        retired = []
+        budget = self.getMemoryBudget()
+        if not budget:
+            return retired
+        pinned = self.getPinnedProducts()
+        for productId in list(self.entries.keys()):
+            if sum([x.size for x in self.entries.values()]) <= budget:
+                break
+            if productId == keep or productId in pinned:
+                continue
+            retired.append(self.entries.pop(productId))
+            self.evictions += 1
+        return retired
+
+    def stats(self):
+        with self.lock:
+            models = {productId: {"trainingId": entry.snapshot.trainingId, "size": entry.size, "loadTime": entry.loadTime, "loadedAt": entry.loadedAt, "hits": entry.hits, "lastUsed": entry.lastUsed, "pinned": self.isPinned(productId), "references": entry.snapshot.refCount-1} for productId, entry in self.entries.items()}
+            return {"memoryBudget": self.getMemoryBudget(), "memoryUsed": sum([x.size for x in self.entries.values()]), "evictions": self.evictions, "retiredSnapshots": len(self.liveSnapshots)-len(self.entries), "snapshotsClosed": self.snapshotsClosed, "models": models}
@@ -0,0 +1,104 @@
+import os, shutil
+
+# Where published models live. Paths use the blob layout {productId}/models/{version}/{file},
+# plus a {productId}/latest.json manifest written by the trainer when a version is published.
+class ModelStore:
+    # ETag of a file, None when it doesn't exist
+    def getEtag(self, path):
+        raise NotImplementedError()
+
+    # (text, etag) of a file, (None, None) when it doesn't exist
+    def readText(self, path):
+        raise NotImplementedError()
+
+    # Files directly under a folder prefix as (path, etag, size)
+    def listFiles(self, prefix):
+        raise NotImplementedError()
+
+    # Names of the folders directly under a folder prefix
+    def listFolders(self, prefix):
+        raise NotImplementedError()
+
+    # Appends to destPath from startRange onwards when resuming a partial download
+    def downloadFile(self, path, destPath, startRange=0):
+        raise NotImplementedError()
+
+class AzureModelStore(ModelStore):
+    def __init__(self, accountName, accountKey, containerName):
+        from azure.storage.blob import BlockBlobService
+        self.blob_service = BlockBlobService(account_name=accountName, account_key=accountKey)
+        self.containerName = containerName
+
+    def getEtag(self, path):
+        try:
+            return self.blob_service.get_blob_properties(self.containerName, path).properties.etag
+        except Exception:
+            return None
+
+    def readText(self, path):
+        try:
+            blob = self.blob_service.get_blob_to_text(self.containerName, path)
+            return blob.content, blob.properties.etag
+        except Exception:
+            return None, None
+
+    def listFiles(self, prefix):
+        # The delimiter keeps the listing to this folder, sub folders come back as prefixes without properties
+        return [(blob.name, blob.properties.etag, blob.properties.content_length) for blob in self.blob_service.list_blobs(self.containerName, prefix=prefix, delimiter="/") if hasattr(blob, "properties")]
+
+    def listFolders(self, prefix):
+        return [blob.name[len(prefix):].strip("/") for blob in self.blob_service.list_blobs(self.containerName, prefix=prefix, delimiter="/") if not hasattr(blob, "properties")]
+
+    def downloadFile(self, path, destPath, startRange=0):
+        self.blob_service.get_blob_to_path(self.containerName, path, destPath, open_mode="ab" if startRange else "wb", start_range=startRange or None)
+
+# Folder with the same layout as the storage container, for tests and local runs
+class LocalModelStore(ModelStore):
+    def __init__(self, root):
+        self.root = root
+
+    def localPath(self, path):
+        return os.path.join(self.root, *[x for x in path.split("/") if x])
+
+    def getEtag(self, path):
+        try:
+            stat = os.stat(self.localPath(path))
+            return "{0}-{1}".format(stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def readText(self, path):
+        etag = self.getEtag(path)
+        if not etag:
+            return None, None
+        with open(self.localPath(path), "r") as fp:
+            return fp.read(), etag
+
+    def listFiles(self, prefix):
+        folder = self.localPath(prefix)
+        if not os.path.isdir(folder):
+            return []
+        files = []
+        for name in os.listdir(folder):
+            path = prefix.rstrip("/") + "/" + name
+            if os.path.isfile(self.localPath(path)):
+                files.append((path, self.getEtag(path), os.path.getsize(self.localPath(path))))
+        return files
+
+    def listFolders(self, prefix):
+        folder = self.localPath(prefix)
+        if not os.path.isdir(folder):
+            return []
+        return [name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder, name))]
+
+    def downloadFile(self, path, destPath, startRange=0):
+        with open(self.localPath(path), "rb") as src, open(destPath, "ab" if startRange else "wb") as dst:
+            src.seek(startRange)
+            shutil.copyfileobj(src, dst)
+
+def createModelStore(config):
+    if config.get("MODEL_STORE_PATH", None):
+        return LocalModelStore(config["MODEL_STORE_PATH"])
+    if config.get("STORAGE_ACCOUNT_NAME", None) and config.get("STORAGE_ACCOUNT_KEY", None):
+        return AzureModelStore(config["STORAGE_ACCOUNT_NAME"], config["STORAGE_ACCOUNT_KEY"], config["STORAGE_ACCOUNT_CONTAINER_NAME"])
+    return None
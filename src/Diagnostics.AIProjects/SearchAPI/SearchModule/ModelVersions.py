@@ -0,0 +1,95 @@
+import os, json, shutil
+from SearchModule import app
+from SearchModule.Utilities import absPath, modelsPath
+
+# Every downloaded version of a product lives in its own folder models/{productId}/{version} and is never
+# modified after it is moved there. current.txt names the version being served and is flipped with a rename.
+pointerFile = "current.txt"
+defaultSmokeQueries = ["app is slow and returns http 500 errors", "high cpu usage", "cannot connect to database", "ssl certificate expired", "deployment failed"]
+
+def productPath(productId):
+    return absPath(os.path.join(app.config.get("TRAINED_MODELS_PATH", modelsPath), productId))
+
+def versionPath(productId, version):
+    return os.path.join(productPath(productId), version)
+
+# Downloaded versions, oldest first
+def listVersions(productId):
+    path = productPath(productId)
+    if not os.path.isdir(path):
+        return []
+    return sorted([x for x in os.listdir(path) if x.isdigit() and os.path.isdir(os.path.join(path, x))], key=int)
+
+def getCurrentVersion(productId):
+    try:
+        return open(os.path.join(productPath(productId), pointerFile)).read().strip() or None
+    except OSError:
+        return None
+
+def setCurrentVersion(productId, version):
+    tempPath = os.path.join(productPath(productId), pointerFile + ".tmp")
+    with open(tempPath, "w") as fp:
+        fp.write(version)
+    os.replace(tempPath, os.path.join(productPath(productId), pointerFile))
+
+# Folder the product is served from. Before versioned folders, models were downloaded straight into
+# models/{productId} and copied to SearchModule/{productId}, those are used until a version is current.
+def getCurrentPath(productId):
+    version = getCurrentVersion(productId)
+    if version and os.path.isdir(versionPath(productId, version)):
+        return versionPath(productId, version)
+    if os.path.isfile(os.path.join(productPath(productId), "ModelInfo.json")):
+        return productPath(productId)
+    if os.path.isdir(absPath(os.path.join("SearchModule", productId))):
+        return absPath(os.path.join("SearchModule", productId))
+    return None
+
+def getCurrentTrainingId(productId):
+    path = getCurrentPath(productId)
+    try:
+        return open(os.path.join(path, "trainingId.txt")).read().strip() if path else None
+    except OSError:
+        return None
+
+# Removes versions other than the current one, the newest `keep` and the folders still in use. Folders that are
+# still open, e.g. memory mapped by a model serving in-flight requests on Windows, are retried on the next pass.
+def collectVersions(productId, keep=2, inUse=()):
+    current = getCurrentVersion(productId)
+    if not current:
+        return []
+    versions = listVersions(productId)
+    inUse = set([os.path.normcase(os.path.abspath(x)) for x in inUse if x])
+    kept = set(versions[-keep:] if keep > 0 else []) | set([current])
+    removed = []
+    for version in versions:
+        path = versionPath(productId, version)
+        if version in kept or os.path.normcase(path) in inUse:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.isdir(path):
+            removed.append(version)
+    # Layouts from before versioned folders. The pointer's temp file belongs to a switch that may be in progress,
+    # this runs from snapshot releases without the product's load lock.
+    for name in os.listdir(productPath(productId)):
+        path = os.path.join(productPath(productId), name)
+        if os.path.isfile(path) and name not in (pointerFile, pointerFile + ".tmp") and os.path.normcase(productPath(productId)) not in inUse:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    legacyPath = absPath(os.path.join("SearchModule", productId))
+    if os.path.isdir(legacyPath) and os.path.normcase(legacyPath) not in inUse:
+        shutil.rmtree(legacyPath, ignore_errors=True)
+    return removed
+
+# A few queries run against a freshly loaded version before it is published. The package's own test cases are
+# used when it carries them, otherwise a fixed set that only has to run without errors.
+def getSmokeQueries(modelpackagepath, count=5):
+    try:
+        testCases = json.loads(open(os.path.join(modelpackagepath, "testCases.json"), "r").read())
+        queries = [t["query"] for t in testCases if t.get("query", None)][:count]
+        if queries:
+            return queries, True
+    except Exception:
+        pass
+    return defaultSmokeQueries[:count], False
@@ -0,0 +1,57 @@
+import time, threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from SearchModule import app
+
+executor = None
+executorLock = threading.Lock()
+
+# Shared by all requests, created on first use so pre-forked workers each get their own threads
+def getExecutor():
+    global executor
+    with executorLock:
+        if not executor:
+            executor = ThreadPoolExecutor(max_workers=app.config.get("DEPENDENCY_POOL_SIZE", 32))
+    return executor
+
+# Runs the dependency calls of one request concurrently and records how each of them finished
+class RequestPipeline:
+    def __init__(self):
+        self.startTime = time.monotonic()
+        self.calls = {}
+        self.status = {}
+        self.errors = {}
+
+    def submit(self, name, fn, *args, **kwargs):
+        self.calls[name] = getExecutor().submit(fn, *args, **kwargs)
+        self.status[name] = "pending"
+
+    def skip(self, name):
+        self.record(name, "skipped")
+
+    # For parts that were served without making the call
+    def record(self, name, status):
+        self.calls.pop(name, None)
+        self.status[name] = status
+
+    # Time left of a budget counted from the start of the request
+    def remaining(self, budget):
+        if budget is None:
+            return None
+        return max(0, budget - (time.monotonic() - self.startTime))
+
+    def done(self, name):
+        return name in self.calls and self.calls[name].done()
+
+    # Waits for a call until the budget runs out, a call that misses it keeps running but its result is dropped
+    def result(self, name, budget=None, default=None):
+        try:
+            value = self.calls[name].result(timeout=self.remaining(budget))
+            self.status[name] = "completed"
+            return value
+        except FutureTimeoutError:
+            self.status[name] = "timedout"
+            self.errors[name] = f"Timed out after {budget} seconds"
+        except Exception as e:
+            self.status[name] = "failed"
+            self.errors[name] = str(e)
+        return default
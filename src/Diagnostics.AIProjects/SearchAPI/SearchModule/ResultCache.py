@@ -0,0 +1,145 @@
+import time, threading, json, ipaddress
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+
+# Bounded LRU cache with an optional time to live, entries can also carry their own absolute expiry
+class TtlLruCache:
+    def __init__(self, maxSize=1024, ttl=None):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[1] is not None and entry[1] <= time.time():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, expiresAt=None):
+        ttl = ttl if ttl is not None else self.ttl
+        if expiresAt is None and ttl:
+            expiresAt = time.time() + ttl
+        with self.lock:
+            self.entries[key] = (value, expiresAt)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxSize": self.maxSize, "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations}
+
+#### Cache shared by all worker processes on a box, served over a local socket ####
+sharedCache = None
+
+def getSharedCache():
+    return sharedCache
+
+def initSharedCache(maxSize, ttl):
+    global sharedCache
+    sharedCache = TtlLruCache(maxSize, ttl)
+
+class SharedCacheManager(BaseManager):
+    pass
+SharedCacheManager.register("getCache", callable=getSharedCache)
+
+# The manager exchanges pickles, which run code when loaded, so it only listens on the loopback interface
+def parseAddress(address):
+    host, port = address.rsplit(":", 1)
+    host = host.strip("[]")
+    try:
+        loopback = host == "localhost" or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise Exception("Shared query cache address {0} is not a loopback address".format(address))
+    return (host, int(port))
+
+# Connections are only accepted from processes that know the key, an empty key would let anyone in
+def encodeAuthkey(authkey):
+    if not authkey:
+        raise Exception("QUERY_CACHE_AUTHKEY is not set, the shared query cache needs one")
+    return authkey.encode()
+
+# Starts the cache server process, to be called once per box before the workers connect
+def serveSharedCache(address, authkey, maxSize=1024, ttl=None):
+    manager = SharedCacheManager(address=parseAddress(address), authkey=encodeAuthkey(authkey))
+    manager.start(initSharedCache, (maxSize, ttl))
+    return manager
+
+def connectSharedCache(address, authkey):
+    manager = SharedCacheManager(address=parseAddress(address), authkey=encodeAuthkey(authkey))
+    manager.connect()
+    return manager.getCache()
+
+#### Search results cache keyed by product, model version and normalized query ####
+class QueryResultCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.errors = 0
+
+    def buildKey(self, productId, trainingId, query):
+        return "{0}|{1}|{2}".format(productId, trainingId, query)
+
+    def get(self, productId, trainingId, query):
+        if not trainingId:
+            return None
+        try:
+            value = self.backend.get(self.buildKey(productId, trainingId, query))
+        except Exception:
+            self.errors += 1
+            return None
+        # Results are stored serialized so callers always get their own copy to modify
+        return json.loads(value) if value else None
+
+    def set(self, productId, trainingId, query, results):
+        if not trainingId:
+            return
+        try:
+            self.backend.set(self.buildKey(productId, trainingId, query), json.dumps(results))
+        except Exception:
+            self.errors += 1
+
+    def stats(self):
+        try:
+            stats = self.backend.stats()
+        except Exception:
+            stats = {}
+        stats["errors"] = self.errors
+        return stats
+
+def createQueryResultCache(config, logger=None):
+    backend = None
+    address = config.get("QUERY_CACHE_ADDRESS", None)
+    if address:
+        try:
+            backend = connectSharedCache(address, config.get("QUERY_CACHE_AUTHKEY", None))
+        except Exception as e:
+            if logger:
+                logger.logHandledException("queryCache", Exception("Failed to connect to shared query cache at {0}, using an in-process cache: {1}".format(address, str(e))))
+    if not backend:
+        backend = TtlLruCache(config.get("QUERY_CACHE_SIZE", 4096), config.get("QUERY_CACHE_TTL", 3600))
+    return QueryResultCache(backend)
@@ -0,0 +1,63 @@
+import numpy as np
+
+# Select the best scoring rows of a similarity vector without sorting the whole vector.
+# Returns (indices, scores) ordered by descending score, ties broken by lower index.
+def topK(similarities, k=None, threshold=None):
+    scores = np.asarray(similarities).ravel()
+    if threshold is not None:
+        indices = np.flatnonzero(scores > threshold)
+        scores = scores[indices]
+    else:
+        indices = np.arange(scores.shape[0])
+    if k is not None and k < scores.shape[0]:
+        if k <= 0:
+            return indices[:0], scores[:0]
+        kth = scores[np.argpartition(scores, scores.shape[0]-k)[scores.shape[0]-k]]
+        candidates = np.flatnonzero(scores >= kth)
+        indices, scores = indices[candidates], scores[candidates]
+    order = np.argsort(-scores, kind="stable")
+    if k is not None:
+        order = order[:k]
+    return indices[order], scores[order]
+
+# Same as topK but skips rows rejected by keep(index), widening the partial selection until k rows survive
+def topKFiltered(similarities, k, keep):
+    scores = np.asarray(similarities).ravel()
+    limit = k
+    while True:
+        indices, selectedScores = topK(scores, limit)
+        selected = [i for i in range(len(indices)) if keep(indices[i])][:k]
+        if len(selected) >= k or len(indices) < limit:
+            return indices[selected], selectedScores[selected]
+        limit *= 2
+
+# Dense row -> detector layout of a detectorContentSplitted index, built once from Mappings.json
+class DetectorSegments:
+    def __init__(self, mappings, numRows):
+        mappings = [x for x in mappings if x["startindex"] < numRows and x["startindex"] <= x["endindex"]]
+        self.detectorIds = [x["id"] for x in mappings]
+        starts = np.array([x["startindex"] for x in mappings], dtype=np.int64)
+        ends = np.minimum(np.array([x["endindex"] for x in mappings], dtype=np.int64), numRows-1)
+        self.rowDetectors = np.full(numRows, -1, dtype=np.int64)
+        for i in range(len(mappings)):
+            self.rowDetectors[starts[i]:ends[i]+1] = i
+        self.boundaries = np.unique(np.concatenate([starts, ends+1]))
+        self.boundaries = self.boundaries[self.boundaries < numRows]
+        self.segmentOf = np.searchsorted(self.boundaries, starts)
+        self.starts, self.ends = starts, ends
+        # Overlapping ranges can't be expressed as one segment per detector
+        order = np.argsort(starts, kind="stable")
+        self.overlapping = bool(np.any(starts[order][1:] <= ends[order][:-1]))
+
+    def detectorAt(self, index):
+        detector = self.rowDetectors[index] if 0 <= index < len(self.rowDetectors) else -1
+        return self.detectorIds[detector] if detector >= 0 else None
+
+    # Maximum row score of every detector, along the last axis so query batches work as well
+    def aggregate(self, similarities):
+        scores = np.asarray(similarities)
+        if not self.detectorIds:
+            return np.zeros(scores.shape[:-1] + (0,), dtype=scores.dtype)
+        if self.overlapping:
+            return np.stack([scores[..., self.starts[i]:self.ends[i]+1].max(axis=-1) for i in range(len(self.detectorIds))], axis=-1)
+        return np.maximum.reduceat(scores, self.boundaries, axis=-1)[..., self.segmentOf]
@@ -0,0 +1,99 @@
+import time, threading
+from concurrent.futures import ThreadPoolExecutor
+from SearchModule import app
+from SearchModule.StorageAccountHelper import StorageAccountHelper
+from SearchModule.TextSearchModule import loadModel, loaded_models
+from SearchModule.ModelVersions import getCurrentPath, getSmokeQueries
+
+modelSyncInterval = 5*60
+
+# Brings every product up when the process starts: downloads, loads and warms them in parallel, then keeps
+# watching for new models. Readiness is tracked per product so the load balancer only sees warm instances.
+class StartupOrchestrator:
+    def __init__(self, productIds, logger, watcher=None):
+        self.productIds = list(set(productIds))
+        self.loggerInstance = logger
+        self.watcher = watcher
+        self.states = {productId: {"state": "pending", "trainingId": None, "error": None, "loadTime": None, "warmupTime": None} for productId in self.productIds}
+        self.settled = False
+        self.startedAt = time.time()
+        self.readyAt = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def setState(self, productId, state, **values):
+        with self.lock:
+            self.states[productId]["state"] = state
+            self.states[productId].update(values)
+
+    # Runs in the background and returns immediately, requests are served while products come up
+    def start(self, watch=True):
+        self.thread = threading.Thread(target=self.run, args=(watch,), daemon=True)
+        self.thread.start()
+
+    def run(self, watch=True):
+        self.prepare()
+        while watch and self.watcher:
+            time.sleep(modelSyncInterval)
+            try:
+                self.watcher.syncModels(self.productIds)
+            except Exception as e:
+                self.loggerInstance.logHandledException("modelRefreshTask", Exception(f"Model sync failed: {str(e)}"))
+
+    # Blocks until every product is ready or has failed
+    def prepare(self):
+        if app.config.get("MODEL_SYNC_ENABLED", True) and not self.watcher:
+            try:
+                watcher = StorageAccountHelper(self.loggerInstance)
+                watcher.connect(self.productIds)
+                self.watcher = watcher
+            except Exception as e:
+                self.loggerInstance.logHandledException("startupTask", Exception(f"Model sync is unavailable, starting with the models on disk: {str(e)}"))
+        self.loggerInstance.logInsights("startupTask: Starting {0}".format(','.join(self.productIds)))
+        # Pinned products are the ones most likely to stay resident under the memory budget, they go first
+        productIds = sorted(self.productIds, key=lambda x: not loaded_models.isPinned(x))
+        with ThreadPoolExecutor(max_workers=max(1, app.config.get("STARTUP_CONCURRENCY", 4))) as executor:
+            list(executor.map(self.prepareProduct, productIds))
+        with self.lock:
+            self.settled = True
+            self.readyAt = time.time()
+        self.loggerInstance.logInsights("startupTask: Search service startup {0} in {1:.1f}s".format("succeeded" if self.isReady() else "finished with failures", self.readyAt - self.startedAt))
+
+    def prepareProduct(self, productId):
+        try:
+            if self.watcher:
+                self.setState(productId, "syncing")
+                # A model downloaded now is published by the refresh that verified it, so loadModel finds it loaded
+                self.watcher.syncProduct(productId, publish=True)
+            if not getCurrentPath(productId):
+                self.setState(productId, "unavailable", error="No model has been published for this product")
+                return
+            self.setState(productId, "loading")
+            startTime = time.time()
+            model = loadModel(productId)
+            loadTime = time.time() - startTime
+            self.setState(productId, "warming", trainingId=model.trainingId, loadTime=round(loadTime, 3))
+            # Primes the tokenizer and lemmatizer caches and pages in the model files
+            queries = getSmokeQueries(model.packagePath, app.config.get("STARTUP_WARMUP_QUERY_COUNT", 5))[0]
+            startTime = time.time()
+            model.queryDetectorsBatch(queries)
+            self.setState(productId, "ready", warmupTime=round(time.time() - startTime, 3))
+        except Exception as e:
+            self.setState(productId, "failed", error=str(e))
+            self.loggerInstance.logHandledException("startupTask", Exception(f"Failed to start product {productId}: {str(e)}"))
+
+    # Ready once every product settled, all pinned products are warm and at least one product can serve.
+    # Other products that failed are reported but don't take the instance out of rotation.
+    def isReady(self):
+        with self.lock:
+            if not self.settled:
+                return False
+            states = dict([(productId, x["state"]) for productId, x in self.states.items()])
+        if any([states.get(productId, "ready") != "ready" for productId in loaded_models.getPinnedProducts() if productId in states]):
+            return False
+        return any([x == "ready" for x in states.values()])
+
+    def status(self):
+        ready = self.isReady()
+        with self.lock:
+            return {"ready": ready, "settled": self.settled, "startedAt": self.startedAt, "readyAt": self.readyAt, "products": dict([(productId, dict(x)) for productId, x in self.states.items()])}
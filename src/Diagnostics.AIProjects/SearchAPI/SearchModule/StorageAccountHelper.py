@@ -1,78 +1,135 @@
-import os, datetime, pytz, time
-from azure.storage.blob import BlockBlobService
+import os, json, time, shutil, threading
+from concurrent.futures import ThreadPoolExecutor
 from SearchModule import app
-import pythoncom
-from SearchModule.TextSearchModule import refreshModel, loaded_models, loadModel
+try:
+	import pythoncom
+except ImportError:
+	pythoncom = None
+from SearchModule.ModelStore import createModelStore
+from SearchModule.ModelDownloader import ModelDownloader, getArtifacts, publishStaged
+from SearchModule.ModelVersions import productPath, versionPath, getCurrentPath, getCurrentTrainingId
+from SearchModule.TextSearchModule import refreshModel, loaded_models, loadModel, collectModelVersions
 
 class StorageAccountHelper:
-	def __init__(self, logger):
+	def __init__(self, logger, store=None):
 		self.firstTime = {}
 		self.loggerInstance = logger
-		self.blob_service = None
-	
+		self.store = store
+		# Last seen manifest of every product with its etag, and the etags of the files downloaded for it
+		self.manifests = {}
+		self.downloadedEtags = {}
+		self.downloader = None
+		self.lock = threading.Lock()
+
 	def watchModels(self, productIds):
 		# Run coinitialize for the new thread to be able to log
-		pythoncom.CoInitialize()
+		if pythoncom:
+			pythoncom.CoInitialize()
 		productIds = list(set(productIds))
-		if ("STORAGE_ACCOUNT_NAME" in app.config and app.config["STORAGE_ACCOUNT_NAME"]) and ("STORAGE_ACCOUNT_KEY" in app.config and app.config["STORAGE_ACCOUNT_KEY"]):
-			self.blob_service = BlockBlobService(account_name=app.config["STORAGE_ACCOUNT_NAME"], account_key=app.config["STORAGE_ACCOUNT_KEY"])
-		else:
+		self.connect(productIds)
+		while True:
+			self.syncModels(productIds)
+			time.sleep(5*60)
+
+	def connect(self, productIds):
+		if not self.store:
+			self.store = createModelStore(app.config)
+		if not self.store:
 			self.loggerInstance.logHandledException("modelRefreshTask", Exception("Failed to read storage account name and key values from configurations"))
 			raise Exception('Failed to read storage account name and key values from configurations')
+		if not self.downloader:
+			self.downloader = ModelDownloader(self.store, app.config.get("MODEL_DOWNLOAD_WORKERS", 4), app.config.get("MODEL_DOWNLOAD_RETRIES", 3))
 		for productId in productIds:
 			self.firstTime[productId] = True
-		while True:
-			for productId in productIds:
-				modelOnDisk = None
-				try:
-					modelOnDisk = open(os.path.join(os.getcwd(), app.config["TRAINED_MODELS_PATH"], productId, "trainingId.txt")).read().strip()
-				except:
-					pass
-				loadedModelId = None
-				try:
-					loadedModelId = loaded_models[productId].trainingId
-				except KeyError:
-					pass
-				self.loggerInstance.logInsights("modelRefreshTask: Running model watcher for {0}".format(productId))
-				copyAndRefresh = False
-				try:
-					now = datetime.datetime.now(pytz.utc)
-					if self.blob_service:
-						allblobsList = [blob for blob in list(self.blob_service.list_blobs(app.config["STORAGE_ACCOUNT_CONTAINER_NAME"])) if blob.name.startswith("{0}/models".format(productId))]
-						if not len(allblobsList)>0:
-							self.firstTime[productId] = False
-							continue
-						folders = list(set([int(blob.name.split("/")[2]) for blob in allblobsList]))
-						latestFolder = str(max(folders))
-						latestTrainingId = self.blob_service.get_blob_to_text(app.config["STORAGE_ACCOUNT_CONTAINER_NAME"], f"{productId}/models/{latestFolder}/trainingId.txt")
-						if latestTrainingId:
-							latestTrainingId = latestTrainingId.content
-						if modelOnDisk and latestTrainingId and latestTrainingId==modelOnDisk:
-							if modelOnDisk != loadedModelId:
-								try:
-									self.loggerInstance.logInsights("modelReloadTask: Models are changed for {0}. Reloading the latest model.".format(productId))
-									loadModel(productId, None, forced=True)
-								except Exception as e:
-									self.loggerInstance.logHandledException("modelReloadTask", "Failed to reload the latest model: {0}".format(str(e)))
-						else:
-							downloadList = [blob for blob in allblobsList if blob.name.startswith("{0}/models/{1}".format(productId, latestFolder))]
-							for blob in downloadList:
-								blobname = blob.name
-								dirpath = os.path.join(os.getcwd(), app.config["TRAINED_MODELS_PATH"], productId)
-								try:
-									os.makedirs(dirpath)
-								except:
-									pass
-								self.blob_service.get_blob_to_path(app.config["STORAGE_ACCOUNT_CONTAINER_NAME"], blobname, os.path.join(dirpath, blobname.split("/")[-1]))
-								copyAndRefresh = True
-					if self.firstTime[productId]:
-						self.firstTime[productId] = False
-				except Exception as e:
-					pass
-				if copyAndRefresh:
+
+	# One pass over the products, returns the products whose loaded model was reloaded or refreshed
+	def syncModels(self, productIds):
+		with ThreadPoolExecutor(max_workers=max(1, app.config.get("MODEL_SYNC_CONCURRENCY", 4))) as executor:
+			changed = list(executor.map(self.syncProduct, productIds))
+		return [productId for productId, hasChanged in zip(productIds, changed) if hasChanged]
+
+	# Latest published version of a product. Reads the manifest only when its etag changed, and falls back
+	# to listing the product's own models prefix for versions published before manifests existed.
+	def getLatestVersion(self, productId):
+		manifestPath = f"{productId}/latest.json"
+		etag = self.store.getEtag(manifestPath)
+		if etag:
+			with self.lock:
+				cached = self.manifests.get(productId, None)
+			if cached and cached[0] == etag:
+				return cached[1]
+			text, etag = self.store.readText(manifestPath)
+			if text:
+				manifest = json.loads(text)
+				with self.lock:
+					self.manifests[productId] = (etag, manifest)
+				return manifest
+		folders = [int(x) for x in self.store.listFolders(f"{productId}/models/") if x.isdigit()]
+		if not folders:
+			return None
+		version = str(max(folders))
+		trainingId = self.store.readText(f"{productId}/models/{version}/trainingId.txt")[0]
+		return {"version": version, "trainingId": trainingId.strip() if trainingId else None}
+
+	# Downloads a version into its own folder next to the one being served, returns the folder
+	def downloadVersion(self, productId, latest):
+		targetDir = versionPath(productId, latest["version"])
+		if os.path.isfile(os.path.join(targetDir, "trainingId.txt")):
+			return targetDir
+		stagingDir = os.path.join(os.path.dirname(productPath(productId)), ".staging", productId, latest["version"])
+		# Parts of other versions can't be resumed any more
+		if os.path.isdir(os.path.dirname(stagingDir)):
+			for folder in os.listdir(os.path.dirname(stagingDir)):
+				if folder != latest["version"]:
+					shutil.rmtree(os.path.join(os.path.dirname(stagingDir), folder), ignore_errors=True)
+		prefix = f"{productId}/models/{latest['version']}/"
+		blobs = {path: (etag, size) for path, etag, size in self.store.listFiles(prefix)}
+		artifacts = getArtifacts(prefix, latest, blobs)
+		with self.lock:
+			downloaded = self.downloadedEtags.get(productId, {})
+		etags = self.downloader.downloadVersion(artifacts, stagingDir, getCurrentPath(productId), downloaded)
+		os.makedirs(productPath(productId), exist_ok=True)
+		publishStaged(stagingDir, targetDir)
+		with self.lock:
+			self.downloadedEtags[productId] = etags
+		return targetDir
+
+	def syncProduct(self, productId, publish=False):
+		modelOnDisk = getCurrentTrainingId(productId)
+		loadedModel = loaded_models.peek(productId)
+		loadedModelId = loadedModel.trainingId if loadedModel else None
+		self.loggerInstance.logInsights("modelRefreshTask: Running model watcher for {0}".format(productId))
+		copyAndRefresh = False
+		changed = False
+		try:
+			latest = self.getLatestVersion(productId)
+			if not latest:
+				self.firstTime[productId] = False
+				return False
+			latestTrainingId = latest.get("trainingId", None)
+			if modelOnDisk and latestTrainingId and latestTrainingId==modelOnDisk:
+				# Only resident and pinned products are reloaded, the rest load lazily on their first request
+				if modelOnDisk != loadedModelId and (loadedModel or loaded_models.isPinned(productId)):
 					try:
-						self.loggerInstance.logInsights("modelRefreshTask: Models are changed for {0}. Triggering model refresh.".format(productId))
-						refreshModel(productId)
+						self.loggerInstance.logInsights("modelReloadTask: Models are changed for {0}. Reloading the latest model.".format(productId))
+						loadModel(productId, None, forced=True)
+						changed = True
 					except Exception as e:
-						self.loggerInstance.logHandledException("modelRefreshTask", "Failed to refresh model: {0}".format(str(e)))
-			time.sleep(5*60)
\ No newline at end of file
+						self.loggerInstance.logHandledException("modelReloadTask", "Failed to reload the latest model: {0}".format(str(e)))
+			else:
+				self.downloadVersion(productId, latest)
+				copyAndRefresh = latest["version"]
+			if self.firstTime[productId]:
+				self.firstTime[productId] = False
+		except Exception as e:
+			self.loggerInstance.logHandledException("modelRefreshTask", Exception("Failed to sync models for {0}: {1}".format(productId, str(e))))
+		if copyAndRefresh:
+			try:
+				self.loggerInstance.logInsights("modelRefreshTask: Models are changed for {0}. Triggering model refresh.".format(productId))
+				changed = refreshModel(productId, copyAndRefresh, publish).startswith("Model Refreshed")
+			except Exception as e:
+				self.loggerInstance.logHandledException("modelRefreshTask", "Failed to refresh model: {0}".format(str(e)))
+		else:
+			# Retries removing old versions that were still in use at the last refresh
+			collectModelVersions(productId)
+		return changed
@@ -0,0 +1,154 @@
+import os, sys, json, time, random, atexit, threading
+from collections import deque
+
+# Lower value is more important, low priority events are the first to go when the queue fills up
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+LOW_PRIORITY = 2
+
+def truncate(content, maxLength):
+    if maxLength and isinstance(content, str) and len(content) > maxLength:
+        return content[:maxLength] + "...[truncated {0} chars]".format(len(content) - maxLength)
+    return content
+
+#### Sinks, each receives batches of events from the flusher thread ####
+class EtwSink:
+    def open(self):
+        # Windows event log needs COM initialized on the thread that writes to it
+        import pythoncom
+        pythoncom.CoInitialize()
+        from SearchModule.ETWProvider import log
+        self.log = log
+
+    def write(self, events):
+        for event in events:
+            self.log(event["eventId"], event["category"], [event["content"]], "")
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.path = path
+
+    def open(self):
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def write(self, events):
+        with open(self.path, "a") as fp:
+            fp.write("".join([json.dumps(event) + "\n" for event in events]))
+
+class StdoutSink:
+    def open(self):
+        pass
+
+    def write(self, events):
+        sys.stdout.write("".join([json.dumps(event) + "\n" for event in events]))
+        sys.stdout.flush()
+
+sinkTypes = {"etw": EtwSink, "jsonl": JsonLinesSink, "stdout": StdoutSink}
+
+# Bounded queue of events written to the sinks in batches by a background thread, so requests never wait on telemetry
+class TelemetryPipeline:
+    def __init__(self, sinks, maxQueueSize=10000, batchSize=200, flushInterval=1.0, maxContentLength=8192, sampleRates=None):
+        self.sinks = sinks
+        self.maxQueueSize = maxQueueSize
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.maxContentLength = maxContentLength
+        self.sampleRates = sampleRates or {}
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "sampledOut": 0, "truncated": 0, "sinkErrors": 0}
+        self.pid = None
+        self.startLock = threading.Lock()
+        atexit.register(self.flush)
+
+    # A forked worker starts with an empty queue and its own flusher thread
+    def ensureStarted(self):
+        with self.startLock:
+            if self.pid == os.getpid():
+                return
+            self.condition = threading.Condition()
+            self.queue = deque()
+            self.openSinks = []
+            self.flusher = threading.Thread(target=self.run, daemon=True)
+            self.pid = os.getpid()
+            self.flusher.start()
+
+    # Counters are updated from request threads, the flusher and atexit
+    def count(self, name, value=1):
+        with self.condition:
+            self.counters[name] += value
+
+    # Content that is serialized JSON can't be cut without breaking it, its producer bounds its fields instead
+    def enqueue(self, event, priority=NORMAL_PRIORITY, truncatable=True):
+        if self.pid != os.getpid():
+            self.ensureStarted()
+        rate = self.sampleRates.get(event["eventType"], 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self.count("sampledOut")
+            return False
+        if truncatable and self.maxContentLength and isinstance(event["content"], str) and len(event["content"]) > self.maxContentLength:
+            event["content"] = truncate(event["content"], self.maxContentLength)
+            self.count("truncated")
+        with self.condition:
+            # Low priority events only get the first 80% of the queue, the rest is kept for errors and summaries
+            limit = self.maxQueueSize if priority < LOW_PRIORITY else int(self.maxQueueSize*0.8)
+            if len(self.queue) >= limit:
+                if priority != HIGH_PRIORITY:
+                    self.counters["dropped"] += 1
+                    return False
+                self.queue.popleft()
+                self.counters["dropped"] += 1
+            self.queue.append(event)
+            self.counters["enqueued"] += 1
+            if len(self.queue) >= self.batchSize:
+                self.condition.notify()
+        return True
+
+    def run(self):
+        for sink in self.sinks:
+            try:
+                sink.open()
+                self.openSinks.append(sink)
+            except Exception as e:
+                self.count("sinkErrors")
+                sys.stderr.write("Failed to open telemetry sink {0}: {1}\n".format(type(sink).__name__, str(e)))
+        while True:
+            with self.condition:
+                if len(self.queue) < self.batchSize:
+                    self.condition.wait(self.flushInterval)
+            self.flush()
+
+    # Writes the queued events, with a timeout whatever is still queued when it passes is left behind
+    def flush(self, timeout=None):
+        if self.pid != os.getpid():
+            return
+        deadline = None if timeout is None else time.time() + timeout
+        while deadline is None or time.time() < deadline:
+            with self.condition:
+                batch = [self.queue.popleft() for i in range(min(self.batchSize, len(self.queue)))]
+            if not batch:
+                return
+            for sink in self.openSinks:
+                try:
+                    sink.write(batch)
+                except Exception:
+                    self.count("sinkErrors")
+            self.count("written", len(batch))
+
+    def stats(self):
+        if self.pid != os.getpid():
+            return dict(self.counters, queued=0)
+        with self.condition:
+            return dict(self.counters, queued=len(self.queue))
+
+# Built from environment variables because the logger exists before the app config is loaded
+def createTelemetryPipeline():
+    sinkNames = os.getenv("TELEMETRY_SINKS", "etw" if os.name == "nt" else "stdout")
+    sinks = []
+    for name in [x.strip().lower() for x in sinkNames.split(",") if x.strip()]:
+        if name == "jsonl":
+            sinks.append(JsonLinesSink(os.getenv("TELEMETRY_FILE", os.path.join("logs", "telemetry.jsonl"))))
+        elif name in sinkTypes:
+            sinks.append(sinkTypes[name]())
+    sampleRates = json.loads(os.getenv("TELEMETRY_SAMPLE_RATES", "{}"))
+    return TelemetryPipeline(sinks, int(os.getenv("TELEMETRY_QUEUE_SIZE", 10000)), int(os.getenv("TELEMETRY_BATCH_SIZE", 200)), float(os.getenv("TELEMETRY_FLUSH_INTERVAL", 1.0)), int(os.getenv("TELEMETRY_MAX_CONTENT_LENGTH", 8192)), sampleRates)
@@ -1,31 +1,35 @@
-import os, shutil, json, re
+import os, json, re, time, threading
+import numpy as np
+from SearchModule import app
 from SearchModule.Logger import loggerInstance
+from SearchModule.ModelRegistry import ModelRegistry, getFolderSize
+from SearchModule.Metrics import metrics
 from SearchModule.ModelInfo import ModelInfo
 from SearchModule.TfIdfSearchModel import TfIdfSearchModel
 from SearchModule.WmdSearchModel import WmdSearchModel
 from SearchModule.Exceptions import *
-from SearchModule.Utilities import absPath, copyFolder, moveModels, modelsPath
+from SearchModule.Utilities import absPath
+from SearchModule.ModelVersions import getCurrentPath, listVersions, versionPath, setCurrentVersion, collectVersions, getSmokeQueries
 from SearchModule.MessageStrings import loadModelMessage, refreshModelMessage, fileMissingMessage
 
 def breakQuery(query):
     queries = [y for y in list(map(lambda x: " ".join(re.sub(r'[^(0-9a-zA-Z )]+', " ", x).split()), re.split(r'[\.,]', query))) if (y and len(y)>=2)]
     return queries
-def mergeResults(query, resultsList):
-    finalResults = {}
-    exceptions = []
-    for result in resultsList:
-        for x in result["results"]:
-            finalResults[x["detector"]] = max([x["score"], finalResults.get(x["detector"], 0)])
-            if "exception" in x:
-                exceptions.append(x["exception"])
-    mergedResult = {"query": query, "results": [{"detector": key, "score": value} for key, value in finalResults.items()]}
-    if exceptions and len(exceptions) > 0:
-        mergedResult["exception"] = " | ".join(exceptions)
-    return mergedResult
+# Union of the detectors selected for each sub-query, keeping the best score of every detector
+def mergeResults(query, detectorScores, model):
+    selected = np.zeros(detectorScores.shape, dtype=bool)
+    for i in range(detectorScores.shape[0]):
+        selected[i, model.rankDetectors(detectorScores[i])[0]] = True
+    mergedScores = np.where(selected, detectorScores, 0).max(axis=0)
+    indices = np.flatnonzero(selected.any(axis=0))
+    indices = indices[np.argsort(-mergedScores[indices], kind="stable")]
+    return model.formatDetectorResults(query, indices, mergedScores[indices])
 #### Text Search model for Queries ####
 class TextSearchModel():
     def __init__(self, modelpackagepath):
         self.trainingId = None
+        self.packagePath = absPath(modelpackagepath)
+        self.packageSize = getFolderSize(self.packagePath)
         try:
             self.trainingId = open(absPath(os.path.join(modelpackagepath, "trainingId.txt"))).read().strip()
         except:
@@ -37,15 +41,34 @@ class TextSearchModel():
         elif modelInfo.modelType == "WmdSearchModel":
             self.model = WmdSearchModel(modelpackagepath)
 
-    def queryDetectors(self, query=None):
+    def expandQuery(self, query):
         cleansed_query = " ".join(re.sub(r'[^(0-9a-zA-Z )]+', " ", query).split())
         # Break the query into smaller chunks if number of word is greater than 6
         if len(cleansed_query.split())>6:
-            queries = breakQuery(query)
-            queries = [cleansed_query] + queries
-            return mergeResults(cleansed_query, [self.model.queryDetectors(query) for query in queries])
-        else:
-            return self.model.queryDetectors(cleansed_query)
+            return cleansed_query, [cleansed_query] + breakQuery(query)
+        return cleansed_query, [cleansed_query]
+
+    # Scores all queries and their sub-queries in one batch, then merges sub-query results per query
+    def queryDetectorsBatch(self, queries):
+        expandedQueries = [self.expandQuery(query) for query in queries]
+        allQueries = [subQuery for cleansed_query, subQueries in expandedQueries for subQuery in subQueries]
+        try:
+            detectorScores = self.model.scoreDetectors(allQueries)
+        except Exception as e:
+            return [{"query": cleansed_query, "results": [], "exception": str(e)} for cleansed_query, subQueries in expandedQueries]
+        results = []
+        offset = 0
+        for cleansed_query, subQueries in expandedQueries:
+            scores = detectorScores[offset:offset+len(subQueries)]
+            offset += len(subQueries)
+            if len(subQueries)>1:
+                results.append(mergeResults(cleansed_query, scores, self.model))
+            else:
+                results.append(self.model.formatDetectorResults(cleansed_query, *self.model.rankDetectors(scores[0])))
+        return results
+
+    def queryDetectors(self, query=None):
+        return self.queryDetectorsBatch([query])[0]
     
     def queryUtterances(self, query=None, existing_utterances=[]):
         return self.model.queryUtterances(query, existing_utterances)
@@ -54,47 +77,99 @@ def loadModel(productId, model=None, forced=False):
     prelogMessage = loadModelMessage.format(productId)
     if model:
         loggerInstance.logInsights(f"{prelogMessage}From provided pre-loaded model.")
-        loaded_models[productId] = model
-        return
-    if (productId in loaded_models) and (not forced):
-        loggerInstance.logInsights(f"{prelogMessage}Model is already loaded in app")
-        return
-    modelpackagepath = os.path.join("SearchModule", productId)
-    loggerInstance.logInsights(f"{prelogMessage}Loading from folder {modelpackagepath}")
-    if not os.path.isdir(absPath(modelpackagepath)):
-        loggerInstance.logInsights(f"{prelogMessage}Could not find model folder. Getting model from download location.")
-        moveModels(productId, "SearchModule")
-    try:
-        loaded_models[productId] = TextSearchModel(modelpackagepath)
-    except Exception as e:
-        if type(e).__name__ == "ModelFileVerificationFailed":
-            loggerInstance.logInsights(f"Loading model failed for {productId} in ModelFileVerification step. Will copy the model folder and reload.")
-        moveModels(productId, "SearchModule")
-        loaded_models[productId] = TextSearchModel(modelpackagepath)
+        publishModel(productId, model)
+        return model
+    # One lookup, the model can be evicted by other loads, refreshes or /freeModel between two
+    loaded = loaded_models.get(productId) if not forced else None
+    if loaded:
+        return loaded
+    # Concurrent first requests for a product wait on the same load instead of loading it again
+    with loaded_models.getLoadLock(productId):
+        loaded = loaded_models.get(productId) if not forced else None
+        if loaded:
+            loggerInstance.logInsights(f"{prelogMessage}Model is already loaded in app")
+            return loaded
+        startTime = time.time()
+        modelpackagepath = getCurrentPath(productId)
+        if not modelpackagepath:
+            raise ModelDownloadFailed(f"{prelogMessage}No downloaded model found")
+        loggerInstance.logInsights(f"{prelogMessage}Loading from folder {modelpackagepath}")
+        model = TextSearchModel(modelpackagepath)
+        loadTime = time.time()-startTime
+        metrics.observe("searchapi_model_load_seconds", loadTime, product=productId)
+        publishModel(productId, model, loadTime)
+        return model
+
+def publishModel(productId, model, loadTime=0):
+    evicted = loaded_models.put(productId, model, model.packageSize, loadTime)
+    if evicted:
+        loggerInstance.logInsights(f"{loadModelMessage.format(productId)}Evicted models {','.join(evicted)} to stay within the memory budget.")
 
-def refreshModel(productId):
+# Loads the new version once from its own folder, checks it with a few queries and publishes that same instance.
+# The folder being served is never modified, so requests keep working on the old model until the switch.
+# With publish the new model is published even when the product is not resident, as on startup.
+def refreshModel(productId, version=None, publish=False):
+    if refreshDelegate:
+        return refreshDelegate(productId)
     prelogMessage = refreshModelMessage.format(productId)
-    modelpackagepath = os.path.join(modelsPath, productId)
     try:
-        # Try to load the given model
-        temp = TextSearchModel(modelpackagepath)
-        del temp
-        if os.path.isdir(os.path.join("SearchModule", productId)):
-            shutil.rmtree(os.path.join("SearchModule", productId))
-        copyFolder(modelpackagepath, os.path.join("SearchModule", productId))
-        #shutil.rmtree(absPath(path))
-        loggerInstance.logInsights(f"{prelogMessage}Verified the new model by loading it. Triggering the switch.")
-        loadModel(productId, model=TextSearchModel(os.path.join("SearchModule", productId)))
-        loggerInstance.logInsights(f"{prelogMessage}Successfully refreshed model. Training Id: {loaded_models[productId].trainingId}")
+        versions = listVersions(productId)
+        version = version or (versions[-1] if versions else None)
+        if not version:
+            raise ModelDownloadFailed("No downloaded model version found")
+        modelpackagepath = versionPath(productId, version)
+        startTime = time.time()
+        model = TextSearchModel(modelpackagepath)
+        loadTime = time.time()-startTime
+        metrics.observe("searchapi_model_load_seconds", loadTime, product=productId)
+        smokeTestModel(model, modelpackagepath)
+        loggerInstance.logInsights(f"{prelogMessage}Verified version {version} by loading it. Triggering the switch.")
+        with loaded_models.getLoadLock(productId):
+            setCurrentVersion(productId, version)
+            # Products that are not resident are picked up from the new folder on their next request
+            if publish or (productId in loaded_models) or loaded_models.isPinned(productId):
+                publishModel(productId, model, loadTime)
+                loggerInstance.logInsights(f"{prelogMessage}Successfully refreshed model. Training Id: {model.trainingId}")
+        del model
+        collectModelVersions(productId)
         return "Model Refreshed Successfully"
     except Exception as e:
-        #shutil.rmtree(absPath(path))
         loggerInstance.logHandledException("modelRefreshTask", ModelRefreshException(f"{prelogMessage}{str(e)}"))
         return "Failed to refresh Model Exception:" + str(e)
 
+def smokeTestModel(model, modelpackagepath):
+    queries, fromTestCases = getSmokeQueries(modelpackagepath, app.config.get("MODEL_SMOKE_QUERY_COUNT", 5))
+    results = model.queryDetectorsBatch(queries)
+    failed = [x for x in results if "exception" in x]
+    if failed:
+        raise ModelRefreshException("Smoke query '{0}' failed: {1}".format(failed[0]["query"], failed[0]["exception"]))
+    if fromTestCases and not any(x["results"] for x in results):
+        raise ModelRefreshException("None of the {0} smoke queries returned any detectors".format(len(queries)))
+
+# Old versions are removed once no snapshot serves from them any more
+def collectModelVersions(productId):
+    return collectVersions(productId, app.config.get("MODEL_VERSIONS_TO_KEEP", 2), loaded_models.livePackagePaths(productId))
+
+# The last request holding a retired snapshot releases it on its own thread, the folder is removed in the background
+def onSnapshotClosed(productId, model):
+    threading.Thread(target=collectModelVersions, args=(productId,), daemon=True).start()
+
+# Pins the current snapshot of a product, loading it first when needed. The caller releases it when done.
+def acquireModel(productId):
+    for attempt in range(3):
+        snapshot = loaded_models.acquire(productId)
+        if snapshot:
+            return snapshot
+        # Another load can evict it again before it is pinned when the memory budget is tight
+        loadModel(productId)
+    raise ModelDownloadFailed(f"{loadModelMessage.format(productId)}Model was evicted before it could be used")
+
+# Requests still holding the model keep using it, it is released when the last of them finishes
 def freeModel(productId):
-    loaded_models[productId] = None
-    del loaded_models[productId]
+    loaded_models.evict(productId)
 
 
-loaded_models = {}
\ No newline at end of file
+loaded_models = ModelRegistry(app.config)
+loaded_models.onClose = onSnapshotClosed
+# Set in pre-forked workers, which hand refreshes over to the master process that owns the models
+refreshDelegate = None
\ No newline at end of file
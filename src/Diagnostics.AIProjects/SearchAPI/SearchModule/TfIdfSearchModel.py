@@ -1,8 +1,14 @@
 import json, os
+import numpy as np
+from scipy import sparse
+from SearchModule import app
 from SearchModule.ModelInfo import ModelInfo
 from SearchModule.TokenizerModule import getAllNGrams
+from SearchModule.RetrievalEngine import topK, topKFiltered, DetectorSegments
+from SearchModule.ArrayModels import ArrayDictionary, ArrayTfidfModel, prefetchArray
+from SearchModule.Metrics import metrics
 from gensim.models import TfidfModel
-from gensim import corpora, similarities
+from gensim import corpora, similarities, matutils
 from SearchModule.Exceptions import *
 from SearchModule.Utilities import absPath, verifyFile
 from SearchModule.MessageStrings import fileMissingMessage
@@ -20,17 +26,27 @@ class TfIdfSearchModel:
             "detectorsFile": "Detectors.json",
             "sampleUtterancesFile": "SampleUtterances.json",
             "mappingsFile": "Mappings.json",
-            "modelInfo": "ModelInfo.json"
+            "modelInfo": "ModelInfo.json",
+            "dictionaryTokensFile": "dictionary.tokens.npy",
+            "dictionaryIdsFile": "dictionary.ids.npy",
+            "dictionaryTokensFile1": "dictionary1.tokens.npy",
+            "dictionaryIdsFile1": "dictionary1.ids.npy",
+            "dictionaryTokensFile2": "dictionary2.tokens.npy",
+            "dictionaryIdsFile2": "dictionary2.ids.npy",
+            "m1IdfFile": "m1.idf.npy",
+            "m2IdfFile": "m2.idf.npy"
         }
         for key in packageFiles.keys():
             packageFiles[key] = absPath(os.path.join(modelpackagepath, packageFiles[key]))
         self.packageFiles = packageFiles
-        self.optionalFiles = ["mappingsFile", "dictionaryFile", "dictionaryFile1", "dictionaryFile2"]
+        self.optionalFiles = ["mappingsFile", "dictionaryFile", "dictionaryFile1", "dictionaryFile2", "dictionaryTokensFile", "dictionaryIdsFile", "dictionaryTokensFile1", "dictionaryIdsFile1", "dictionaryTokensFile2", "dictionaryIdsFile2", "m1IdfFile", "m2IdfFile"]
+        # Memory mapped arrays are shared through the page cache by every process serving the same package
+        self.mmapMode = 'r' if app.config.get("MODEL_MMAP_ENABLED", False) else None
 
         if not self.verifyModelFiles():
             raise ModelFileVerificationFailed(fileMissingMessage)
 
-        self.models = {"dictionary": None, "dictionary1": None, "dictionary2": None, "m1Model": None, "m1Index": None, "m2Model": None, "m2Index": None, "detectors": None, "sampleUtterances": None, "mappings": None, "modelInfo": None}
+        self.models = {"dictionary": None, "dictionary1": None, "dictionary2": None, "m1Model": None, "m1Index": None, "m2Model": None, "m2Index": None, "detectors": None, "sampleUtterances": None, "mappings": None, "detectorSegments": None, "modelInfo": None}
         try:
             with open(self.packageFiles["modelInfo"], "r") as fp:
                 self.models["modelInfo"] = ModelInfo(json.loads(fp.read()))
@@ -39,28 +55,28 @@ class TfIdfSearchModel:
             self.models["modelInfo"] = ModelInfo({})
         try:
             if self.models["modelInfo"].splitDictionary:
-                self.models["dictionary1"] = corpora.Dictionary.load(self.packageFiles["dictionaryFile1"])
-                self.models["dictionary2"] = corpora.Dictionary.load(self.packageFiles["dictionaryFile2"])
+                self.models["dictionary1"] = self.loadDictionary("dictionaryFile1", "dictionaryTokensFile1", "dictionaryIdsFile1")
+                self.models["dictionary2"] = self.loadDictionary("dictionaryFile2", "dictionaryTokensFile2", "dictionaryIdsFile2")
             else:
-                self.models["dictionary"] = corpora.Dictionary.load(self.packageFiles["dictionaryFile"])
+                self.models["dictionary"] = self.loadDictionary("dictionaryFile", "dictionaryTokensFile", "dictionaryIdsFile")
         except Exception as e:
             raise ModelFileLoadFailed(f"Failed to load dictionary from file. {e}")
         try:
-            self.models["m1Model"] = TfidfModel.load(self.packageFiles["m1ModelFile"])
+            self.models["m1Model"] = self.loadTfidfModel("m1ModelFile", "m1IdfFile")
         except:
             raise ModelFileLoadFailed("Failed to load model from file " + self.packageFiles["m1ModelFile"])
         try:
-            self.models["m1Index"] = similarities.MatrixSimilarity.load(self.packageFiles["m1IndexFile"])
+            self.models["m1Index"] = self.loadIndex("m1IndexFile", "m1")
         except:
             raise ModelFileLoadFailed("Failed to load index from file " + self.packageFiles["m1IndexFile"])
         try:
-            self.models["m2Model"] = TfidfModel.load(self.packageFiles["m2ModelFile"])
+            self.models["m2Model"] = self.loadTfidfModel("m2ModelFile", "m2IdfFile")
             #self.models["m2Model"] = None
             #del self.models["m2Model"]
         except:
             raise ModelFileLoadFailed("Failed to load model from file " + self.packageFiles["m2ModelFile"])
         try:
-            self.models["m2Index"] = similarities.MatrixSimilarity.load(self.packageFiles["m2IndexFile"])
+            self.models["m2Index"] = self.loadIndex("m2IndexFile", "m2")
             #self.models["m2Index"] = None
             #del self.models["m2Index"]
         except:
@@ -78,6 +94,7 @@ class TfIdfSearchModel:
                     f.close()
             except:
                 raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["mappingsFile"])
+            self.models["detectorSegments"] = DetectorSegments(self.models["mappings"], len(self.models["m1Index"]))
         try:
             with open(self.packageFiles["sampleUtterancesFile"], "r") as f:
                 self.models["sampleUtterances"] = json.loads(f.read())
@@ -87,6 +104,34 @@ class TfIdfSearchModel:
         except:
             raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["sampleUtterancesFile"])
     
+    # Packages trained with mmapArrays carry .npy copies of the dictionary and idf tables next to the pickles
+    def useArrays(self):
+        return self.mmapMode and self.models["modelInfo"].mmapArrays
+
+    def loadDictionary(self, dictionaryFile, tokensFile, idsFile):
+        if self.useArrays():
+            return ArrayDictionary(self.packageFiles[tokensFile], self.packageFiles[idsFile], self.mmapMode)
+        return corpora.Dictionary.load(self.packageFiles[dictionaryFile])
+
+    def loadTfidfModel(self, modelFile, idfFile):
+        if self.useArrays():
+            return ArrayTfidfModel(self.packageFiles[idfFile], self.mmapMode)
+        return TfidfModel.load(self.packageFiles[modelFile])
+
+    # Sparse indices hold the docs x features matrix column wise, the product in getSimilarities then only reads
+    # the columns of the features the queries have
+    def loadIndex(self, indexFile, indexName):
+        if self.models["modelInfo"].indexTypes.get(indexName, "dense") == "sparse":
+            index = similarities.SparseMatrixSimilarity.load(self.packageFiles[indexFile], mmap=self.mmapMode)
+            arrays = [index.index.data, index.index.indices, index.index.indptr]
+        else:
+            index = similarities.MatrixSimilarity.load(self.packageFiles[indexFile], mmap=self.mmapMode)
+            arrays = [index.index]
+        if self.mmapMode and app.config.get("MODEL_PREFETCH_ENABLED", True):
+            for array in arrays:
+                prefetchArray(array)
+        return index
+
     def verifyModelFiles(self):
         for key in self.packageFiles.keys():
             if key not in self.optionalFiles and not verifyFile(self.packageFiles[key], absolute=True, prelogMessage="TfIdfSearchModel: "):
@@ -94,35 +139,60 @@ class TfIdfSearchModel:
         return True
 
     def getDetectorByIndex(self, index):
-        detector = [x for x in self.models["mappings"] if (x["startindex"] <= index <= x["endindex"])]
-        if detector and detector[0]:
-            return detector[0]["id"]
-        else:
-            return None
+        return self.models["detectorSegments"].detectorAt(index)
+
+    def getDetectorIds(self):
+        if self.models["modelInfo"].detectorContentSplitted:
+            return self.models["detectorSegments"].detectorIds
+        return [x["id"] for x in self.models["detectors"]]
+
+    # Builds one sparse query matrix for the batch and scores it against the index with a single product
+    def getSimilarities(self, queries, dictionary, model, index):
+        with metrics.stage("tokenization"):
+            tokens = [getAllNGrams(query, self.models["modelInfo"].textNGrams) for query in queries]
+        with metrics.stage("vectorization"):
+            vectors = [matutils.unitvec(model[dictionary.doc2bow(x)]) for x in tokens]
+            queryMatrix = matutils.corpus2csc(vectors, num_terms=index.num_features, num_docs=len(vectors), dtype=index.index.dtype).T.tocsr()
+        with metrics.stage("similarity"):
+            if sparse.issparse(index.index):
+                return queryMatrix.dot(index.index.T).toarray()
+            # Only the columns of the features the queries have are read, the product with the whole transposed
+            # index would copy it on every call
+            cols = np.unique(queryMatrix.indices)
+            return np.asarray(index.index[:, cols].dot(queryMatrix[:, cols].T.toarray()).T)
+
+    # Detector level scores for every query, one row per query
+    def scoreDetectors(self, queries):
+        dictionary = self.models["dictionary1"] if self.models["modelInfo"].splitDictionary else self.models["dictionary"]
+        sims = self.getSimilarities(queries, dictionary, self.models["m1Model"], self.models["m1Index"])
+        if self.models["modelInfo"].detectorContentSplitted:
+            with metrics.stage("aggregation"):
+                return self.models["detectorSegments"].aggregate(sims)
+        return sims
+
+    def rankDetectors(self, detectorScores):
+        return topK(detectorScores, 10 if self.models["modelInfo"].detectorContentSplitted else None, 0.30)
+
+    def formatDetectorResults(self, query, indices, scores):
+        detectorIds = self.getDetectorIds()
+        similar_docs = list(map(lambda x: {"detector": detectorIds[x[0]], "score": round(float(x[1]), 3)}, zip(indices, scores)))
+        return {"query": query, "results": [x for x in similar_docs if x["score"]>0.30]}
+
+    def queryDetectorsBatch(self, queries):
+        try:
+            detectorScores = self.scoreDetectors(queries)
+            return [self.formatDetectorResults(query, *self.rankDetectors(detectorScores[i])) for i, query in enumerate(queries)]
+        except Exception as e:
+            return [{"query": query, "results": [], "exception": str(e)} for query in queries]
 
     def queryDetectors(self, query=None):
         if query:
-            try:
-                doc2bow = self.models["dictionary1"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams)) if self.models["modelInfo"].splitDictionary else self.models["dictionary"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams))
-                vector = self.models["m1Model"][doc2bow]
-                if self.models["modelInfo"].detectorContentSplitted:    
-                    similar_doc_indices = sorted(enumerate(self.models["m1Index"][vector]), key=lambda item: -item[1])[:10]
-                    similar_docs = []
-                    for x in similar_doc_indices:
-                        detector = self.getDetectorByIndex(x[0])
-                        if detector and (not (detector in [p["detector"] for p in similar_docs])):
-                            similar_docs.append({"detector": self.getDetectorByIndex(x[0]), "score": round(float(x[1]), 3)})
-                else:
-                    similar_doc_indices = sorted(enumerate(self.models["m1Index"][vector]), key=lambda item: -item[1])
-                    similar_docs = list(map(lambda x: {"detector": self.models["detectors"][x[0]]["id"], "score": round(float(x[1]), 3)}, similar_doc_indices))
-                return {"query": query, "results": [x for x in similar_docs if x["score"]>0.30]}
-            except Exception as e:
-                return {"query": query, "results": [], "exception": str(e)}
+            return self.queryDetectorsBatch([query])[0]
         return {"query": query, "results": []}
 
     def loadUtteranceModel(self):
-        self.models["m2Model"] = TfidfModel.load(self.packageFiles["m2ModelFile"])
-        self.models["m2Index"] = similarities.MatrixSimilarity.load(self.packageFiles["m2IndexFile"])
+        self.models["m2Model"] = self.loadTfidfModel("m2ModelFile", "m2IdfFile")
+        self.models["m2Index"] = self.loadIndex("m2IndexFile", "m2")
         with open(self.packageFiles["sampleUtterancesFile"], "r") as f:
             self.models["sampleUtterances"] = json.loads(f.read())
             f.close()
@@ -139,8 +209,7 @@ class TfIdfSearchModel:
             try:
                 doc2bow = self.models["dictionary2"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams)) if self.models["modelInfo"].splitDictionary else self.models["dictionary"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams))
                 vector = self.models["m2Model"][doc2bow]
-                similar_doc_indices = sorted(enumerate(self.models["m2Index"][vector]), key=lambda item: -item[1])
-                similar_doc_indices = [x for x in similar_doc_indices if self.models["sampleUtterances"][x[0]]["text"].lower() not in existing_utterances][:10]
+                similar_doc_indices = zip(*topKFiltered(self.models["m2Index"][vector], 10, lambda i: self.models["sampleUtterances"][i]["text"].lower() not in existing_utterances))
                 similar_docs = list(map(lambda x: {"sampleUtterance": self.models["sampleUtterances"][x[0]], "score": str(x[1])}, similar_doc_indices))
                 return {"query": query, "results": similar_docs}
             except Exception as e:
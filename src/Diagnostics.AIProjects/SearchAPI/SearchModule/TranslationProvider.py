@@ -0,0 +1,113 @@
+import os, re, json, time, unicodedata
+from SearchModule.ResultCache import TtlLruCache
+from SearchModule.Utilities import absPath
+from SearchModule.Metrics import metrics
+
+# Must match normalizeText in Scripts/BuildLanguageProfiles.py
+def normalizeText(text):
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return " ".join(re.sub(r"[^a-z]+", " ", text).split())
+
+def getTrigrams(text):
+    for word in text.split():
+        word = " " + word + " "
+        for i in range(len(word)-2):
+            yield word[i:i+3]
+
+# Character trigram language identification against the profiles built by Scripts/BuildLanguageProfiles.py
+class LanguageIdentifier:
+    def __init__(self, profilesFile):
+        with open(profilesFile, "r") as fp:
+            self.profiles = json.loads(fp.read())["languages"]
+
+    # Average trigram log probability of the text under every language
+    def scores(self, text):
+        trigrams = list(getTrigrams(normalizeText(text)))
+        if not trigrams:
+            return {}
+        return {language: sum([profile["trigrams"].get(g, profile["unknown"]) for g in trigrams])/len(trigrams) for language, profile in self.profiles.items()}
+
+    # Only plain ascii text is considered, and english has to beat every other language by the margin
+    def isEnglish(self, text, margin=0.1):
+        if any(ord(c) > 127 for c in text):
+            return False
+        scores = self.scores(text)
+        if "en" not in scores:
+            return False
+        others = [score for language, score in scores.items() if language != "en"]
+        return not others or scores["en"] - max(others) >= margin
+
+#### Translators ####
+class Translator:
+    def translate(self, text):
+        raise NotImplementedError()
+
+class GoogleTranslator(Translator):
+    def __init__(self):
+        from googletrans import Translator as GoogleTransClient
+        self.client = GoogleTransClient()
+
+    def translate(self, text):
+        return self.client.translate(text).text
+
+# Local stand-in for tests and benchmarks, returns known translations or the text itself after an optional delay
+class StubTranslator(Translator):
+    def __init__(self, translations=None, delay=0):
+        self.translations = translations or {}
+        self.delay = delay
+        self.calls = 0
+
+    def translate(self, text):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.translations.get(text, text)
+
+translators = {"google": GoogleTranslator, "stub": StubTranslator}
+
+# Skips translation for english text and remembers earlier translations
+class TranslationProvider:
+    def __init__(self, translator, identifier=None, cache=None, margin=0.1):
+        self.translator = translator
+        self.identifier = identifier
+        self.cache = cache
+        self.margin = margin
+        self.bypassed = 0
+        self.translated = 0
+
+    # Translation that doesn't need the translator, returns (text, "bypassed"/"cached") or (None, None)
+    def lookup(self, text):
+        if self.identifier and self.identifier.isEnglish(text, self.margin):
+            self.bypassed += 1
+            return text, "bypassed"
+        translation = self.cache.get(text) if self.cache else None
+        if translation is not None:
+            return translation, "cached"
+        return None, None
+
+    def translate(self, text):
+        translation, source = self.lookup(text)
+        if translation is not None:
+            return translation
+        with metrics.stage("translation"):
+            translation = self.translator.translate(text)
+        self.translated += 1
+        if self.cache:
+            self.cache.set(text, translation)
+        return translation
+
+    def stats(self):
+        stats = {"bypassed": self.bypassed, "translated": self.translated}
+        if self.cache:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+def createTranslationProvider(config):
+    translator = translators[config.get("TRANSLATOR", "google") or "google"]()
+    identifier = None
+    if config.get("TRANSLATION_BYPASS_ENABLED", True):
+        identifier = LanguageIdentifier(absPath(os.path.join("SearchModule", "LanguageProfiles.json")))
+    cache = None
+    if config.get("TRANSLATION_CACHE_SIZE", 4096):
+        cache = TtlLruCache(config.get("TRANSLATION_CACHE_SIZE", 4096), config.get("TRANSLATION_CACHE_TTL", 24*3600))
+    return TranslationProvider(translator, identifier, cache, config.get("TRANSLATION_BYPASS_MARGIN", 0.1))
@@ -1,12 +1,23 @@
-import json, os, gensim
+import json, os, time, gensim
+import numpy as np
 from gensim.similarities import WmdSimilarity
 from pyemd import emd
+from SearchModule import app
 from SearchModule.ModelInfo import ModelInfo
+from SearchModule.ArrayModels import loadEmbeddings
+from SearchModule.WmdEngine import PrunedWmdIndex
+from SearchModule.EmdPool import getEmdPool
 from SearchModule.TokenizerModule import getAllNGrams
+from SearchModule.RetrievalEngine import topK, topKFiltered, DetectorSegments
+from SearchModule.Metrics import metrics
 from SearchModule.Exceptions import *
 from SearchModule.Utilities import absPath, verifyFile
 from SearchModule.MessageStrings import fileMissingMessage
 
+detectorsTopK = 10
+detectorsThreshold = 0.30
+utterancesTopK = 10
+
 class WmdSearchModel:
     def __init__(self, modelpackagepath):
         packageFiles = {
@@ -15,17 +26,20 @@ class WmdSearchModel:
             "detectorsFile": "Detectors.json",
             "sampleUtterancesFile": "SampleUtterances.json",
             "mappingsFile": "Mappings.json",
-            "modelInfo": "ModelInfo.json"
+            "modelInfo": "ModelInfo.json",
+            "embeddingsFile": "embeddings.npy",
+            "embeddingsWordsFile": "embeddings.words.npy"
         }
         for key in packageFiles.keys():
             packageFiles[key] = absPath(os.path.join(modelpackagepath, packageFiles[key]))
         self.packageFiles = packageFiles
-        self.optionalFiles = ["mappingsFile"]
+        self.optionalFiles = ["mappingsFile", "embeddingsFile", "embeddingsWordsFile"]
+        self.mmapMode = 'r' if app.config.get("MODEL_MMAP_ENABLED", False) else None
 
         if not self.verifyModelFiles():
             raise ModelFileVerificationFailed(fileMissingMessage)
 
-        self.models = {"m1Index": None, "m2Index": None, "detectors": None, "sampleUtterances": None, "mappings": None, "modelInfo": None}
+        self.models = {"m1Index": None, "m2Index": None, "detectors": None, "sampleUtterances": None, "mappings": None, "detectorSegments": None, "modelInfo": None}
         try:
             with open(self.packageFiles["modelInfo"], "r") as fp:
                 self.models["modelInfo"] = ModelInfo(json.loads(fp.read()))
@@ -42,6 +56,14 @@ class WmdSearchModel:
             #del self.models["m2Index"]
         except:
             raise ModelFileLoadFailed("Failed to load index from file " + self.packageFiles["m2IndexFile"])
+        # Packages trained with embeddings pickle the indices without their word vectors, both use one shared copy
+        if self.models["modelInfo"].embeddings:
+            try:
+                embeddings = loadEmbeddings(self.packageFiles["embeddingsWordsFile"], self.packageFiles["embeddingsFile"], self.mmapMode)
+            except:
+                raise ModelFileLoadFailed("Failed to load embeddings from file " + self.packageFiles["embeddingsFile"])
+            self.models["m1Index"].w2v_model = embeddings
+            self.models["m2Index"].w2v_model = embeddings
         try:
             with open(self.packageFiles["detectorsFile"], "r") as f:
                 self.models["detectors"] = json.loads(f.read())
@@ -55,6 +77,7 @@ class WmdSearchModel:
                     f.close()
             except:
                 raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["mappingsFile"])
+            self.models["detectorSegments"] = DetectorSegments(self.models["mappings"], len(self.models["m1Index"]))
         try:
             with open(self.packageFiles["sampleUtterancesFile"], "r") as f:
                 self.models["sampleUtterances"] = json.loads(f.read())
@@ -63,6 +86,11 @@ class WmdSearchModel:
                 #del self.models["sampleUtterances"]
         except:
             raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["sampleUtterancesFile"])
+        # Exact EMD against every row is only used when pruning is turned off
+        self.engines = {"m1Index": None, "m2Index": None}
+        if app.config.get("WMD_PRUNING_ENABLED", True):
+            getPool = getEmdPool if app.config.get("WMD_EMD_WORKERS", 0) else None
+            self.engines = {"m1Index": PrunedWmdIndex(self.models["m1Index"], getPool), "m2Index": PrunedWmdIndex(self.models["m2Index"], getPool)}
     
     def verifyModelFiles(self):
         for key in self.packageFiles.keys():
@@ -71,32 +99,60 @@ class WmdSearchModel:
         return True
 
     def getDetectorByIndex(self, index):
-        detector = [x for x in self.models["mappings"] if (x["startindex"] <= index <= x["endindex"])]
-        if detector and detector[0]:
-            return detector[0]["id"]
-        else:
-            return None
+        return self.models["detectorSegments"].detectorAt(index)
+
+    def getDetectorIds(self):
+        if self.models["modelInfo"].detectorContentSplitted:
+            return self.models["detectorSegments"].detectorIds
+        return [x["id"] for x in self.models["detectors"]]
+
+    # Time by which a query started now has to return with whatever it scored so far, None without a limit
+    def getDeadline(self):
+        timeout = app.config.get("WMD_QUERY_TIMEOUT", 0)
+        return time.time() + timeout if timeout else None
+
+    # Detector level scores for every query, one row per query
+    def scoreDetectors(self, queries):
+        with metrics.stage("tokenization"):
+            tokens = [getAllNGrams(query, self.models["modelInfo"].textNGrams, lemmatize=False) for query in queries]
+        with metrics.stage("similarity"):
+            # Each query of a batch gets its own time limit, a shared one would leave the later queries unscored
+            sims = np.vstack([self.getDetectorSimilarities(x, self.getDeadline()) for x in tokens])
+        if self.models["modelInfo"].detectorContentSplitted:
+            with metrics.stage("aggregation"):
+                return self.models["detectorSegments"].aggregate(sims)
+        return sims
+
+    def getDetectorSimilarities(self, tokens, deadline=None):
+        if not self.engines["m1Index"]:
+            return self.models["m1Index"][tokens]
+        aggregate = self.models["detectorSegments"].aggregate if self.models["modelInfo"].detectorContentSplitted else None
+        return self.engines["m1Index"].similarities(tokens, detectorsTopK, detectorsThreshold, aggregate=aggregate, deadline=deadline)
+
+    def rankDetectors(self, detectorScores):
+        return topK(detectorScores, detectorsTopK, detectorsThreshold)
+
+    def formatDetectorResults(self, query, indices, scores):
+        detectorIds = self.getDetectorIds()
+        similar_docs = list(map(lambda x: {"detector": detectorIds[x[0]], "score": round(float(x[1]), 3)}, zip(indices, scores)))
+        return {"query": query, "results": [x for x in similar_docs if x["score"]>detectorsThreshold]}
+
+    def queryDetectorsBatch(self, queries):
+        try:
+            detectorScores = self.scoreDetectors(queries)
+            return [self.formatDetectorResults(query, *self.rankDetectors(detectorScores[i])) for i, query in enumerate(queries)]
+        except Exception as e:
+            return [{"query": query, "results": [], "exception": str(e)} for query in queries]
 
     def queryDetectors(self, query=None):
         if query:
-            try:
-                tokenized = getAllNGrams(query, self.models["modelInfo"].textNGrams, lemmatize=False)
-                similar_doc_indices = sorted(enumerate(self.models["m1Index"][tokenized]), key=lambda x: x[1], reverse=True)[:10]
-                if self.models["modelInfo"].detectorContentSplitted:    
-                    similar_docs = []
-                    for x in similar_doc_indices:
-                        detector = self.getDetectorByIndex(x[0])
-                        if detector and (not (detector in [p["detector"] for p in similar_docs])):
-                            similar_docs.append({"detector": self.getDetectorByIndex(x[0]), "score": round(float(x[1]), 3)})
-                else:
-                    similar_docs = list(map(lambda x: {"detector": self.models["detectors"][x[0]]["id"], "score": round(float(x[1]), 3)}, similar_doc_indices))
-                return {"query": query, "results": [x for x in similar_docs if x["score"]>0.30]}
-            except Exception as e:
-                return {"query": query, "results": [], "exception": str(e)}
+            return self.queryDetectorsBatch([query])[0]
         return None
 
     def loadUtteranceModel(self):
         self.models["m2Index"] = WmdSimilarity.load(self.packageFiles["m2IndexFile"])
+        if self.models["modelInfo"].embeddings:
+            self.models["m2Index"].w2v_model = self.models["m1Index"].w2v_model
         with open(self.packageFiles["sampleUtterancesFile"], "r") as f:
             self.models["sampleUtterances"] = json.loads(f.read())
             f.close()
@@ -110,9 +166,14 @@ class WmdSearchModel:
             query = query + " ".join(existing_utterances)
             #self.loadUtteranceModel()
             try:
+                deadline = self.getDeadline()
                 tokenized = getAllNGrams(query, self.models["modelInfo"].textNGrams, lemmatize=False)
-                similar_doc_indices = sorted(enumerate(self.models["m2Index"][tokenized]), key=lambda item: -item[1])
-                similar_doc_indices = [x for x in similar_doc_indices if self.models["sampleUtterances"][x[0]]["text"].lower() not in existing_utterances][:10]
+                keep = lambda i: self.models["sampleUtterances"][i]["text"].lower() not in existing_utterances
+                if self.engines["m2Index"]:
+                    sims = self.engines["m2Index"].similarities(tokenized, utterancesTopK, keep=keep, deadline=deadline)
+                else:
+                    sims = self.models["m2Index"][tokenized]
+                similar_doc_indices = zip(*topKFiltered(sims, utterancesTopK, keep))
                 similar_docs = list(map(lambda x: {"sampleUtterance": self.models["sampleUtterances"][x[0]], "score": str(x[1])}, similar_doc_indices))
                 return {"query": query, "results": similar_docs}
             except Exception as e:
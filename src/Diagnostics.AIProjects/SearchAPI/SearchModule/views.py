@@ -1,21 +1,30 @@
-from flask import request
+from flask import request, g
 from flask_cors import CORS, cross_origin
 from datetime import datetime, timezone
 from functools import wraps
 import threading, json, time
-from googletrans import Translator
 
 from AuthModule.authhandler import authProvider
 from SearchModule import app
-from SearchModule.TextSearchModule import loadModel, refreshModel, freeModel, loaded_models
+from SearchModule.TextSearchModule import acquireModel, refreshModel, freeModel, loaded_models
 from SearchModule.Utilities import resourceConfig, getProductId, getAllProductIds
-from SearchModule.StorageAccountHelper import StorageAccountHelper
+from SearchModule.StartupOrchestrator import StartupOrchestrator
 from SearchModule.Logger import loggerInstance
-from SearchModule.LuisProvider import getLuisPredictions, mergeLuisResults
+from SearchModule.LuisProvider import getLuisPredictions, mergeLuisResults, isLuisEnabled, getLuisClient
+import SearchModule.LuisProvider as LuisProvider
+from SearchModule.RequestPipeline import RequestPipeline
+from SearchModule.Metrics import metrics
+from SearchModule.ResultCache import createQueryResultCache
+from SearchModule.TranslationProvider import createTranslationProvider
 import urllib.parse, re
 
-translator = Translator()
 specialChars = r'[^(0-9a-zA-Z )]+'
+queryResultCache = None
+queryResultCacheLock = threading.Lock()
+translationProvider = None
+translationProviderLock = threading.Lock()
+startupOrchestrator = None
+startupLock = threading.Lock()
 ######## RUN THE API SERVER IN FLASK  #############
 def getUTCTime():
     return datetime.now(timezone.utc)
@@ -31,6 +40,58 @@ def getRequestId(req):
         return request.args.get('requestId')
     return None
 
+# Returns the whitespace normalized query, or the error response for a query we can't search
+def validateQuery(query):
+    if (len(query)>250):
+        return None, ("Query length exceeded the maximum limit of 250", 400)
+    query = " ".join(query.split()) # remove extra whitespaces
+    if (not query) or len(query)<2:
+        return None, ("Minimum query length is 2", 400)
+    return query, None
+
+def searchDetectors(model, productid, query):
+    cache = getQueryResultCache()
+    results = cache.get(productid, model.trainingId, query) if cache else None
+    if results is None:
+        with metrics.stage("search"):
+            results = model.queryDetectors(query)
+        if cache and not "exception" in results:
+            cache.set(productid, model.trainingId, query, results)
+    return results
+
+# Starts the local search and the LUIS call for a query, replacing the calls made for an earlier query
+def submitSearch(pipeline, model, productid, query):
+    pipeline.submit("search", searchDetectors, model, productid, query)
+    if isLuisEnabled(productid):
+        pipeline.submit("luis", getLuisPredictions, query, productid, timeout=app.config.get('LUIS_TIMEOUT', 3))
+    else:
+        pipeline.skip("luis")
+
+# Created on first use so that the config loaded by the entry point is honoured
+def getQueryResultCache():
+    global queryResultCache
+    if not app.config.get('QUERY_CACHE_ENABLED', True):
+        return None
+    with queryResultCacheLock:
+        if not queryResultCache:
+            queryResultCache = createQueryResultCache(app.config, loggerInstance)
+    return queryResultCache
+
+# The snapshot stays pinned until the request is torn down, so a refresh can't swap the model out from under it
+def useModel(productId):
+    snapshot = acquireModel(productId)
+    if "snapshots" not in g:
+        g.snapshots = []
+    g.snapshots.append(snapshot)
+    return snapshot.model
+
+def getTranslationProvider():
+    global translationProvider
+    with translationProviderLock:
+        if not translationProvider:
+            translationProvider = createTranslationProvider(app.config)
+    return translationProvider
+
 def loggingProvider(requestIdRequired=True):
     def loggingOuter(f):
         @wraps(f)
@@ -67,28 +128,72 @@ cors = CORS(app)
 app.config.from_object("AppConfig.ProductionConfig")
 app.config['CORS_HEADERS'] = 'Content-Type'
 
-@app.before_first_request
-def activate_job():
-    if app.config['MODEL_SYNC_ENABLED']:
-        productIds = getAllProductIds(resourceConfig)
-        sah = StorageAccountHelper(loggerInstance)
-        loggerInstance.logInsights("Starting model sync for {0}".format(','.join(productIds)))
-        thread = threading.Thread(target=sah.watchModels, args=(productIds,))
-        thread.start()
-        while True:
-            modelDownloadPending = [sah.firstTime[productId] if productId in sah.firstTime else True for productId in productIds]
-            if any(modelDownloadPending):
-                time.sleep(2)
-            else:
-                break
-    loggerInstance.logInsights("Search service startup succeeded")
+@app.before_request
+def startRequestTimer():
+    g.startTime = time.perf_counter()
+
+@app.after_request
+def recordRequestLatency(response):
+    if "startTime" in g:
+        metrics.observe("searchapi_request_seconds", time.perf_counter() - g.startTime, route=str(request.url_rule), product=g.get("productId", ""), status=response.status_code)
+    return response
+
+@app.teardown_request
+def releaseModels(exception=None):
+    for snapshot in g.pop("snapshots", []):
+        snapshot.release()
 
+def collectServiceMetrics():
+    gauges = []
+    registry = loaded_models.stats()
+    gauges += [("searchapi_model_memory_budget_bytes", {}, registry["memoryBudget"]), ("searchapi_model_memory_used_bytes", {}, registry["memoryUsed"]), ("searchapi_model_evictions", {}, registry["evictions"]), ("searchapi_model_retired_snapshots", {}, registry["retiredSnapshots"])]
+    for productId, model in registry["models"].items():
+        gauges += [("searchapi_model_hits", {"product": productId}, model["hits"]), ("searchapi_model_size_bytes", {"product": productId}, model["size"])]
+    cache = getQueryResultCache()
+    if cache:
+        gauges += [("searchapi_query_cache_" + key, {}, value) for key, value in cache.stats().items() if isinstance(value, (int, float))]
+    if translationProvider:
+        stats = translationProvider.stats()
+        gauges += [("searchapi_translation_" + key, {}, value) for key, value in stats.items() if isinstance(value, (int, float))]
+        gauges += [("searchapi_translation_cache_" + key, {}, value) for key, value in stats.get("cache", {}).items()]
+    luisStats = LuisProvider.luisClient.stats() if LuisProvider.luisClient else None
+    if luisStats:
+        gauges += [("searchapi_luis_" + key, {}, value) for key, value in luisStats.items() if isinstance(value, (int, float))]
+        gauges += [("searchapi_luis_breaker_open", {}, 1 if luisStats["breaker"]["state"] == "open" else 0)]
+    gauges += [("searchapi_telemetry_" + key, {}, value) for key, value in loggerInstance.getTelemetryStats().items()]
+    return gauges
+metrics.registerCollector(collectServiceMetrics)
+
+# Called by the entry point once its config is loaded, returns the app for WSGI handlers.
+# Products are brought up in the background so the process can answer liveness probes meanwhile.
+def startService():
+    global startupOrchestrator
+    with startupLock:
+        if not startupOrchestrator:
+            startupOrchestrator = StartupOrchestrator(getAllProductIds(resourceConfig), loggerInstance)
+            startupOrchestrator.start(watch=app.config['MODEL_SYNC_ENABLED'])
+    return app
+
+# For hosts that serve SearchModule.app directly, without waiting for startup to finish
+@app.before_request
+def ensureStarted():
+    if not startupOrchestrator:
+        startService()
 
 @app.route('/healthping')
 @cross_origin()
 def healthPing():
     return ("I am alive!", 200)
 
+@app.route('/health/live')
+def healthLive():
+    return ("Alive", 200)
+
+@app.route('/health/ready')
+def healthReady():
+    status = startupOrchestrator.status() if startupOrchestrator else {"ready": False, "settled": False, "products": {}}
+    return (json.dumps(status), 200 if status["ready"] else 503, {"Content-Type": "application/json"})
+
 @app.route('/queryDetectors', methods=["POST"])
 @cross_origin()
 @authProvider()
@@ -96,41 +201,60 @@ def healthPing():
 def queryDetectorsMethod():
     data = json.loads(request.data.decode('utf-8'))
     requestId = data['requestId']
-
-    try:
-        txt_data = translator.translate(urllib.parse.unquote(data['text'])).text
-    except Exception as e:
-        if 'text' in data:
-            loggerInstance.logHandledException(requestId, Exception(f"Failed to translate the query -> {str(e)}. Querystring: {data['text']}"))
-            txt_data = urllib.parse.unquote(data['text'])
-        else:
-            return ("Parameter with name 'text' was not provided in the request", 400)
-    original_query = txt_data
-    if (len(original_query)>250):
-        return ("Query length exceeded the maximum limit of 250", 400)
-    txt_data = " ".join(txt_data.split()) # remove extra whitespaces
-    if (not txt_data) or len(txt_data)<2:
-        return ("Minimum query length is 2", 400)
+    if not 'text' in data:
+        return ("Parameter with name 'text' was not provided in the request", 400)
+    # Invalid input is rejected before it can cause a model load, the translated text is checked again below
+    untranslated = urllib.parse.unquote(data['text'])
+    speculativeQuery, error = validateQuery(untranslated)
+    if error:
+        return error
     productid = getProductId(data)
     if not productid:
         return (f'Resource not supported in search. Request data: {json.dumps(data)}', 404)
     productid = productid[0]
+    g.productId = productid
     try:
-        loadModel(productid)
+        model = useModel(productid)
     except Exception as e:
         loggerInstance.logHandledException(requestId, e)
-        return (json.dumps({"query_received": original_query, "query": txt_data, "data": data, "results": [], "exception": str(e)}), 404)
-    results = loaded_models[productid].queryDetectors(txt_data)
-    try:
-        results["luis_results"] = getLuisPredictions(txt_data, productid)
-    except Exception as e:
+        return (json.dumps({"query_received": data['text'], "query": data['text'], "data": data, "results": [], "exception": str(e)}), 404)
+
+    # Translation, LUIS and the local search run concurrently. Search and LUIS start on the untranslated
+    # text, which is what we end up using when the query is already english or translation doesn't finish.
+    pipeline = RequestPipeline()
+    translator = getTranslationProvider()
+    txt_data, source = translator.lookup(untranslated)
+    if txt_data is not None:
+        pipeline.record("translation", source)
+        speculativeQuery = None
+    else:
+        pipeline.submit("translation", translator.translate, untranslated)
+        submitSearch(pipeline, model, productid, speculativeQuery)
+        txt_data = pipeline.result("translation", app.config.get('TRANSLATION_TIMEOUT', 2), default=untranslated)
+        if pipeline.status["translation"] != "completed":
+            loggerInstance.logHandledException(requestId, Exception(f"Failed to translate the query -> {pipeline.errors['translation']}. Querystring: {data['text']}"))
+    original_query = txt_data
+    txt_data, error = validateQuery(txt_data)
+    if error:
+        return error
+    if txt_data != speculativeQuery:
+        submitSearch(pipeline, model, productid, txt_data)
+    results = pipeline.result("search")
+    if results is None:
+        results = {"query": txt_data, "results": [], "exception": pipeline.errors["search"]}
+    if pipeline.status["luis"] == "skipped":
         results["luis_results"] = []
-        results["luis_exception"] = f"LUISProviderError: {str(e)}"
+    else:
+        results["luis_results"] = pipeline.result("luis", app.config.get('LUIS_TIMEOUT', 3), default=[])
+        if pipeline.status["luis"] != "completed":
+            results["luis_exception"] = f"LUISProviderError: {pipeline.errors['luis']}"
     results = mergeLuisResults(results)
     logObject = results
     logObject["productId"] = productid
-    logObject["modelId"] = loaded_models[productid].trainingId
-    res = json.dumps(logObject)
+    logObject["modelId"] = model.trainingId
+    logObject["dependencies"] = pipeline.status
+    with metrics.stage("serialization"):
+        res = json.dumps(logObject)
     return (res, 200)
 
 @app.route('/queryMultiple', methods=["POST"])
@@ -145,14 +269,15 @@ def queryMultipleMethod():
     if not productid:
         return ('Resource data not available', 404)
     productid = productid[0]
+    g.productId = productid
     try:
-        loadModel(productid)
+        model = useModel(productid)
     except Exception as e:
         loggerInstance.logHandledException(requestId, e)
         loggerInstance.logToFile(requestId, e)
         return (json.dumps({"query": txts, "results": [], "exception": str(e)}), 404)
     
-    res = json.dumps([loaded_models[productid].queryDetectors(txt_data) for txt_data in txts])
+    res = json.dumps(model.queryDetectorsBatch(txts))
     return (res, 200)
 
 @app.route('/queryUtterances', methods=["POST"])
@@ -173,10 +298,10 @@ def queryUtterancesMethod():
     if not productid:
         return (f'Resource type product data not available. Request data: {json.dumps(data)}', 404)
     results = {"query": txt_data, "results": []}
+    g.productId = ",".join(productid)
     for product in productid:
         try:
-            loadModel(product)
-            res = loaded_models[product].queryUtterances(txt_data, existing_utterances)
+            res = useModel(product).queryUtterances(txt_data, existing_utterances)
         except Exception as e:
             loggerInstance.logHandledException(requestId, e)
             res = {"query": txt_data, "results": None, "exception": str(e)}
@@ -194,6 +319,37 @@ def freeModelMethod():
     freeModel(productid)
     return ('', 204)
 
+@app.route('/modelStats')
+@cross_origin()
+@authProvider()
+def modelStatsMethod():
+    return (json.dumps(loaded_models.stats()), 200)
+
+@app.route('/queryCacheStats')
+@cross_origin()
+@authProvider()
+def queryCacheStatsMethod():
+    cache = getQueryResultCache()
+    return (json.dumps(cache.stats() if cache else {}), 200)
+
+@app.route('/translationStats')
+@cross_origin()
+@authProvider()
+def translationStatsMethod():
+    return (json.dumps(getTranslationProvider().stats()), 200)
+
+@app.route('/luisStats')
+@cross_origin()
+@authProvider()
+def luisStatsMethod():
+    return (json.dumps(getLuisClient().stats()), 200)
+
+@app.route('/metrics')
+@cross_origin()
+@authProvider()
+def metricsMethod():
+    return (metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"})
+
 @app.route('/refreshModel', methods=["GET"])
 @cross_origin()
 @authProvider()
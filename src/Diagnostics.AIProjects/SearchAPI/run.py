@@ -1,4 +1,6 @@
 from SearchModule import app
 app.config.from_object("AppConfig.DevelopmentConfig")
+from SearchModule.views import startService
+startService()
 if __name__ == "__main__":
     app.run("localhost", port=8010, threaded=True)
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Pre-fork production server. The master process loads and warms every model, then forks
+workers that share the listening socket and inherit the loaded models copy-on-write.
+Model sync runs in the master only; after a model changes the workers are replaced one
+at a time so they pick up the new models from the master.
+"""
+import os, sys, gc, time, signal, select, argparse, threading
+from werkzeug.serving import make_server
+from SearchModule import app
+from SearchModule.Logger import loggerInstance
+from SearchModule.Utilities import resourceConfig, getAllProductIds
+from SearchModule.TextSearchModule import refreshModel
+from SearchModule.StartupOrchestrator import StartupOrchestrator
+from SearchModule.StorageAccountHelper import StorageAccountHelper
+from SearchModule.ResultCache import serveSharedCache
+import SearchModule.TextSearchModule as TextSearchModule
+import SearchModule.views
+
+modelSyncInterval = 5*60
+telemetryFlushTimeout = 5
+
+# Moves everything allocated so far out of the collector's reach, so collections in the workers
+# don't write to the shared pages. Only available from Python 3.7.
+def freezeHeap():
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+class PreforkServer:
+    def __init__(self, host, port, workers, threaded=False):
+        self.host = host
+        self.port = port
+        self.numWorkers = workers
+        self.threaded = threaded
+        self.workers = []
+        self.running = True
+        self.server = None
+        self.cacheManager = None
+        self.modelWatcher = None
+        self.productIds = list(set(getAllProductIds(resourceConfig)))
+
+    def start(self):
+        if app.config.get("QUERY_CACHE_ENABLED", True) and app.config.get("QUERY_CACHE_ADDRESS", None):
+            try:
+                self.cacheManager = serveSharedCache(app.config["QUERY_CACHE_ADDRESS"], app.config.get("QUERY_CACHE_AUTHKEY", None), app.config.get("QUERY_CACHE_SIZE", 4096), app.config.get("QUERY_CACHE_TTL", 3600))
+            except Exception as e:
+                loggerInstance.logHandledException("preforkServer", Exception(f"Failed to start shared query cache, workers will use their own: {str(e)}"))
+                app.config["QUERY_CACHE_ADDRESS"] = None
+        if app.config["MODEL_SYNC_ENABLED"]:
+            self.modelWatcher = StorageAccountHelper(loggerInstance)
+            self.modelWatcher.connect(self.productIds)
+        # Workers inherit the warm models along with the readiness reported on /health/ready
+        SearchModule.views.startupOrchestrator = StartupOrchestrator(self.productIds, loggerInstance, self.modelWatcher)
+        SearchModule.views.startupOrchestrator.prepare()
+        self.server = make_server(self.host, self.port, app, threaded=self.threaded)
+        self.refreshReader, self.refreshWriter = os.pipe()
+        freezeHeap()
+        for i in range(self.numWorkers):
+            self.workers.append(self.spawnWorker())
+        loggerInstance.logInsights(f"Search service started {self.numWorkers} workers on {self.host}:{self.port}")
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.run()
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def spawnWorker(self):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.runWorker()
+            finally:
+                # os._exit skips the atexit handlers, events still queued by the worker would be lost
+                try:
+                    loggerInstance.flushTelemetry(telemetryFlushTimeout)
+                finally:
+                    os._exit(0)
+        return pid
+
+    def runWorker(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=self.server.shutdown).start())
+        os.close(self.refreshReader)
+        app.config["MODEL_SYNC_ENABLED"] = False
+        TextSearchModule.refreshDelegate = self.requestRefresh
+        self.server.serve_forever()
+
+    # Runs in a worker, the master does the refresh and then replaces the workers
+    def requestRefresh(self, productId):
+        os.write(self.refreshWriter, (productId.strip() + "\n").encode())
+        return "Model refresh scheduled"
+
+    def run(self):
+        nextSync = time.time() + modelSyncInterval
+        pending = b""
+        while self.running:
+            self.replaceDeadWorkers()
+            try:
+                ready = select.select([self.refreshReader], [], [], 1)[0]
+            except InterruptedError:
+                continue
+            changed = []
+            if ready:
+                pending += os.read(self.refreshReader, 4096)
+                lines = pending.split(b"\n")
+                pending = lines[-1]
+                for productId in set([x.decode() for x in lines[:-1] if x]):
+                    if refreshModel(productId).startswith("Model Refreshed"):
+                        changed.append(productId)
+            if self.modelWatcher and time.time() >= nextSync:
+                changed += self.modelWatcher.syncModels(self.productIds)
+                nextSync = time.time() + modelSyncInterval
+            if changed:
+                loggerInstance.logInsights(f"Models changed for {','.join(set(changed))}. Restarting workers.")
+                freezeHeap()
+                self.restartWorkers()
+        self.shutdown()
+
+    def replaceDeadWorkers(self):
+        for i, pid in enumerate(self.workers):
+            try:
+                exited, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                exited = pid
+            if exited == pid and self.running:
+                loggerInstance.logHandledException("preforkServer", Exception(f"Worker {pid} exited unexpectedly. Starting a new one."))
+                self.workers[i] = self.spawnWorker()
+
+    # Rolling restart, a worker is replaced only after its replacement is listening
+    def restartWorkers(self):
+        for i, pid in enumerate(list(self.workers)):
+            self.workers[i] = self.spawnWorker()
+            self.stopWorker(pid)
+
+    def stopWorker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+    def shutdown(self):
+        for pid in self.workers:
+            self.stopWorker(pid)
+        if self.cacheManager:
+            self.cacheManager.shutdown()
+        self.server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-fork search service")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", 8010)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threaded", action="store_true", help="Serve requests on threads inside every worker")
+    parser.add_argument("--dev", action="store_true", help="Use the development configuration from appconfig.json")
+    args = parser.parse_args()
+    if args.dev:
+        app.config.from_object("AppConfig.DevelopmentConfig")
+    if not hasattr(os, "fork"):
+        loggerInstance.logInsights("Pre-fork serving needs os.fork, falling back to the threaded development server")
+        SearchModule.views.startService()
+        app.run(args.host, port=args.port, threaded=True)
+        sys.exit(0)
+    PreforkServer(args.host, args.port, args.workers, args.threaded).start()
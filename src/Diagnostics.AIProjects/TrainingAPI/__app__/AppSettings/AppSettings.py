@@ -1,5 +1,6 @@
 import json
 from __app__.TrainingModule import logHandler
+import os
 from os import environ
 class AppSettings:
     def __init__(self):
@@ -22,4 +23,8 @@ class AppSettings:
         self.DETECTORS_APP_RESOURCE = config.get("DETECTORS_APP_RESOURCE", None)
         self.WORD2VEC_PATH = config.get("WORD2VEC_PATH", "word2vec")
         self.WORD2VEC_MODEL_NAME = config.get("WORD2VEC_MODEL_NAME", "w2vModel.bin")
+        self.WORD2VEC_CACHE_PATH = config.get("WORD2VEC_CACHE_PATH", os.path.join(self.MODEL_DATA_PATH, "word2vec-cache"))
+        self.MODEL_ARTIFACT_COMPRESSION = config.get("MODEL_ARTIFACT_COMPRESSION", None)
+        self.WMD_EMD_WORKERS = int(config.get("WMD_EMD_WORKERS", os.cpu_count() or 1))
+        self.MODEL_TEST_TIME_BUDGET = float(config.get("MODEL_TEST_TIME_BUDGET", 600))
 appSettings = AppSettings()
\ No newline at end of file
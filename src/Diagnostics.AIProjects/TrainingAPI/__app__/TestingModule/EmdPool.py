@@ -0,0 +1,149 @@
+import os, time, shutil, atexit, weakref, tempfile, threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pyemd import emd
+from __app__.AppSettings.AppSettings import appSettings
+
+maxChunkSize = 16
+
+# Same computation as gensim 3.7's KeyedVectors.wmdistance, including the order words get their ids in, so the
+# distances match the in-process ones exactly. Both documents only hold words that have a vector.
+def wmdistance(document1, document2, vectorOf):
+    if not document1 or not document2:
+        return float('inf')
+    token2id = {}
+    for document in (document1, document2):
+        for token in sorted(set(document) - set(token2id)):
+            token2id[token] = len(token2id)
+    vocabLen = len(token2id)
+    if vocabLen == 1:
+        return 0.0
+    docset1, docset2 = set(document1), set(document2)
+    items = sorted(token2id.items(), key=lambda x: x[1])
+    distanceMatrix = np.zeros((vocabLen, vocabLen), dtype=np.double)
+    for t1, i in items:
+        if t1 not in docset1:
+            continue
+        for t2, j in items:
+            if t2 not in docset2 or distanceMatrix[i, j] != 0.0:
+                continue
+            distanceMatrix[i, j] = distanceMatrix[j, i] = np.sqrt(np.sum((vectorOf(t1) - vectorOf(t2))**2))
+    if np.sum(distanceMatrix) == 0.0:
+        return float('inf')
+    def nbow(document):
+        d = np.zeros(vocabLen, dtype=np.double)
+        for token in document:
+            d[token2id[token]] += 1
+        return d/float(len(document))
+    return emd(nbow(document1), nbow(document2), distanceMatrix)
+
+#### Worker side, every worker maps the shared files of an index once and keeps them ####
+workerIndexes = {}
+
+def openSharedIndex(path):
+    if path not in workerIndexes:
+        words = [str(x) for x in np.load(os.path.join(path, "words.npy"))]
+        workerIndexes[path] = {
+            "wordIds": dict([(word, i) for i, word in enumerate(words)]),
+            "words": words,
+            # Plain arrays over the mapped pages, numpy's memmap subclass is slow to slice row by row
+            "vectors": np.asarray(np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")),
+            "tokens": np.asarray(np.load(os.path.join(path, "tokens.npy"), mmap_mode="r")),
+            "offsets": np.asarray(np.load(os.path.join(path, "offsets.npy"), mmap_mode="r"))
+        }
+    return workerIndexes[path]
+
+def scoreRows(path, rows, queryTokens, queryVectors):
+    index = openSharedIndex(path)
+    vectors, wordIds, words, tokens, offsets = index["vectors"], index["wordIds"], index["words"], index["tokens"], index["offsets"]
+    vectorOf = lambda token: queryVectors[token] if token in queryVectors else vectors[wordIds[token]]
+    distances = []
+    for row in rows:
+        document = [words[i] for i in tokens[offsets[row]:offsets[row+1]].tolist()]
+        distances.append(wmdistance(document, queryTokens, vectorOf))
+    return distances
+
+#### Parent side ####
+# Writes the word vectors and tokens of a gensim WmdSimilarity index to files any pool's workers can map. They
+# only depend on the index, so pre-forked workers use the files of the master with their own pool.
+def shareIndex(index, owner):
+    path = tempfile.mkdtemp(prefix="wmd-")
+    vectors = index.w2v_model
+    wordIds = {}
+    tokens, offsets = [], [0]
+    for document in index.corpus:
+        tokens += [wordIds.setdefault(token, len(wordIds)) for token in document if token in vectors]
+        offsets.append(len(tokens))
+    words = list(wordIds)
+    np.save(os.path.join(path, "words.npy"), np.array(words if words else [""], dtype=str))
+    np.save(os.path.join(path, "vectors.npy"), np.array([vectors[word] for word in words], dtype=np.float32).reshape(len(words), vectors.vector_size))
+    np.save(os.path.join(path, "tokens.npy"), np.array(tokens, dtype=np.int32))
+    np.save(os.path.join(path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    weakref.finalize(owner, removeSharedIndex, path, os.getpid())
+    return path
+
+# Only the process that wrote the files removes them, a forked copy of the owner going away must not
+def removeSharedIndex(path, pid):
+    if os.getpid() == pid:
+        shutil.rmtree(path, True)
+
+# Exact EMD for candidate rows spread over a persistent process pool. The word vectors and tokens of an index are
+# written once to memory mapped files that all workers share, only the query travels with each task.
+class EmdPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.pid = os.getpid()
+        self.counters = {"tasks": 0, "rows": 0, "cancelled": 0, "deadlinesExceeded": 0}
+        self.lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    # Distances of the rows to the query, by row. Rows whose task didn't finish before the deadline are left out.
+    # Tasks are kept small so results keep coming in up to the deadline and a task that is already running when
+    # it passes, and can't be cancelled, doesn't hold its worker for long.
+    def distances(self, path, rows, queryTokens, queryVectors, deadline=None):
+        chunkSize = max(1, min(maxChunkSize, -(-len(rows)//self.workers)))
+        futures = {}
+        for i in range(0, len(rows), chunkSize):
+            chunk = [int(x) for x in rows[i:i+chunkSize]]
+            futures[self.executor.submit(scoreRows, path, chunk, queryTokens, queryVectors)] = chunk
+        results = {}
+        pending = set(futures)
+        while pending:
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                results.update(zip(futures[future], future.result()))
+            if pending and deadline is not None and time.time() >= deadline:
+                cancelled = sum([1 for future in pending if future.cancel()])
+                with self.lock:
+                    self.counters["cancelled"] += cancelled
+                    self.counters["deadlinesExceeded"] += 1
+                break
+        with self.lock:
+            self.counters["tasks"] += len(futures)
+            self.counters["rows"] += len(results)
+        return results
+
+    def shutdown(self):
+        if self.pid == os.getpid():
+            self.executor.shutdown(wait=False)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, workers=self.workers)
+
+emdPool = None
+emdPoolLock = threading.Lock()
+
+# One pool per process, kept across trainings so the workers are only started once. An executor inherited over
+# fork never runs the work submitted to it, so a forked process gets a new pool.
+def getEmdPool():
+    global emdPool
+    workers = appSettings.WMD_EMD_WORKERS
+    if not workers:
+        return None
+    with emdPoolLock:
+        if not emdPool or emdPool.pid != os.getpid():
+            emdPool = EmdPool(workers)
+    return emdPool
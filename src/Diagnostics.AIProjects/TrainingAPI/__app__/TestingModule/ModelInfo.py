@@ -4,4 +4,6 @@ class ModelInfo:
             modelInfo = {}
         self.detectorContentSplitted = modelInfo.get("detectorContentSplitted", False)
         self.textNGrams = modelInfo.get("textNGrams", 1)
-        self.splitDictionary = modelInfo.get("splitDictionary", False)
\ No newline at end of file
+        self.splitDictionary = modelInfo.get("splitDictionary", False)
+        self.modelType = modelInfo.get("modelType", "TfIdfSearchModel")
+        self.embeddings = modelInfo.get("embeddings", False)
\ No newline at end of file
@@ -11,7 +11,11 @@ class TestCase:
             raise Exception("Please provide at least one expected result.")
     
     def run(self, model, threshold=0.5):
-        results = [res["detector"].lower() for res in model.queryDetectors(self.query)["results"] if float(res["score"])>=0.3]
+        self.evaluate(model.queryDetectors(self.query), threshold)
+
+    # Checks the expected detectors against a result of queryDetectors for this query
+    def evaluate(self, queryResult, threshold=0.5):
+        results = [res["detector"].lower() for res in queryResult["results"] if float(res["score"])>=0.3]
         self.results = results
         numpassed = 0
         for result in self.expectedResults:
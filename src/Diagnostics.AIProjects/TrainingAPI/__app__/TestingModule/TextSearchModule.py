@@ -1,12 +1,16 @@
-import os, gc
+import os, gc, time
 from __app__.TrainingModule import logHandler
 import json
 from __app__.TestingModule.ModelInfo import ModelInfo
+from __app__.TestingModule.RetrievalEngine import topK, topKFiltered, DetectorSegments
+from __app__.TestingModule.WmdEngine import PrunedWmdIndex, loadEmbeddings
+from __app__.TestingModule.EmdPool import getEmdPool
 from __app__.TrainingModule.TokenizerModule import *
 from __app__.AppSettings.AppSettings import appSettings
 
 from gensim.models import TfidfModel
 from gensim import corpora, similarities
+from gensim.similarities import WmdSimilarity
 
 SITE_ROOT = os.getcwd()
 logHandler.info("SITE_ROOT: {0}".format(SITE_ROOT))
@@ -37,6 +41,17 @@ packageFileNames = {
 
 optionalFiles = ["mappingsFile", "modelInfo", "dictionaryFile", "dictionaryFile1", "dictionaryFile2"]
 
+wmdPackageFileNames = {
+    "m1IndexFile": "m1.index",
+    "detectorsFile": "Detectors.json",
+    "mappingsFile": "Mappings.json",
+    "modelInfo": "ModelInfo.json",
+    "embeddingsFile": "embeddings.npy",
+    "embeddingsWordsFile": "embeddings.words.npy"
+}
+
+wmdOptionalFiles = ["mappingsFile", "embeddingsFile", "embeddingsWordsFile"]
+
 #### Text Search model for Queries ####
 def verifyFile(filename, prelogMessage=""):
     try:
@@ -53,7 +68,7 @@ class TextSearchModel:
         for key in packageFiles.keys():
             packageFiles[key] = absPath(os.path.join(modelpackagepath, packageFiles[key]))
         self.packageFiles = packageFiles
-        self.models = {"dictionary": None, "dictionary1": None, "dictionary2": None, "m1Model": None, "m1Index": None, "m2Model": None, "m2Index": None, "detectors": None, "sampleUtterances": None, "mappings": None, "modelInfo": None}
+        self.models = {"dictionary": None, "dictionary1": None, "dictionary2": None, "m1Model": None, "m1Index": None, "m2Model": None, "m2Index": None, "detectors": None, "sampleUtterances": None, "mappings": None, "detectorSegments": None, "modelInfo": None}
         try:
             with open(self.packageFiles["modelInfo"], "r") as fp:
                 self.models["modelInfo"] = ModelInfo(json.loads(fp.read()))
@@ -101,6 +116,7 @@ class TextSearchModel:
                     f.close()
             except:
                 raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["mappingsFile"])
+            self.models["detectorSegments"] = DetectorSegments(self.models["mappings"], len(self.models["m1Index"]))
         try:
             with open(self.packageFiles["sampleUtterancesFile"], "r") as f:
                 self.models["sampleUtterances"] = json.loads(f.read())
@@ -111,11 +127,7 @@ class TextSearchModel:
             raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["sampleUtterancesFile"])
 
     def getDetectorByIndex(self, index):
-        detector = [x for x in self.models["mappings"] if (x["startindex"] <= index <= x["endindex"])]
-        if detector and detector[0]:
-            return detector[0]["id"]
-        else:
-            return None
+        return self.models["detectorSegments"].detectorAt(index)
 
     def queryDetectors(self, query=None):
         if query:
@@ -123,14 +135,10 @@ class TextSearchModel:
                 doc2bow = self.models["dictionary1"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams)) if self.models["modelInfo"].splitDictionary else self.models["dictionary"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams))
                 vector = self.models["m1Model"][doc2bow]
                 if self.models["modelInfo"].detectorContentSplitted:    
-                    similar_doc_indices = sorted(enumerate(self.models["m1Index"][vector]), key=lambda item: -item[1])[:10]
-                    similar_docs = []
-                    for x in similar_doc_indices:
-                        detector = self.getDetectorByIndex(x[0])
-                        if detector and (not (detector in [p["detector"] for p in similar_docs])):
-                            similar_docs.append({"detector": self.getDetectorByIndex(x[0]), "score": str(x[1])})
+                    detectorScores = self.models["detectorSegments"].aggregate(self.models["m1Index"][vector])
+                    similar_docs = list(map(lambda x: {"detector": self.models["detectorSegments"].detectorIds[x[0]], "score": str(x[1])}, zip(*topK(detectorScores, 10))))
                 else:
-                    similar_doc_indices = sorted(enumerate(self.models["m1Index"][vector]), key=lambda item: -item[1])
+                    similar_doc_indices = zip(*topK(self.models["m1Index"][vector]))
                     similar_docs = list(map(lambda x: {"detector": self.models["detectors"][x[0]]["id"], "score": str(x[1])}, similar_doc_indices))
                 return {"query": query, "results": similar_docs}
             except Exception as e:
@@ -157,8 +165,7 @@ class TextSearchModel:
             try:
                 doc2bow = self.models["dictionary2"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams)) if self.models["modelInfo"].splitDictionary else self.models["dictionary"].doc2bow(getAllNGrams(query, self.models["modelInfo"].textNGrams))
                 vector = self.models["m2Model"][doc2bow]
-                similar_doc_indices = sorted(enumerate(self.models["m2Index"][vector]), key=lambda item: -item[1])
-                similar_doc_indices = [x for x in similar_doc_indices if self.models["sampleUtterances"][x[0]]["text"].lower() not in existing_utterances][:10]
+                similar_doc_indices = zip(*topKFiltered(self.models["m2Index"][vector], 10, lambda i: self.models["sampleUtterances"][i]["text"].lower() not in existing_utterances))
                 similar_docs = list(map(lambda x: {"sampleUtterance": self.models["sampleUtterances"][x[0]], "score": str(x[1])}, similar_doc_indices))
                 return {"query": query, "results": similar_docs}
             except Exception as e:
@@ -167,25 +174,115 @@ class TextSearchModel:
         return None
     
     def runTestCases(self, testCases, passThreshold=0.5, publishThreshold=0.95):
-        numpassed = 0
-        failedTestCases = []
         for testCase in testCases:
             testCase.run(self, passThreshold)
-            if testCase.isPassed:
-                numpassed += 1
-        logHandler.info("Total test cases: {0}".format(len(testCases)))
-        logHandler.info("Passed test cases: {0}".format(numpassed))
-        logHandler.info("Failed test case details:\n{0}".format("\n".join(["{0}\t\t{1}".format(testCase.query, ",".join(testCase.failDetails)) for testCase in testCases if not testCase.isPassed])))
-        if numpassed/len(testCases)>publishThreshold:
-            return True
-        return False
+        return checkTestResults(testCases, publishThreshold)
+
+def checkTestResults(testCases, publishThreshold=0.95):
+    numpassed = len([testCase for testCase in testCases if testCase.isPassed])
+    logHandler.info("Total test cases: {0}".format(len(testCases)))
+    logHandler.info("Passed test cases: {0}".format(numpassed))
+    logHandler.info("Failed test case details:\n{0}".format("\n".join(["{0}\t\t{1}".format(testCase.query, ",".join(testCase.failDetails)) for testCase in testCases if not testCase.isPassed])))
+    if numpassed/len(testCases)>publishThreshold:
+        return True
+    return False
+
+#### WMD model for Queries, detectors only ####
+detectorsTopK = 10
+detectorsThreshold = 0.30
+
+# Scores like the search service's WmdSearchModel: rows are scored in order of a cheap lower bound on their
+# distance until the top 10 is settled, with the exact distances spread over the EMD worker pool
+class WmdSearchModel:
+    def __init__(self, modelpackagepath, packageFiles):
+        for key in packageFiles.keys():
+            packageFiles[key] = absPath(os.path.join(modelpackagepath, packageFiles[key]))
+        self.packageFiles = packageFiles
+        self.models = {"m1Index": None, "detectors": None, "mappings": None, "detectorSegments": None, "modelInfo": None}
+        try:
+            with open(self.packageFiles["modelInfo"], "r") as fp:
+                self.models["modelInfo"] = ModelInfo(json.loads(fp.read()))
+                fp.close()
+        except:
+            self.models["modelInfo"] = ModelInfo({})
+        try:
+            self.models["m1Index"] = WmdSimilarity.load(self.packageFiles["m1IndexFile"])
+        except:
+            raise ModelFileLoadFailed("Failed to load index from file " + self.packageFiles["m1IndexFile"])
+        if self.models["modelInfo"].embeddings:
+            try:
+                self.models["m1Index"].w2v_model = loadEmbeddings(self.packageFiles["embeddingsWordsFile"], self.packageFiles["embeddingsFile"])
+            except:
+                raise ModelFileLoadFailed("Failed to load embeddings from file " + self.packageFiles["embeddingsFile"])
+        try:
+            with open(self.packageFiles["detectorsFile"], "r") as f:
+                self.models["detectors"] = json.loads(f.read())
+                f.close()
+        except:
+            raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["detectorsFile"])
+        if self.models["modelInfo"].detectorContentSplitted:
+            try:
+                with open(self.packageFiles["mappingsFile"], "r") as f:
+                    self.models["mappings"] = json.loads(f.read())
+                    f.close()
+            except:
+                raise ModelFileLoadFailed("Failed to parse json from file " + self.packageFiles["mappingsFile"])
+            self.models["detectorSegments"] = DetectorSegments(self.models["mappings"], len(self.models["m1Index"]))
+        self.engine = PrunedWmdIndex(self.models["m1Index"], getEmdPool if appSettings.WMD_EMD_WORKERS else None)
+
+    def getDetectorIds(self):
+        if self.models["modelInfo"].detectorContentSplitted:
+            return self.models["detectorSegments"].detectorIds
+        return [x["id"] for x in self.models["detectors"]]
+
+    # Queries left when the deadline passes get no results, so they count as failed test cases
+    def queryDetectorsBatch(self, queries, deadline=None):
+        detectorIds = self.getDetectorIds()
+        aggregate = self.models["detectorSegments"].aggregate if self.models["modelInfo"].detectorContentSplitted else None
+        results = []
+        for query in queries:
+            if deadline is not None and time.time() >= deadline:
+                results.append({"query": query, "results": [], "exception": "Test time budget exceeded"})
+                continue
+            try:
+                tokens = getAllNGrams(query, self.models["modelInfo"].textNGrams, lemmatize=False)
+                sims = self.engine.similarities(tokens, detectorsTopK, detectorsThreshold, aggregate=aggregate, deadline=deadline)
+                detectorScores = aggregate(sims) if aggregate else sims
+                similar_docs = list(map(lambda x: {"detector": detectorIds[x[0]], "score": str(x[1])}, zip(*topK(detectorScores, detectorsTopK, detectorsThreshold))))
+                results.append({"query": query, "results": similar_docs})
+            except Exception as e:
+                results.append({"query": query, "results": [], "exception": str(e)})
+        return results
+
+    def queryDetectors(self, query=None):
+        if query:
+            return self.queryDetectorsBatch([query])[0]
+        return None
+
+    # Every distinct query is scored once, the batch stops at the deadline given by MODEL_TEST_TIME_BUDGET
+    def runTestCases(self, testCases, passThreshold=0.5, publishThreshold=0.95):
+        startTime = time.time()
+        queries = list(dict.fromkeys([testCase.query for testCase in testCases]))
+        results = dict(zip(queries, self.queryDetectorsBatch(queries, startTime + appSettings.MODEL_TEST_TIME_BUDGET)))
+        for testCase in testCases:
+            testCase.evaluate(results[testCase.query], passThreshold)
+        skipped = len([x for x in results.values() if x.get("exception", None)])
+        logHandler.info("Scored {0} distinct test queries in {1:.1f}s, {2} failed or exceeded the time budget, engine stats {3}".format(len(queries), time.time() - startTime, skipped, json.dumps(self.engine.stats())))
+        return checkTestResults(testCases, publishThreshold)
 
 def loadModel(productid):
     modelpackagepath = os.path.join(appSettings.MODEL_DATA_PATH, os.path.normpath(productid))
     logHandler.info("TextSearchModule: Loading model for product {0}: Loading from folder {1}".format(productid, modelpackagepath))
     if not os.path.isdir(absPath(modelpackagepath)):
         logHandler.info("TextSearchModule: Loading model for product {0}: Could not find model folder.".format(productid))
-    if not all([verifyFile(os.path.join(modelpackagepath, packageFileNames[x])) for x in packageFileNames.keys() if x not in optionalFiles]):
+    modelInfo = ModelInfo({})
+    try:
+        with open(absPath(os.path.join(modelpackagepath, packageFileNames["modelInfo"])), "r") as fp:
+            modelInfo = ModelInfo(json.loads(fp.read()))
+    except:
+        pass
+    modelClass, fileNames, optional = (WmdSearchModel, wmdPackageFileNames, wmdOptionalFiles) if modelInfo.modelType == "WmdSearchModel" else (TextSearchModel, packageFileNames, optionalFiles)
+    if not all([verifyFile(os.path.join(modelpackagepath, fileNames[x])) for x in fileNames.keys() if x not in optional]):
         logHandler.error("modelLoadTask: TextSearchModule: Loading model for product {0}: {1}".format(productid, "One or more of model file(s) are missing"))
         raise FileNotFoundError("One or more of model file(s) are missing")
-    return TextSearchModel(modelpackagepath, dict(packageFileNames))
\ No newline at end of file
+    return modelClass(modelpackagepath, dict(fileNames))
\ No newline at end of file
@@ -0,0 +1,154 @@
+import time, threading
+import numpy as np
+from scipy import sparse
+from gensim.models import KeyedVectors
+from gensim.models.keyedvectors import Vocab
+from __app__.TestingModule.EmdPool import shareIndex
+
+# KeyedVectors over the embeddings saved with a WMD package, float16 vectors are widened to float32
+def loadEmbeddings(wordsFile, vectorsFile):
+    words = [str(x) for x in np.load(wordsFile)]
+    vectors = np.load(vectorsFile, mmap_mode='r')
+    if vectors.dtype != np.float32:
+        vectors = vectors.astype(np.float32)
+    embeddings = KeyedVectors(vectors.shape[1])
+    embeddings.vectors = vectors
+    embeddings.index2word = words
+    embeddings.vocab = dict([(word, Vocab(index=i, count=len(words)-i)) for i, word in enumerate(words)])
+    return embeddings
+
+# Exact top-k Word Mover's Distance search over a gensim WmdSimilarity index. Every row gets a cheap lower bound
+# on its distance to the query, the larger of the word centroid distance and the relaxed WMD, and rows are scored
+# with the exact EMD in order of that bound until no remaining row can still reach the top k. Rows that are never
+# scored are left at 0, which can't change the rows selected by topK/topKFiltered or the detector aggregation.
+# With getPool, the exact distances of each block of rows are computed by the worker processes of the EmdPool it
+# returns. It's called on every query since the pool belongs to the process asking, not the one that built the index.
+class PrunedWmdIndex:
+    def __init__(self, index, getPool=None):
+        self.index = index
+        self.vectors = index.w2v_model
+        self.corpus = index.corpus
+        # Normalized bag of words of every row over the in-vocabulary words, the same weights gensim's wmdistance uses
+        wordIds = {}
+        indptr, indices, weights = [0], [], []
+        for document in self.corpus:
+            tokens = [token for token in document if token in self.vectors]
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                indices.append(wordIds.setdefault(token, len(wordIds)))
+                weights.append(count/float(len(tokens)))
+            indptr.append(len(indices))
+        self.embeddings = np.array([self.vectors[word] for word in wordIds], dtype=np.float64).reshape(len(wordIds), self.vectors.vector_size)
+        self.squaredNorms = (self.embeddings**2).sum(axis=1)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.bows = sparse.csr_matrix((np.array(weights, dtype=np.float64), self.indices, self.indptr), shape=(len(self.corpus), len(wordIds)))
+        self.empty = np.diff(self.indptr) == 0
+        self.starts = self.indptr[:-1][~self.empty]
+        self.centroids = self.bows.dot(self.embeddings)
+        self.counters = {"queries": 0, "rows": 0, "exact": 0, "deadlinesExceeded": 0}
+        self.lock = threading.Lock()
+        self.getPool = getPool
+        self.sharedPath = shareIndex(index, self) if getPool else None
+
+    def __len__(self):
+        return len(self.corpus)
+
+    # Lower bound of the WMD between the query and every row, None when no query word has an embedding
+    def lowerBounds(self, queryTokens):
+        tokens = [token for token in queryTokens if token in self.vectors]
+        if not tokens:
+            return None
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        queryWeights = np.array([count/float(len(tokens)) for count in counts.values()], dtype=np.float64)
+        queryVectors = np.array([self.vectors[token] for token in counts], dtype=np.float64)
+        # Euclidean distance from every query word to every corpus word
+        distances = (queryVectors**2).sum(axis=1)[:, None] + self.squaredNorms[None, :] - 2*queryVectors.dot(self.embeddings.T)
+        distances = np.sqrt(np.maximum(distances, 0))
+        centroidDistance = np.linalg.norm(self.centroids - queryWeights.dot(queryVectors), axis=1)
+        # Relaxed WMD: every word moves all of its weight to its nearest word on the other side
+        toQuery = self.bows.dot(distances.min(axis=0))
+        toRow = np.zeros(len(self.corpus))
+        if len(self.starts):
+            for i in range(len(queryWeights)):
+                toRow[~self.empty] += queryWeights[i]*np.minimum.reduceat(distances[i, self.indices], self.starts)
+        bounds = np.maximum(centroidDistance, np.maximum(toQuery, toRow))
+        # Slack for the rounding of the float32 word distances used by the exact computation
+        bounds = np.maximum(bounds - (1e-5 + 1e-6*bounds), 0)
+        bounds[self.empty] = np.inf
+        return bounds
+
+    def similarity(self, row, queryTokens):
+        return 1./(1. + self.vectors.wmdistance(self.corpus[row], queryTokens))
+
+    # Similarities of the rows by row, without the rows that couldn't be scored before the deadline
+    def score(self, rows, queryTokens, deadline=None, pool=None):
+        if pool:
+            tokens = [token for token in queryTokens if token in self.vectors]
+            queryVectors = dict([(token, self.vectors[token]) for token in set(tokens)])
+            distances = pool.distances(self.sharedPath, rows, tokens, queryVectors, deadline)
+            return dict([(row, 1./(1. + distance)) for row, distance in distances.items()])
+        scores = {}
+        for row in rows:
+            if deadline is not None and time.time() >= deadline:
+                break
+            scores[row] = self.similarity(row, queryTokens)
+        return scores
+
+    # Same values as index[queryTokens] for every row that can be in the top k, 0 for the rest.
+    # threshold skips rows that can't score above it, keep(row) limits the top k to the rows it accepts, and
+    # aggregate(similarities) maps row scores to the scores actually ranked, e.g. the maximum per detector.
+    # Past the deadline (a time.time() value) scoring stops and the best rows scored so far are returned.
+    def similarities(self, queryTokens, k, threshold=None, keep=None, aggregate=None, deadline=None):
+        similarities = np.zeros(len(self.corpus))
+        bounds = self.lowerBounds(queryTokens)
+        computed = 0
+        exceeded = False
+        pool = self.getPool() if self.getPool else None
+        if bounds is not None:
+            upperBounds = 1./(1. + bounds)
+            order = np.argsort(bounds, kind="stable")
+            if threshold is not None:
+                order = order[upperBounds[order] > threshold]
+            block = max(k, 8, 2*pool.workers if pool else 0)
+            while computed < len(order):
+                rows = order[computed:computed+block]
+                scores = self.score(rows, queryTokens, deadline, pool)
+                for row, similarity in scores.items():
+                    similarities[row] = similarity
+                if len(scores) < len(rows):
+                    computed += len(scores)
+                    exceeded = True
+                    break
+                computed += len(rows)
+                block = min(block*2, max(256, block))
+                if computed < len(order):
+                    kth = self.kthScore(similarities, order[:computed], k, keep, aggregate)
+                    if kth is not None and upperBounds[order[computed]] < kth:
+                        break
+        with self.lock:
+            self.counters["queries"] += 1
+            self.counters["rows"] += len(self.corpus)
+            self.counters["exact"] += computed
+            self.counters["deadlinesExceeded"] += int(exceeded)
+        return similarities
+
+    # k-th best score among the rows scored so far, None while fewer than k rows qualify
+    def kthScore(self, similarities, computedRows, k, keep=None, aggregate=None):
+        if aggregate:
+            scores = np.asarray(aggregate(similarities)).ravel()
+        elif keep:
+            scores = similarities[[row for row in computedRows if keep(row)]]
+        else:
+            scores = similarities[computedRows]
+        if len(scores) < k:
+            return None
+        return np.partition(scores, len(scores)-k)[len(scores)-k]
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
@@ -7,6 +7,7 @@ from __app__.TestingModule.TestSchema import TestCase
 from __app__.TrainingModule.TfIdfTrainer import TfIdfTrainer
 from __app__.TrainingModule.WmdTrainer import WmdTrainer
 from __app__.TrainingModule.Exceptions import *
+from __app__.TrainingModule.Utilities import fileSha256, compressFile
 from __app__.AppSettings.AppSettings import appSettings
 
 class ModelTrainPublish:
@@ -50,9 +51,27 @@ class ModelTrainPublish:
         ts = int(str(time.time()).split(".")[0])
         try:
             sah = StorageAccountHelper.getInstance()
+            files = []
+            compression = appSettings.MODEL_ARTIFACT_COMPRESSION
             for fileName in os.listdir(os.path.join(datapath, self.productId)):
-                logHandler.info("Uploading {0} to {1}".format(os.path.join(datapath, self.productId, fileName), os.path.join(self.productId, "models", str(ts), fileName)))
-                await sah.uploadFile(os.path.join(datapath, self.productId, fileName), os.path.join(self.productId, "models", str(ts), fileName))
+                filePath = os.path.join(datapath, self.productId, fileName)
+                entry = {"name": fileName, "size": os.path.getsize(filePath), "sha256": fileSha256(filePath), "blob": fileName, "compression": compression}
+                uploadPath = filePath
+                if compression:
+                    uploadPath = os.path.join(datapath, f"{self.productId}-{fileName}.compressed")
+                    entry["blob"] = fileName + compressFile(filePath, uploadPath, compression)
+                entry["blobSize"] = os.path.getsize(uploadPath)
+                blobName = "/".join([self.productId, "models", str(ts), entry["blob"]])
+                logHandler.info("Uploading {0} to {1}".format(filePath, blobName))
+                try:
+                    await sah.uploadFile(uploadPath, blobName)
+                finally:
+                    if uploadPath != filePath:
+                        os.remove(uploadPath)
+                files.append(entry)
+            # The manifest is written last so the model watchers only see a version once all of its files are uploaded
+            manifest = {"productId": self.productId, "version": str(ts), "trainingId": self.trainingId, "files": files}
+            await sah.uploadText(json.dumps(manifest), "/".join([self.productId, "latest.json"]))
         except Exception as e:
             logHandler.error("Publishing Exception: {0}".format(str(e)))
             raise PublishingException(str(e))
@@ -61,9 +80,7 @@ class ModelTrainPublish:
         hasTrained, syntheticTestCases = self.trainer.trainModel()
         if not hasTrained:
             return "Training was not needed"
-        tested = False
-        if not self.trainingConfig.modelType == "WmdSearchModel":
-            tested = self.testModelForSearch(syntheticTestCases)
+        tested = self.testModelForSearch(syntheticTestCases)
         if tested:
             await self.publishModels()
         else:
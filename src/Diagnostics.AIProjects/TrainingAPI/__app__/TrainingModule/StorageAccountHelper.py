@@ -3,6 +3,7 @@ from __app__.TrainingModule import logHandler
 from azure.storage.blob import BlobServiceClient
 #from azure.common import AzureMissingResourceHttpError
 from __app__.AppSettings.AppSettings import appSettings
+from __app__.TrainingModule.Utilities import decompressBytes
 
 class StorageAccountHelper:
 	__instance = None
@@ -27,18 +28,33 @@ class StorageAccountHelper:
 
 	def getLastModelDetectorsForProduct(self, productId):
 		containerClient = self.blob_service.get_container_client(container=appSettings.STORAGE_ACCOUNT_CONTAINER_NAME)
-		allblobsList = [blob for blob in list(containerClient.list_blobs()) if blob.name.startswith("{0}/models".format(productId))]
-		if not len(allblobsList)>0:
+		detectorsBlob, compression = self.getLatestDetectorsBlob(containerClient, productId)
+		if not detectorsBlob:
 			return None
+		blobClient = containerClient.get_blob_client(detectorsBlob)
+		blob_data = blobClient.download_blob().readall()
+		return json.loads(decompressBytes(blob_data, compression))
+
+	# Detectors.json of the latest published version and its compression, from the manifest when there is one
+	def getLatestDetectorsBlob(self, containerClient, productId):
+		try:
+			manifest = json.loads(containerClient.get_blob_client("{0}/latest.json".format(productId)).download_blob().readall())
+			for entry in manifest.get("files", []):
+				if entry["name"].lower() == "detectors.json":
+					return "/".join([productId, "models", manifest["version"], entry.get("blob", entry["name"])]), entry.get("compression", None)
+		except Exception as e:
+			logHandler.info("No model manifest for {0}, looking for the latest model folder: {1}".format(productId, str(e)))
+		allblobsList = list(containerClient.list_blobs(name_starts_with="{0}/models/".format(productId)))
+		if not len(allblobsList)>0:
+			return None, None
 		folders = list(set([int(blob.name.split("/")[2]) for blob in allblobsList]))
 		latestFolder = str(max(folders))
-		latestFolderFiles = [blob.name for blob in allblobsList if latestFolder in blob.name]
-		detectorsFile = [blobname for blobname in latestFolderFiles if "detectors.json" in blobname.lower()]
-		if not detectorsFile:
-			return None
-		blobClient = containerClient.get_blob_client(detectorsFile[0])
-		blob_data = blobClient.download_blob().readall()
-		return json.loads(blob_data)
+		latestFolderFiles = [blob.name for blob in allblobsList if blob.name.split("/")[2] == latestFolder]
+		for suffix, compression in [("", None), (".gz", "gzip"), (".zst", "zstd")]:
+			detectorsFile = [blobname for blobname in latestFolderFiles if blobname.split("/")[-1].lower() == "detectors.json" + suffix]
+			if detectorsFile:
+				return detectorsFile[0], compression
+		return None, None
 
 	def downloadFile(self, blobname, destpath=None):
 		writepath = os.path.join(appSettings.MODEL_DATA_PATH, os.path.normpath('/'.join(blobname.split("/")[:-1])))
@@ -65,4 +81,8 @@ class StorageAccountHelper:
 		blobClient = self.blob_service.get_blob_client(container=appSettings.STORAGE_ACCOUNT_CONTAINER_NAME, blob=destfilepath)
 		with open(srcfilepath, "rb") as data:
 			blobClient.upload_blob(data)
-		#self.blob_service.create_blob_from_path(appSettings.STORAGE_ACCOUNT_CONTAINER_NAME, destfilepath, srcfilepath)
\ No newline at end of file
+		#self.blob_service.create_blob_from_path(appSettings.STORAGE_ACCOUNT_CONTAINER_NAME, destfilepath, srcfilepath)
+
+	async def uploadText(self, text, destfilepath):
+		blobClient = self.blob_service.get_blob_client(container=appSettings.STORAGE_ACCOUNT_CONTAINER_NAME, blob=destfilepath)
+		blobClient.upload_blob(text, overwrite=True)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os, json, shutil
+import numpy as np
 from __app__.TrainingModule import logHandler
 from gensim.models import TfidfModel
 from gensim import corpora, similarities
@@ -15,6 +16,7 @@ class TfIdfTrainer:
         self.trainingId = trainingId
         self.productId = productId
         self.trainingConfig = trainingConfig
+        self.indexTypes = {}
     
     def trainDictionary(self, alltokens, outfile, trimDict=False):
         dictionary = corpora.Dictionary(alltokens)
@@ -23,7 +25,40 @@ class TfIdfTrainer:
             dictionary.filter_extremes(no_below=2, no_above=0.3, keep_n=min([500, int(len(dictionary)/2)]))
             logHandler.info(f"Trimmed dictionary from {oldSize} features to {len(dictionary)} features")
         dictionary.save(outfile)
+        self.saveDictionaryArrays(dictionary, outfile)
     
+    # Plain .npy copies of the token -> id table and idf weights, loaded memory mapped by the search service
+    def saveDictionaryArrays(self, dictionary, outfile):
+        prefix = os.path.splitext(outfile)[0]
+        tokens = sorted(dictionary.token2id.keys())
+        np.save(prefix + ".tokens.npy", np.array(tokens, dtype=str))
+        np.save(prefix + ".ids.npy", np.array([dictionary.token2id[token] for token in tokens], dtype=np.int64))
+
+    def saveIdfArray(self, model, numFeatures, outfile):
+        idfs = np.zeros(max([numFeatures] + [termid+1 for termid in model.idfs.keys()]), dtype=np.float64)
+        for termid, idf in model.idfs.items():
+            idfs[termid] = idf
+        np.save(outfile, idfs)
+    
+    # Dense docs x features index, or a sparse one when the dense matrix would be large and mostly zeros.
+    # The sparse matrix is stored column wise so a query only reads the columns of its own features.
+    def trainIndex(self, vectors, numFeatures, outfile):
+        numDocs = len(vectors)
+        nnz = sum([len(x) for x in vectors])
+        density = nnz/float(max(1, numDocs*numFeatures))
+        denseSize = 4*numDocs*numFeatures
+        indexType = self.trainingConfig.indexType
+        if indexType == "auto":
+            indexType = "sparse" if density <= self.trainingConfig.sparseIndexMaxDensity and denseSize >= self.trainingConfig.sparseIndexMinSize else "dense"
+        if indexType == "sparse":
+            index = similarities.SparseMatrixSimilarity(vectors, num_features=numFeatures, num_docs=numDocs, num_nnz=nnz)
+            index.index = index.index.tocsc()
+        else:
+            index = similarities.MatrixSimilarity(vectors)
+        index.save(outfile, separately=["index"])
+        logHandler.info(f"IndexTrainer: Saved {indexType} index of {numDocs} documents and {numFeatures} features with density {density:.5f} to {outfile}")
+        return indexType
+
     def trainModelM1(self, detector_tokens, outpath):
         if self.trainingConfig.splitDictionary:
             dictionary = corpora.Dictionary.load(os.path.join(outpath, "dictionary1.dict"))
@@ -31,9 +66,9 @@ class TfIdfTrainer:
             dictionary = corpora.Dictionary.load(os.path.join(outpath, "dictionary.dict"))
         corpus = [dictionary.doc2bow(line) for line in detector_tokens]
         model = TfidfModel(corpus)
-        index = similarities.MatrixSimilarity(model[corpus])
         model.save(os.path.join(outpath, "m1.model"))
-        index.save(os.path.join(outpath, "m1.index"))
+        self.indexTypes["m1"] = self.trainIndex(list(model[corpus]), len(dictionary), os.path.join(outpath, "m1.index"))
+        self.saveIdfArray(model, len(dictionary), os.path.join(outpath, "m1.idf.npy"))
     
     def trainModelM2(self, sampleUtterances_tokens, outpath):
         if self.trainingConfig.splitDictionary:
@@ -42,9 +77,9 @@ class TfIdfTrainer:
             dictionary = corpora.Dictionary.load(os.path.join(outpath, "dictionary.dict"))
         corpus = [dictionary.doc2bow(line) for line in sampleUtterances_tokens]
         model = TfidfModel(corpus)
-        index = similarities.MatrixSimilarity(model[corpus])
         model.save(os.path.join(outpath, "m2.model"))
-        index.save(os.path.join(outpath, "m2.index"))
+        self.indexTypes["m2"] = self.trainIndex(list(model[corpus]), len(dictionary), os.path.join(outpath, "m2.index"))
+        self.saveIdfArray(model, len(dictionary), os.path.join(outpath, "m2.idf.npy"))
     
     def prepareSyntheticTestCases(self, detectors):
         syntheticTestCases = []
@@ -143,6 +178,6 @@ class TfIdfTrainer:
         open(os.path.join(outpath, "trainingId.txt"), "w").write(str(self.trainingId))
         open(os.path.join(outpath, "Detectors.json"), "w").write(json.dumps(detectors))
         open(os.path.join(outpath, "SampleUtterances.json"), "w").write(json.dumps(sampleUtterances))
-        modelInfo = {"splitDictionary": self.trainingConfig.splitDictionary, "detectorContentSplitted": self.trainingConfig.detectorContentSplitted, "textNGrams": self.trainingConfig.textNGrams, "modelType": self.trainingConfig.modelType}
+        modelInfo = {"splitDictionary": self.trainingConfig.splitDictionary, "detectorContentSplitted": self.trainingConfig.detectorContentSplitted, "textNGrams": self.trainingConfig.textNGrams, "modelType": self.trainingConfig.modelType, "mmapArrays": True, "indexTypes": self.indexTypes}
         open(os.path.join(outpath, "ModelInfo.json"), "w").write(json.dumps(modelInfo))
         return True, syntheticTestCases
\ No newline at end of file
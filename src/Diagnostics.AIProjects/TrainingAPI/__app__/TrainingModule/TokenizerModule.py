@@ -1,6 +1,6 @@
 import nltk
 from nltk import ngrams
-import itertools
+from functools import lru_cache
 from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 import re
@@ -19,16 +19,35 @@ except LookupError:
     nltk.download('wordnet')
 
 lemmatizer = WordNetLemmatizer()
-stop = stopwords.words('english')
+stop = frozenset(stopwords.words('english'))
+specialCharsPattern = re.compile(specialChars)
+plainText = re.compile(r'[0-9a-z \t\n\r\f\v]*')
+# The only Treebank rules that can fire on text made of plain words
+contractions = {"cannot": ["can", "not"], "gimme": ["gim", "me"], "gonna": ["gon", "na"], "gotta": ["got", "ta"], "lemme": ["lem", "me"], "wanna": ["wan", "na"]}
+
+@lru_cache(maxsize=100000)
+def lemmatizeWord(word):
+    return lemmatizer.lemmatize(word)
+
+# Same tokens as nltk.word_tokenize, plain lowercase words skip the sentence splitter and regex passes
+def wordTokenize(txt):
+    if plainText.fullmatch(txt):
+        tokens = []
+        for word in txt.split():
+            tokens += contractions.get(word, [word])
+        return tokens
+    return nltk.word_tokenize(txt)
 
 def tokenize_text(txt, lemmatize=True):
-    return [lemmatizer.lemmatize(word) if lemmatize else word for word in nltk.word_tokenize(txt.lower()) if word not in stop]
+    return [lemmatizeWord(word) if lemmatize else word for word in wordTokenize(txt.lower()) if word not in stop]
 
 def getNGrams(sentence, n, lemmatize=True):
     return [' '.join(list(x)) for x in ngrams(tokenize_text(sentence, lemmatize), n)]
 
+# Tokenizes once and emits the 1-grams up to n-grams in the same order as one getNGrams call per n
 def getAllNGrams(sentence, n=1, lemmatize=True):
     if not sentence:
         return []
-    sentence = " ".join(re.sub(specialChars, " ", sentence).split())
-    return list(itertools.chain.from_iterable([getNGrams(sentence, i, lemmatize) for i in range(1, min([n, len(sentence.split())])+1)]))
\ No newline at end of file
+    sentence = " ".join(specialCharsPattern.sub(" ", sentence).split())
+    tokens = tokenize_text(sentence, lemmatize)
+    return [' '.join(tokens[j:j+i]) for i in range(1, min([n, len(sentence.split())])+1) for j in range(len(tokens)-i+1)]
\ No newline at end of file
@@ -17,6 +17,11 @@ class TrainingConfig:
 		self.splitDictionary = trainingConfig.get("splitDictionary", False)
 		self.trainDetectors = trainingConfig.get("trainDetectors", False)
 		self.trainUtterances = trainingConfig.get("trainUtterances", False)
+		self.embeddingVocabularyHead = trainingConfig.get("embeddingVocabularyHead", 20000)
+		self.embeddingPrecision = trainingConfig.get("embeddingPrecision", "float32")
+		self.indexType = trainingConfig.get("indexType", "auto")
+		self.sparseIndexMaxDensity = trainingConfig.get("sparseIndexMaxDensity", 0.05)
+		self.sparseIndexMinSize = trainingConfig.get("sparseIndexMinSize", 1 << 20)
 
 		self.modelType = trainingConfig.get("modelType", "TfIdfSearchModel")
 		self.blockOnMissingTestCases = trainingConfig.get("blockOnMissingTestCases", False)
\ No newline at end of file
@@ -1,4 +1,4 @@
-import os
+import os, io, gzip, shutil, hashlib
 
 def cleanFolder(folderPath):
     for f in os.listdir(folderPath):
@@ -10,4 +10,35 @@ def compareDetectorSets(set1, set2):
         set2 = sorted([{k:x[k] for k in ["id", "name", "description", "utterances"]} for x in set2], key=lambda p: p["id"])
         return set1 == set2
     else:
-        return False
\ No newline at end of file
+        return False
+
+def fileSha256(filePath):
+    digest = hashlib.sha256()
+    with open(filePath, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Compressed copy of a model file for publishing, returns the extension added to the blob name
+def compressFile(srcPath, destPath, compression):
+    if compression == "gzip":
+        with open(srcPath, "rb") as src, gzip.open(destPath, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        return ".gz"
+    if compression == "zstd":
+        import zstandard
+        with open(srcPath, "rb") as src, open(destPath, "wb") as dst:
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+        return ".zst"
+    raise ValueError(f"Unsupported compression {compression}")
+
+# Content of a model file published with compressFile
+def decompressBytes(data, compression):
+    if not compression:
+        return data
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+    raise ValueError(f"Unsupported compression {compression}")
@@ -2,6 +2,7 @@ import os, json, shutil
 from __app__.TrainingModule import logHandler
 import numpy as np
 import gensim
+from gensim.models.keyedvectors import Vocab
 from gensim.similarities import WmdSimilarity
 from gensim import corpora
 from __app__.TrainingModule.TokenizerModule import getAllNGrams
@@ -13,20 +14,70 @@ from __app__.AppSettings.AppSettings import appSettings
 from __app__.TrainingModule.Exceptions import *
 from __app__.TrainingModule.Utilities import cleanFolder
 
+w2vLimit = 20000
+
+# KeyedVectors over an array of vectors and the words of its rows, without copying the array
+def keyedVectorsFromArrays(words, vectors):
+    w2vModel = gensim.models.KeyedVectors(vectors.shape[1])
+    w2vModel.vectors = vectors
+    w2vModel.index2word = list(words)
+    w2vModel.vocab = dict([(word, Vocab(index=i, count=len(words)-i)) for i, word in enumerate(words)])
+    return w2vModel
+
 class WmdTrainer:
     def __init__(self, trainingId, productId, trainingConfig):
         self.trainingId = trainingId
         self.productId = productId
         self.trainingConfig = trainingConfig
-        self.w2vModel = gensim.models.KeyedVectors.load_word2vec_format(os.path.join(appSettings.WORD2VEC_PATH, appSettings.WORD2VEC_MODEL_NAME), binary=True, limit=20000)
-    
+        self.w2vModel = self.loadWord2Vec(os.path.join(appSettings.WORD2VEC_PATH, appSettings.WORD2VEC_MODEL_NAME), w2vLimit)
+
+    # The word2vec binary is converted once into normalized vectors in a .npy file and a word list, later
+    # trainings on the same instance map those instead of parsing the binary again
+    def loadWord2Vec(self, sourcePath, limit):
+        stat = os.stat(sourcePath)
+        cachePrefix = os.path.join(appSettings.WORD2VEC_CACHE_PATH, "{0}-{1}-{2}-{3}".format(os.path.basename(sourcePath), stat.st_size, int(stat.st_mtime), limit))
+        try:
+            words = [str(x) for x in np.load(cachePrefix + ".words.npy")]
+            vectors = np.load(cachePrefix + ".vectors.npy", mmap_mode="r")
+            logHandler.info("Word2VecCache: Loaded {0} word vectors from {1}".format(len(words), cachePrefix))
+            return keyedVectorsFromArrays(words, vectors)
+        except Exception:
+            pass
+        w2vModel = gensim.models.KeyedVectors.load_word2vec_format(sourcePath, binary=True, limit=limit)
+        # Same normalization WmdSimilarity applies, done once so the indices can use the vectors as they are
+        w2vModel.init_sims(replace=True)
+        try:
+            os.makedirs(appSettings.WORD2VEC_CACHE_PATH, exist_ok=True)
+            # Written under temporary names and moved in place, the vectors last, so a cut off write is never loaded
+            for suffix, array in [(".words.npy", np.array(w2vModel.index2word, dtype=str)), (".vectors.npy", np.asarray(w2vModel.vectors, dtype=np.float32))]:
+                with open(cachePrefix + suffix + ".tmp", "wb") as fp:
+                    np.save(fp, array)
+                os.replace(cachePrefix + suffix + ".tmp", cachePrefix + suffix)
+            logHandler.info("Word2VecCache: Cached {0} word vectors to {1}".format(len(w2vModel.index2word), cachePrefix))
+        except Exception as e:
+            logHandler.warning("Word2VecCache: Failed to cache word vectors: {0}".format(str(e)))
+        return w2vModel
+
+    # The word vectors are left out of the pickled indices, both share the embeddings saved by saveEmbeddings
     def trainModelM1(self, detector_tokens, outpath):
-        index = WmdSimilarity(detector_tokens, self.w2vModel)
-        index.save(os.path.join(outpath, "m1.index"))
+        index = WmdSimilarity(detector_tokens, self.w2vModel, normalize_w2v_and_replace=False)
+        index.save(os.path.join(outpath, "m1.index"), ignore=["w2v_model"])
     
     def trainModelM2(self, sampleUtterances_tokens, outpath):
-        index = WmdSimilarity(sampleUtterances_tokens, self.w2vModel)
-        index.save(os.path.join(outpath, "m2.index"))
+        index = WmdSimilarity(sampleUtterances_tokens, self.w2vModel, normalize_w2v_and_replace=False)
+        index.save(os.path.join(outpath, "m2.index"), ignore=["w2v_model"])
+
+    # Vectors of the words used by the indices and of the most frequent words, for the words of queries, as a
+    # memory mappable array with the words of its rows next to it
+    def saveEmbeddings(self, tokenLists, outpath):
+        rows = set(range(min(self.trainingConfig.embeddingVocabularyHead, len(self.w2vModel.index2word))))
+        for tokens in tokenLists:
+            for document in tokens:
+                rows.update([self.w2vModel.vocab[token].index for token in document if token in self.w2vModel.vocab])
+        rows = sorted(rows)
+        np.save(os.path.join(outpath, "embeddings.words.npy"), np.array([self.w2vModel.index2word[i] for i in rows], dtype=str))
+        np.save(os.path.join(outpath, "embeddings.npy"), np.asarray(self.w2vModel.vectors[rows], dtype=self.trainingConfig.embeddingPrecision))
+        logHandler.info("EmbeddingsPackager: Saved {0} of {1} word vectors as {2}".format(len(rows), len(self.w2vModel.index2word), self.trainingConfig.embeddingPrecision))
     
     def prepareSyntheticTestCases(self, detectors):
         syntheticTestCases = []
@@ -110,10 +161,15 @@ class WmdTrainer:
             except Exception as e:
                 logHandler.error("[ERROR]ModelM2Trainer: " + str(e))
                 raise TrainingException("ModelM2Trainer: " + str(e))
+        try:
+            self.saveEmbeddings([detector_tokens, sampleUtterances_tokens], outpath)
+        except Exception as e:
+            logHandler.error("[ERROR]EmbeddingsPackager: " + str(e))
+            raise TrainingException("EmbeddingsPackager: " + str(e))
         # Save data files and configuration files
         open(os.path.join(outpath, "trainingId.txt"), "w").write(str(self.trainingId))
         open(os.path.join(outpath, "Detectors.json"), "w").write(json.dumps(detectors))
         open(os.path.join(outpath, "SampleUtterances.json"), "w").write(json.dumps(sampleUtterances))
-        modelInfo = {"detectorContentSplitted": self.trainingConfig.detectorContentSplitted, "textNGrams": self.trainingConfig.textNGrams, "modelType": self.trainingConfig.modelType}
+        modelInfo = {"detectorContentSplitted": self.trainingConfig.detectorContentSplitted, "textNGrams": self.trainingConfig.textNGrams, "modelType": self.trainingConfig.modelType, "embeddings": True}
         open(os.path.join(outpath, "ModelInfo.json"), "w").write(json.dumps(modelInfo))
-        return syntheticTestCases
\ No newline at end of file
+        return True, syntheticTestCases
\ No newline at end of file